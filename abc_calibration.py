@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+# Calibrate the simulator parameters to a CLDF dataset by approximate Bayesian
+# computation with sequential Monte Carlo (ABC-SMC, Beaumont et al. 2009).
+#
+# The dataset is reduced to a few summary statistics: the mean and standard
+# deviation of the number of cognate classes per meaning and of the proportion
+# of languages in the largest class, and the mean TIGER rate. All parameters of
+# a model are calibrated jointly. The first generation of particles is drawn
+# from the prior; every later generation perturbs particles of the previous
+# one and keeps those whose simulated summaries lie within a shrinking
+# distance of the observed ones, with importance weights correcting for the
+# perturbation. Every prior is uniform on a linear or logarithmic scale, so the
+# particles are handled on that scale, where the prior density is constant.
+# Simulations are run in batches of particles in a pool of processes. The
+# simulators take a single parameter set, so the particles of a batch are
+# simulated one after another; each dataset is simulated in column chunks and
+# summarised with array operations.
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+
+import numpy as np
+import scipy.special
+import scipy.stats
+
+import cldf
+import tiger
+
+PARSER_DESC = "Calibrate simulator parameters to a CLDF dataset with ABC-SMC."
+MISSING = "?"
+# Name, lower and upper bound and whether the prior is uniform on a log scale
+PRIORS = {"swamp": (("alpha", 0.01, 10.0, True),
+                    ("count_n", 0.5, 50.0, True),
+                    ("count_p", 0.05, 0.95, False)),
+          "chain": (("alpha", 0.01, 10.0, True),
+                    ("count_n", 0.5, 50.0, True),
+                    ("count_p", 0.05, 0.95, False)),
+          "tree": (("birth_rate", 0.01, 100.0, True),
+                   ("gamma", 0.1, 10.0, True))}
+SUMMARIES = ("classes_mean", "classes_sd", "max_prop_mean", "max_prop_sd", "tiger_mean")
+N_TREES = 1000 # seeds are reused modulo this, so every tree stays in the tree cache of DolloSimulator
+MIN_ACCEPTANCE = 0.01
+
+def summarise(matrix):
+    '''Return the summary statistics of a (taxa x characters) matrix of cognate classes numbered 0, 1, ... within every character, with UNKNOWN for missing data. Characters without known states are left out.'''
+    matrix = np.asarray(matrix, dtype=np.int64)
+    n_taxa, n_chars = matrix.shape
+    known = matrix != tiger.UNKNOWN
+    # Class sizes of all characters at once, with every character's classes offset into its own row
+    index = (matrix + np.arange(n_chars) * n_taxa)[known]
+    sizes = np.bincount(index, minlength=n_taxa * n_chars).reshape(n_chars, n_taxa)
+    totals = sizes.sum(axis=1)
+    coded = totals > 0
+    classes = (sizes[coded] > 0).sum(axis=1)
+    max_props = sizes[coded].max(axis=1) / totals[coded]
+    rates = tiger.calculate_rates(matrix[:, coded])
+    return np.array([classes.mean(), classes.std(), max_props.mean(), max_props.std(), rates.mean()])
+
+def observed_summaries(cldf_path, excluded_taxa=(), strategy="minimum"):
+    '''Return the summary statistics of a CLDF dataset, its number of taxa and its number of meanings with cognate-coded forms.'''
+    store = cldf.load(cldf_path)
+    matrix = store.resolve_synonyms(strategy, excluded_taxa)
+    taxa, _, characters = tiger.read_harvest(cldf.harvest_lines(store, matrix, excluded_taxa, MISSING), MISSING)
+    characters = characters[:, (characters != tiger.UNKNOWN).any(axis=0)]
+    return summarise(characters), len(taxa), characters.shape[1]
+
+def to_parameters(model, u):
+    '''Return the parameter values of a point on the prior scale.'''
+    return [10 ** x if log else x for x, (_, _, _, log) in zip(u, PRIORS[model])]
+
+def prior_bounds(model):
+    '''Return the lower and upper bounds of the priors of model on their own scale.'''
+    bounds = np.array([(math.log10(low), math.log10(high)) if log else (low, high)
+                       for _, low, high, log in PRIORS[model]])
+    return bounds[:, 0], bounds[:, 1]
+
+def make_simulator(model, params, n_taxa, n_features, seed):
+    # Imported here so that the simulators are only loaded in the processes which simulate
+    if model == "tree":
+        from dollo import DolloSimulator
+        simulator = DolloSimulator(n_taxa, n_features, params[0], params[1], 0.0, seed % N_TREES)
+        # The seed of the simulator also reset the global random state
+        np.random.seed(seed)
+        return simulator
+    from chain import ChainSimulator
+    from swamp import SwampSimulator
+    Simulator = SwampSimulator if model == "swamp" else ChainSimulator
+    return Simulator(n_taxa, n_features, params[0], scipy.stats.nbinom(params[1], params[2]))
+
+def simulate_batch(job):
+    '''Simulate a dataset for every point of a batch and return their summary statistics.'''
+    model, points, seeds, n_taxa, n_features = job
+    summaries = np.empty((len(points), len(SUMMARIES)))
+    for i, (u, seed) in enumerate(zip(points, seeds)):
+        random.seed(seed)
+        np.random.seed(seed)
+        simulator = make_simulator(model, to_parameters(model, u), n_taxa, n_features, seed)
+        _, _, chunks = simulator.generate_chunks(n_features)
+        summaries[i] = summarise(np.concatenate([block for _, block in chunks], axis=1))
+    return summaries
+
+class ABCSMC():
+    '''ABC-SMC calibration of one simulation model to observed summary statistics.'''
+
+    def __init__(self, model, observed, n_taxa, n_features, n_particles=500, quantile=0.5, seed=None):
+        self.model = model
+        self.observed = np.asarray(observed, dtype=float)
+        self.n_taxa = n_taxa
+        self.n_features = n_features
+        self.n_particles = n_particles
+        self.quantile = quantile # of the distances of a generation, giving the tolerance of the next
+        self.rng = np.random.RandomState(seed)
+        self.low, self.high = prior_bounds(model)
+        self.scales = None
+        self.simulations = 0
+
+    def simulate(self, pool, points, processes):
+        '''Return the summary statistics of datasets simulated at points, in batches shared out to the pool.'''
+        seeds = self.rng.randint(2**31, size=len(points)).tolist()
+        n_batches = min(len(points), processes * 4)
+        jobs = [(self.model, points[b::n_batches], seeds[b::n_batches], self.n_taxa, self.n_features)
+                for b in range(n_batches)]
+        summaries = np.empty((len(points), len(SUMMARIES)))
+        for b, batch in enumerate(pool.map(simulate_batch, jobs)):
+            summaries[b::n_batches] = batch
+        self.simulations += len(points)
+        return summaries
+
+    def distances(self, summaries):
+        '''Return the Euclidean distances of summaries from the observed summaries, on the scale of their spread under the prior.'''
+        return np.sqrt((((summaries - self.observed) / self.scales) ** 2).sum(axis=1))
+
+    def _kernel_weights(self, points, parents, weights, cov):
+        # Prior densities are constant inside the bounds, so a particle's weight
+        # is the reciprocal of its density under the perturbation of the previous generation
+        inverse = np.linalg.inv(cov)
+        diffs = points[:, None, :] - parents[None, :, :]
+        log_kernel = -0.5 * np.einsum("ijk,kl,ijl->ij", diffs, inverse, diffs)
+        log_weights = -scipy.special.logsumexp(log_kernel, b=weights, axis=1)
+        weights = np.exp(log_weights - log_weights.max())
+        return weights / weights.sum()
+
+    def run(self, generations=5, processes=1):
+        '''Run the generations and yield (generation, tolerance, acceptance rate, particles on the prior scale, weights, distances) of every generation.'''
+        n, dim = self.n_particles, len(self.low)
+        with multiprocessing.Pool(processes) as pool:
+            points = self.rng.uniform(self.low, self.high, (n, dim))
+            summaries = self.simulate(pool, points, processes)
+            # Summaries are scaled by their median absolute deviation under the prior
+            self.scales = np.median(np.abs(summaries - np.median(summaries, axis=0)), axis=0)
+            self.scales = np.where(self.scales > 0, self.scales, summaries.std(axis=0) + 1e-12)
+            distances = self.distances(summaries)
+            weights = np.full(n, 1.0 / n)
+            yield 0, math.inf, 1.0, points, weights, distances
+            for generation in range(1, generations):
+                tolerance = np.quantile(distances, self.quantile)
+                cov = 2 * np.atleast_2d(np.cov(points.T, aweights=weights))
+                accepted, accepted_distances = [], []
+                proposed = 0
+                rate = self.quantile
+                while sum(len(a) for a in accepted) < n:
+                    missing = n - sum(len(a) for a in accepted)
+                    size = min(int(math.ceil(missing / max(rate, MIN_ACCEPTANCE))), 10 * n)
+                    parents = self.rng.choice(n, size=size, p=weights)
+                    candidates = points[parents] + self.rng.multivariate_normal(np.zeros(dim), cov, size)
+                    candidates = candidates[((candidates >= self.low) & (candidates <= self.high)).all(axis=1)]
+                    if len(candidates) == 0:
+                        continue
+                    candidate_distances = self.distances(self.simulate(pool, candidates, processes))
+                    keep = candidate_distances <= tolerance
+                    accepted.append(candidates[keep])
+                    accepted_distances.append(candidate_distances[keep])
+                    proposed += size
+                    rate = sum(len(a) for a in accepted) / proposed
+                    if rate < MIN_ACCEPTANCE:
+                        break
+                if sum(len(a) for a in accepted) < n:
+                    print("Stopping at generation %d, acceptance rate %f" % (generation, rate))
+                    return
+                new_points = np.concatenate(accepted)[:n]
+                weights = self._kernel_weights(new_points, points, weights, cov)
+                points, distances = new_points, np.concatenate(accepted_distances)[:n]
+                yield generation, tolerance, rate, points, weights, distances
+
+def posterior_lines(model, results):
+    '''Return the lines of a table of the particles of every generation.'''
+    names = [name for name, _, _, _ in PRIORS[model]]
+    lines = ["generation\ttolerance\tacceptance\tweight\tdistance\t" + "\t".join(names) + "\n"]
+    for generation, tolerance, rate, points, weights, distances in results:
+        for u, weight, distance in zip(points, weights, distances):
+            lines.append("%d\t%f\t%f\t%g\t%f\t%s\n" % (generation, tolerance, rate, weight, distance,
+                                                      "\t".join("%g" % x for x in to_parameters(model, u))))
+    return lines
+
+def posterior_summary(model, points, weights):
+    '''Return the weighted mean and 95% interval of every parameter, as (name, mean, low, high).'''
+    values = np.array([to_parameters(model, u) for u in points])
+    order = np.argsort(values, axis=0)
+    summary = []
+    for j, (name, _, _, _) in enumerate(PRIORS[model]):
+        cdf = np.cumsum(weights[order[:, j]])
+        low, high = values[order[np.searchsorted(cdf, [0.025, 0.975]).clip(0, len(cdf) - 1), j], j]
+        summary.append((name, float(weights @ values[:, j]), float(low), float(high)))
+    return summary
+
+def main(cldf_path, outbase, models=("swamp", "chain", "tree"), excluded_taxa=(), n_particles=500,
+         generations=5, processes=1, seed=None):
+    observed, n_taxa, n_features = observed_summaries(cldf_path, excluded_taxa)
+    print("%d taxa, %d coded meanings, summaries %s" % (n_taxa, n_features, " ".join("%s=%f" % s for s in zip(SUMMARIES, observed))))
+    for model in models:
+        abc = ABCSMC(model, observed, n_taxa, n_features, n_particles, seed=seed)
+        results = []
+        for result in abc.run(generations, processes):
+            generation, tolerance, rate = result[:3]
+            print("%s generation %d: tolerance %f, acceptance rate %f, %d simulations in total" %
+                  (model, generation, tolerance, rate, abc.simulations))
+            results.append(result)
+        with open("%s_%s.tsv" % (outbase, model), "w") as fp:
+            fp.writelines(posterior_lines(model, results))
+        for name, mean, low, high in posterior_summary(model, results[-1][3], results[-1][4]):
+            print("%s %s: %g (%g-%g)" % (model, name, mean, low, high))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="in_file",
+                        help="CLDF folder to calibrate to",
+                        metavar='IN_FILE',
+                        type=str)
+
+    parser.add_argument("-o",
+                        dest="outbase",
+                        help="Base name of the output tables, one for every model",
+                        metavar='OUTBASE',
+                        default="abc_posterior",
+                        type=str)
+
+    parser.add_argument("-m",
+                        dest="models",
+                        help="Comma-separated list of models to calibrate (swamp, chain, tree)",
+                        metavar='MODELS',
+                        default="swamp,chain,tree",
+                        type=str)
+
+    parser.add_argument("-x",
+                        dest="excluded_taxa",
+                        help="Comma-separated list of taxa to exclude (wildcards allowed)",
+                        metavar='EXCLUDED_TAXA',
+                        default="",
+                        type=str)
+
+    parser.add_argument("-n",
+                        dest="particles",
+                        help="Number of particles",
+                        metavar='PARTICLES',
+                        default=500,
+                        type=int)
+
+    parser.add_argument("-g",
+                        dest="generations",
+                        help="Number of generations",
+                        metavar='GENERATIONS',
+                        default=5,
+                        type=int)
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of processes to simulate in",
+                        metavar='PROCESSES',
+                        default=os.cpu_count(),
+                        type=int)
+
+    parser.add_argument("-r",
+                        dest="seed",
+                        help="Random seed",
+                        metavar='SEED',
+                        default=None,
+                        type=int)
+
+    args = parser.parse_args()
+
+    models = [m for m in args.models.split(",") if m]
+    for m in models:
+        if m not in PRIORS:
+            print("Unknown model", m)
+            exit(1)
+    if not os.path.isdir(args.in_file):
+        print("Could not find folder", args.in_file)
+        exit(1)
+
+    excluded_taxa = [x for x in args.excluded_taxa.split(",") if x]
+    main(args.in_file, args.outbase, models, excluded_taxa, args.particles, args.generations, args.processes, args.seed)
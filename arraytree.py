@@ -0,0 +1,111 @@
+import numpy as np
+
+class ArrayTree():
+    '''Rooted binary tree stored as arrays indexed by node number. The root is
+    node 0 and has parent -1. Derived arrays give the preorder, the depth
+    (distance from root) of every node and the nodes grouped by generation,
+    so that simulations can work on whole levels of the tree at once.'''
+
+    def __init__(self, parent, edge_length, labels):
+        self.parent = np.asarray(parent, dtype=np.intp)
+        self.edge_length = np.asarray(edge_length, dtype=float)
+        self.labels = labels # dict of leaf node -> taxon label
+        self.n_nodes = len(self.parent)
+
+        self.children = np.full((self.n_nodes, 2), -1, dtype=np.intp)
+        n_children = np.zeros(self.n_nodes, dtype=np.intp)
+        for node in range(1, self.n_nodes):
+            p = self.parent[node]
+            self.children[p, n_children[p]] = node
+            n_children[p] += 1
+        self.is_leaf = n_children == 0
+
+        preorder = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            preorder.append(node)
+            stack.extend(c for c in self.children[node][::-1] if c >= 0)
+        self.preorder = np.array(preorder, dtype=np.intp)
+        self.position = np.empty(self.n_nodes, dtype=np.intp)
+        self.position[self.preorder] = np.arange(self.n_nodes)
+
+        self.depth = np.zeros(self.n_nodes)
+        self.level = np.zeros(self.n_nodes, dtype=np.intp)
+        for node in self.preorder[1:]:
+            self.depth[node] = self.depth[self.parent[node]] + self.edge_length[node]
+            self.level[node] = self.level[self.parent[node]] + 1
+        # Descendants of a node follow it contiguously in the preorder
+        self.subtree_size = np.ones(self.n_nodes, dtype=np.intp)
+        for node in self.preorder[:0:-1]:
+            self.subtree_size[self.parent[node]] += self.subtree_size[node]
+
+        self.leaves = self.preorder[self.is_leaf[self.preorder]]
+
+    def descendants(self, node):
+        '''Return the descendants of node (excluding node) in preorder.'''
+        start = self.position[node]
+        return self.preorder[start + 1:start + self.subtree_size[node]]
+
+    def ancestors(self, node):
+        '''Return the ancestors of node, nearest first.'''
+        nodes = []
+        node = self.parent[node]
+        while node >= 0:
+            nodes.append(node)
+            node = self.parent[node]
+        return nodes
+
+    def leaf_labels(self):
+        '''Return the taxon labels of the leaves in preorder.'''
+        return [self.labels[leaf] for leaf in self.leaves]
+
+    def to_dendropy(self):
+        '''Return the tree as a dendropy.Tree.'''
+        import dendropy
+        taxa = dendropy.TaxonNamespace(self.leaf_labels())
+        tree = dendropy.Tree(taxon_namespace=taxa, is_rooted=True)
+        nodes = {0: tree.seed_node}
+        tree.seed_node.edge.length = float(self.edge_length[0])
+        for node in self.preorder[1:]:
+            child = nodes[self.parent[node]].new_child(edge_length=float(self.edge_length[node]))
+            if self.is_leaf[node]:
+                child.taxon = taxa.get_taxon(self.labels[node])
+            nodes[node] = child
+        return tree
+
+    def write(self, filename, schema="newick"):
+        '''Write the tree to filename in a format supported by dendropy (e.g. newick or nexus).'''
+        self.to_dendropy().write(path=filename, schema=schema)
+
+def generate_yule_tree(n_taxa, birthrate, rng, names):
+    '''Generate a pure-birth tree with n_taxa leaves, using the random.Random
+    instance rng. Follows dendropy's birth_death_tree: every extant lineage
+    splits at rate birthrate and the process stops as soon as n_taxa lineages
+    exist. Leaves are labelled with a random permutation of names, padded
+    with T1, T2, ... if there are fewer names than leaves.'''
+    parent = [-1]
+    start = [0.0] # time at which each node's edge begins
+    end = [0.0]
+    extant = [0]
+    time = 0.0
+    while len(extant) < n_taxa:
+        time += rng.expovariate(len(extant) * birthrate)
+        k = rng.randrange(len(extant))
+        node = extant[k]
+        extant[k] = extant[-1]
+        extant.pop()
+        end[node] = time
+        for _ in range(2):
+            parent.append(node)
+            start.append(time)
+            end.append(time)
+            extant.append(len(parent) - 1)
+    for node in extant:
+        end[node] = time
+    edge_length = np.array(end) - np.array(start)
+
+    labels = list(names)[:n_taxa]
+    labels += ["T%d" % (i + 1) for i in range(n_taxa - len(labels))]
+    rng.shuffle(labels)
+    return ArrayTree(parent, edge_length, dict(zip(sorted(extant), labels)))
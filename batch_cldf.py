@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# Analyse a whole collection of CLDF wordlists.
+#
+# Every folder below the root which contains a CLDF dataset (a metadata file or
+# a forms.csv) is read into its cached cognate store and analysed in a worker
+# process: synonyms are resolved, taxa matching the dataset's exclusion
+# patterns are dropped, and TIGER rates, delta scores and Q-residuals are
+# calculated from the resulting harvest matrix. The per-dataset summaries are
+# written to a single table.
+
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import cldf
+import tiger
+from calculate_delta_and_q import harvest_to_matrix, phylogemetric
+
+PARSER_DESC = "Calculate TIGER rates, delta scores and Q-residuals for all CLDF datasets in a folder."
+MISSING = "?"
+MIN_TAXA = 4 # delta scores and Q-residuals are defined over quartets
+HEADER = "dataset\tpath\ttaxa\tcharacters\tcoded_characters\ttiger_mean\ttiger_sd\tdelta_mean\tqresidual_mean\n"
+
+def discover(root):
+    '''Return the folders below root which contain a CLDF dataset.'''
+    found = []
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != cldf.CACHE_FOLDER and not d.startswith("."))
+        if "forms.csv" in files or glob.glob(os.path.join(glob.escape(path), "*metadata.json")):
+            found.append(path)
+            # Datasets are not nested
+            dirs[:] = []
+    return found
+
+def dataset_name(path):
+    '''Return the name of the dataset in path. Lexibank datasets keep their CLDF data in a cldf subfolder, so that is named after its parent.'''
+    path = os.path.normpath(path)
+    if os.path.basename(path) == "cldf":
+        path = os.path.dirname(path)
+    return os.path.basename(path)
+
+def read_exclusions(filename):
+    '''Read a file of tab-separated dataset names and comma-separated taxon patterns. Returns a dict of dataset name -> list of patterns.'''
+    exclusions = {}
+    with open(filename, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, _, patterns = line.partition("\t")
+            exclusions.setdefault(name.strip(), []).extend(p for p in patterns.strip().split(",") if p)
+    return exclusions
+
+def analyse(job):
+    '''Analyse one dataset. Returns (name, line of the result table), or (name, None) and prints the reason if the dataset cannot be analysed.'''
+    name, path, excluded_taxa, strategy = job
+    try:
+        store = cldf.load(path)
+    except (ValueError, KeyError, OSError) as e:
+        print("Could not read %s: %s" % (path, e), file=sys.stderr)
+        return name, None
+    matrix = store.resolve_synonyms(strategy, excluded_taxa)
+    lines = cldf.harvest_lines(store, matrix, excluded_taxa, MISSING)
+    taxa, names, characters = tiger.read_harvest(lines, MISSING)
+    if len(taxa) < MIN_TAXA:
+        print("Skipping %s, only %d taxa left" % (path, len(taxa)), file=sys.stderr)
+        return name, None
+    rates = tiger.calculate_rates(characters)
+    coded = int((characters != tiger.UNKNOWN).any(axis=0).sum())
+    harvest = harvest_to_matrix(lines)
+    delta_score = phylogemetric.DeltaScoreMetric(harvest).score()
+    q_residual = phylogemetric.QResidualMetric(harvest).score()
+    line = "%s\t%s\t%d\t%d\t%d\t%f\t%f\t%f\t%f\n" % (name, path, len(taxa), len(names), coded,
+                                                    rates.mean(), rates.std(ddof=1),
+                                                    np.mean(list(delta_score.values())),
+                                                    np.mean(list(q_residual.values())))
+    return name, line
+
+def main(root, outfile, excluded_taxa=(), exclusions=None, strategy="minimum", processes=1):
+    '''Analyse every CLDF dataset below root and write the results to outfile. Taxa matching excluded_taxa are left out of every dataset, and those matching exclusions[name] out of dataset name.'''
+    if exclusions is None:
+        exclusions = {}
+    jobs = []
+    for path in discover(root):
+        name = dataset_name(path)
+        jobs.append((name, path, list(excluded_taxa) + exclusions.get(name, []), strategy))
+    print("Found %d datasets in %s" % (len(jobs), root))
+    results = []
+    with multiprocessing.Pool(processes) as pool:
+        for name, line in pool.imap(analyse, jobs):
+            if line is not None:
+                print("Analysed %s" % name)
+                results.append(line)
+    with open(outfile, "w") as fp:
+        fp.write(HEADER)
+        fp.writelines(results)
+    return len(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="root",
+                        help="Folder containing the CLDF datasets",
+                        metavar='ROOT',
+                        type=str)
+
+    parser.add_argument("-o",
+                        dest="outfile",
+                        help="Output table",
+                        metavar='OUTFILE',
+                        default="cldf_results.tsv",
+                        type=str)
+
+    parser.add_argument("-x",
+                        dest="excluded_taxa",
+                        help="Comma-separated list of taxa to exclude from every dataset (wildcards allowed)",
+                        metavar='EXCLUDED_TAXA',
+                        default="",
+                        type=str)
+
+    parser.add_argument("-e",
+                        dest="exclusions",
+                        help="File of dataset names and comma-separated taxa to exclude from them, separated by a tab",
+                        metavar='EXCLUSIONS',
+                        default=None,
+                        type=str)
+
+    parser.add_argument("-s",
+                        dest="synonym_strategy",
+                        help="Synonym resolution strategy (minimum or maximum)",
+                        metavar='STRATEGY',
+                        default="minimum",
+                        type=str)
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of datasets to analyse in parallel",
+                        metavar='PROCESSES',
+                        default=os.cpu_count(),
+                        type=int)
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print("Could not find folder", args.root)
+        exit(1)
+    if args.synonym_strategy not in ("minimum", "maximum"):
+        print("Unknown synonym strategy", args.synonym_strategy)
+        exit(1)
+    exclusions = {}
+    if args.exclusions is not None:
+        try:
+            exclusions = read_exclusions(args.exclusions)
+        except FileNotFoundError:
+            print("Could not find file", args.exclusions)
+            exit(1)
+
+    excluded_taxa = [x for x in args.excluded_taxa.split(",") if x]
+    main(args.root, args.outfile, excluded_taxa, exclusions, args.synonym_strategy, args.processes)
@@ -0,0 +1,111 @@
+# Bit-packed binary character matrices.
+#
+# Every multistate character (cognate set) is binarised into one presence /
+# absence column per state, as in the NEXUS files read by SplitsTree. Rows are
+# stored as numpy.packbits arrays together with a packed mask of the known
+# (non-missing) columns, so pairwise distances reduce to popcounts of XORed
+# bytes. A packed mask of the known characters gives the Hamming distances
+# between the multistate characters as well, for delta scores and Q-residuals.
+
+import numpy as np
+
+MISSING = "?"
+
+if hasattr(np, "bitwise_count"):
+    def popcount(x, axis=-1):
+        '''Return the number of set bits of the uint8 array x along axis.'''
+        return np.bitwise_count(x).sum(axis=axis, dtype=np.int64)
+else:
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(x, axis=-1):
+        '''Return the number of set bits of the uint8 array x along axis.'''
+        return _POPCOUNT[x].sum(axis=axis, dtype=np.int64)
+
+class BinaryMatrix():
+    '''Binarised characters of a set of taxa. ones and known are packed
+    (taxa x bytes) bit arrays of the n_columns binary columns; a column of
+    a taxon is 1 if the taxon has that state, and unknown if the taxon's
+    value of the character is missing. known_characters is the packed
+    array of the characters known in every taxon.'''
+
+    def __init__(self, taxa, ones, known, n_columns, known_characters=None):
+        self.taxa = taxa
+        self.ones = ones
+        self.known = known
+        self.n_columns = n_columns
+        self.known_characters = known_characters
+
+    @classmethod
+    def from_harvest(cls, lines, missing=MISSING):
+        '''Binarise harvest-style CSV lines. Taxa and characters are sorted by name and the states of every character numerically, as in harvestcsv2nexus.py.'''
+        rows = [line.strip().split(",") for line in lines if line.strip()]
+        names = rows[0][1:]
+        rows = sorted(rows[1:], key=lambda row: row[0])
+        taxa = [row[0] for row in rows]
+        values = np.array([row[1:] for row in rows], dtype=str).reshape(len(rows), len(names))
+        ones = []
+        known = []
+        order = sorted(range(len(names)), key=lambda j: names[j])
+        for j in order:
+            states = sorted(set(values[:, j].tolist()) - {missing}, key=int)
+            column_ones = values[:, j, None] == np.array(states, dtype=str)
+            ones.append(column_ones)
+            known.append(np.repeat((values[:, j] != missing)[:, None], len(states), axis=1))
+        ones = np.concatenate(ones, axis=1) if ones else np.zeros((len(taxa), 0), dtype=bool)
+        known = np.concatenate(known, axis=1) if known else np.zeros((len(taxa), 0), dtype=bool)
+        known_characters = values[:, order] != missing
+        return cls(taxa, np.packbits(ones, axis=1), np.packbits(known, axis=1), ones.shape[1],
+                   np.packbits(known_characters, axis=1))
+
+    def differences(self):
+        '''Return the numbers of binary columns in which each pair of taxa differ and in which both are known.'''
+        n = len(self.taxa)
+        different = np.zeros((n, n), dtype=np.int64)
+        comparable = np.zeros((n, n), dtype=np.int64)
+        for a in range(n):
+            both = self.known[a] & self.known
+            different[a] = popcount((self.ones[a] ^ self.ones) & both)
+            comparable[a] = popcount(both)
+        return different, comparable
+
+    def p_distances(self):
+        '''Return the uncorrected p-distances between the taxa, ignoring columns missing in either taxon.'''
+        different, comparable = self.differences()
+        return np.divide(different, comparable, out=np.zeros(different.shape), where=comparable > 0)
+
+    def hamming_distances(self):
+        '''Return the proportions of the characters known in both of each pair of taxa in which their states differ, as used by phylogemetric for delta scores and Q-residuals. Different states of a character differ in two of its binary columns.'''
+        different, _ = self.differences()
+        compared = np.zeros(different.shape, dtype=np.int64)
+        for a in range(len(self.taxa)):
+            compared[a] = popcount(self.known_characters[a] & self.known_characters)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return different / 2 / compared
+
+    def row(self, i):
+        '''Return the row of taxon i as a string of 0, 1 and ?.'''
+        ones = np.unpackbits(self.ones[i], count=self.n_columns)
+        known = np.unpackbits(self.known[i], count=self.n_columns).astype(bool)
+        chars = np.full(self.n_columns, ord(MISSING), dtype=np.uint8)
+        chars[known] = ord("0") + ones[known]
+        return chars.tobytes().decode("ascii")
+
+    def format_nexus(self):
+        '''Return the lines of a NEXUS file with the taxa and the binary characters.'''
+        lines = []
+        lines.append("#NEXUS")
+        lines.append("begin taxa;")
+        lines.append("dimensions ntax=" + str(len(self.taxa)) + ";")
+        lines.append("taxlabels" + "".join(" " + t for t in self.taxa) + ";")
+        lines.append("end;")
+        lines.append("")
+        lines.append("begin characters;")
+        lines.append("dimensions nchar=" + str(self.n_columns) + ";")
+        lines.append('format symbols="01" missing=?;')
+        lines.append("matrix")
+        for i, taxon in enumerate(self.taxa):
+            lines.append(taxon + " " + self.row(i))
+        lines.append(";")
+        lines.append("end;")
+        return lines
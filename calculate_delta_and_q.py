@@ -1,6 +1,12 @@
 #!/usr/bin/python3
 import argparse
 import sys
+
+import numpy as np
+import scipy.special
+
+from bitmatrix import BinaryMatrix
+
 try:
     import phylogemetric
 except:
@@ -19,6 +25,59 @@ def harvest_to_matrix(csv):
         matrix[fields[0]] = fields[1:]
     return matrix
 
+def quartet_pair_sums(dist):
+    '''Return the sums of the delta scores and of the squared Q-residual numerators (m1 - m2)^2 of all quartets of taxa, over the quartets containing each pair of taxa, as two symmetric matrices.'''
+    n = len(dist)
+    delta_sums = np.zeros((n, n))
+    q_sums = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n - 2):
+            # All quartets (i, j, k, l) with j < k < l at once
+            k, l = np.triu_indices(n - j - 1, 1)
+            k += j + 1
+            l += j + 1
+            a = dist[i, j] + dist[k, l]
+            b = dist[i, k] + dist[j, l]
+            c = dist[i, l] + dist[j, k]
+            m1 = np.maximum(np.maximum(a, b), c)
+            m3 = np.minimum(np.minimum(a, b), c)
+            m2 = np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+            denom = m1 - m3
+            delta = np.divide(m1 - m2, denom, out=np.zeros_like(denom), where=denom != 0)
+            q = (m1 - m2) ** 2
+            for sums, score in ((delta_sums, delta), (q_sums, q)):
+                sums[i, j] += score.sum()
+                sums[i] += np.bincount(k, score, n) + np.bincount(l, score, n)
+                sums[j] += np.bincount(k, score, n) + np.bincount(l, score, n)
+                sums[k, l] += score
+    # Every pair was only counted in the row of its first taxon so far
+    return delta_sums + delta_sums.T, q_sums + q_sums.T
+
+def jackknife(lines):
+    '''Return the taxa of harvest-style CSV lines, their delta scores and Q-residuals, and matrices of the delta scores and Q-residuals of every taxon (column) with each taxon (row) left out. All quartets are scored once; leaving a taxon out only subtracts the scores of the quartets containing it.'''
+    binary = BinaryMatrix.from_harvest(lines)
+    taxa, dist = binary.taxa, binary.hamming_distances()
+    np.fill_diagonal(dist, 0.0)
+    n = len(taxa)
+    delta_pairs, q_pairs = quartet_pair_sums(dist)
+    # Every quartet of a taxon contains three other taxa
+    delta_sums = delta_pairs.sum(axis=1) / 3
+    q_sums = q_pairs.sum(axis=1) / 3
+    pair_distances = dist[np.triu_indices(n, 1)]
+    scale = pair_distances.mean() ** 2
+    # Mean distance of the pairs left after removing each taxon, for the Q-residual scaling
+    loo_scales = ((pair_distances.sum() - dist.sum(axis=1)) / scipy.special.comb(n - 1, 2)) ** 2
+    full_count = scipy.special.comb(n - 1, 3)
+    loo_count = scipy.special.comb(n - 2, 3)
+    delta_score = delta_sums / full_count
+    q_residual = q_sums / full_count / scale
+    with np.errstate(invalid="ignore", divide="ignore"):
+        loo_delta = (delta_sums[None, :] - delta_pairs) / loo_count
+        loo_q = (q_sums[None, :] - q_pairs) / loo_count / loo_scales[:, None]
+    np.fill_diagonal(loo_delta, np.nan)
+    np.fill_diagonal(loo_q, np.nan)
+    return taxa, delta_score, q_residual, loo_delta, loo_q
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calculate delta scores and Q-residuals for a harvest-style CSV")
 
@@ -27,6 +86,11 @@ if __name__ == "__main__":
                         metavar='INFILE',
                         type=str,
                         default = None)
+
+    parser.add_argument("-j",
+                        dest="jackknife",
+                        help="Print the mean delta score and Q-residual of the taxa with each taxon left out in turn",
+                        action="store_true")
     
     args = parser.parse_args()
     in_file = args.infile
@@ -39,6 +103,13 @@ if __name__ == "__main__":
         print("Could not find file",in_file)
         quit()
 
+    if args.jackknife:
+        taxa, delta_score, q_residual, loo_delta, loo_q = jackknife(infile)
+        print("left_out\tdelta-score\tq-residual")
+        print("%s\t%f\t%f" % ("none", delta_score.mean(), q_residual.mean()))
+        for r in np.argsort(taxa):
+            print("%s\t%f\t%f" % (taxa[r], np.nanmean(loo_delta[r]), np.nanmean(loo_q[r])))
+        exit(0)
     matrix = harvest_to_matrix(infile)
     delta_score = phylogemetric.DeltaScoreMetric(matrix).score()
     q_residual  = phylogemetric.QResidualMetric(matrix).score()
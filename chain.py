@@ -1,11 +1,11 @@
-import itertools
 import random
 
+import numpy as np
 import scipy.stats
 
 import dataframe
-
-dummy_isos = set(["".join(chars) for chars in itertools.combinations("abcdefghijklmnopqrstuvwxyz",3)])
+import naming
+import sampling
 
 class ChainSimulator():
 
@@ -22,63 +22,70 @@ class ChainSimulator():
 
     def generate_data(self):
         """Generate cognate class data in a Dollo-like fashion."""
-        self.data = dataframe.DataFrame()
+        self.data = dataframe.from_chunks(*self.generate_chunks(self.n_features))
         self.data.datatype = "binary"
+        return self.data
 
-        langs = random.sample(dummy_isos, self.n_langs)
+    def generate_chunks(self, chunk_size):
+        """Generate the data chunk_size features at a time. Returns the languages, the number of features and an iterator over (feature names, languages x features matrix) chunks."""
+        langs = naming.taxon_names(self.n_langs, random)
         self.langs = langs
 
         # Generate cognate class counts
-        feature_sizes = self.dist.rvs(self.n_features)
-        test_counter = 5000000
-        while 0 in feature_sizes or max(feature_sizes) > self.n_langs:
-            feature_sizes = self.dist.rvs(self.n_features)
-            test_counter -= 1
-            if test_counter == 0:
-                print("Could not generate a suitable sample of features with many sampling attempts.")
-                exit(1)
+        feature_sizes = sampling.sample_truncated(self.dist, self.n_features, 1, self.n_langs)
 
         # Sample concatenation / insertion mixture proportion
         p = scipy.stats.beta(2,2).rvs()
 
-        # Assign taxa to cognate classes
-        for i, classes in enumerate(feature_sizes):
-            # First, sample the multinomial probabilities.
-            multinomial_probs = scipy.stats.dirichlet.rvs(alpha=[self.alpha]*classes)[0]
-            # Now sample the counts of each class, after making `remaining` draws from the multinomial dist
-            # Everything needs to be above zero!
-            multinomial_counts = scipy.stats.multinomial.rvs(n=self.n_langs-classes,p=multinomial_probs/sum(multinomial_probs))
-            multinomial_counts = [c+1 for c in multinomial_counts]
-            assert sum(multinomial_counts) == self.n_langs
-            # Start off by structuring cognate classes as uninterrupted chains of consecutive languages,
-            # in random order
-            segments = [[j]*count for j,count in enumerate(multinomial_counts)]
-            # Now iteratively "merge" classes by either concatenating a random pair or inserting one
-            # class into another at a random index class.  This second operation is consistent with the
-            # structure of one class "evolving over the top of" some now unobserved portion of a larger
-            # other class.
-            while len(segments) > 1:
-                random.shuffle(segments)
-                a, b = segments.pop(), segments.pop()
-                if random.random() < p or len(a) == len(b) == 1:
-                    # Concatenate
-                    c = a + b
-                else:
-                    # Insert
-                    longest = a if len(a) > len(b) else b
-                    shortest = b if len(a) > len(b) else a
-                    insertion_index = random.randint(1,len(longest)-1)
-                    c = longest[0:insertion_index] + shortest + longest[insertion_index:]
-                segments.append(c)
-            assignments = segments[0]
-            # Sanity checks
-            assert len(assignments) == self.n_langs
-            assert len(set(assignments)) == classes
+        return langs, self.n_features, self._chunks(feature_sizes, p, chunk_size)
 
-            # Store
-            for lang, cognate in zip(self.langs, assignments):
-                if lang not in self.data.data:
-                    self.data.data[lang] = {}
-                self.data.data[lang]["f_%03d" % i] = cognate
+    def _chunks(self, feature_sizes, p, chunk_size):
+        names = naming.feature_names(self.n_features)
+        for start in range(0, self.n_features, chunk_size):
+            stop = min(start + chunk_size, self.n_features)
+            block = dataframe.state_matrix(self.n_langs, stop - start)
+            # Assign taxa to cognate classes
+            for i in range(start, stop):
+                block[:, i - start] = self._generate_feature(feature_sizes[i], p)
+            yield names[start:stop], block
 
-        return self.data
+    def _generate_feature(self, classes, p):
+        """Return the cognate class of every language for a feature with the given number of classes."""
+        # First, sample the multinomial probabilities.
+        multinomial_probs = sampling.sample_dirichlet(self.alpha, classes)
+        # Now sample the counts of each class, after making `remaining` draws from the multinomial dist
+        # Everything needs to be above zero!
+        multinomial_counts = np.random.multinomial(self.n_langs-classes, multinomial_probs)
+        multinomial_counts = [c+1 for c in multinomial_counts]
+        assert sum(multinomial_counts) == self.n_langs
+        # Start off by structuring cognate classes as uninterrupted chains of consecutive languages,
+        # in random order
+        segments = [[j]*count for j,count in enumerate(multinomial_counts)]
+        # Now iteratively "merge" classes by either concatenating a random pair or inserting one
+        # class into another at a random index class.  This second operation is consistent with the
+        # structure of one class "evolving over the top of" some now unobserved portion of a larger
+        # other class.
+        while len(segments) > 1:
+            a, b = self._pop_random(segments), self._pop_random(segments)
+            if random.random() < p or len(a) == len(b) == 1:
+                # Concatenate
+                c = a + b
+            else:
+                # Insert
+                longest = a if len(a) > len(b) else b
+                shortest = b if len(a) > len(b) else a
+                insertion_index = random.randint(1,len(longest)-1)
+                c = longest[0:insertion_index] + shortest + longest[insertion_index:]
+            segments.append(c)
+        assignments = segments[0]
+        # Sanity checks
+        assert len(assignments) == self.n_langs
+        assert len(set(assignments)) == classes
+
+        return assignments
+
+    def _pop_random(self, segments):
+        """Remove and return a uniformly chosen segment, in constant time."""
+        k = random.randrange(len(segments))
+        segments[k], segments[-1] = segments[-1], segments[k]
+        return segments.pop()
@@ -0,0 +1,277 @@
+# Indexed CLDF wordlist store.
+#
+# A CLDF dataset is read once into three aligned integer columns (language,
+# meaning and cognate set of every form) plus the lists of language, meaning
+# and cognate set names. The store is cached next to the dataset as a .npz
+# file named after the SHA-256 hash of the input files, so later runs load it
+# without parsing any CSV, and a changed dataset is never read from a stale
+# cache. Synonym resolution and everything derived from it (harvest matrices,
+# cognate class counts) works on the store.
+
+import collections
+import csv
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_FOLDER = ".cldf_cache"
+CACHE_VERSION = "1"
+UNKNOWN = -1
+TERMS = "http://cldf.clld.org/v1.0/terms.rdf#"
+DEFAULT_TABLES = {"FormTable": "forms.csv",
+                  "CognateTable": "cognates.csv",
+                  "LanguageTable": "languages.csv",
+                  "ParameterTable": "parameters.csv"}
+DEFAULT_COLUMNS = {"id": "ID",
+                   "name": "Name",
+                   "languageReference": "Language_ID",
+                   "parameterReference": "Parameter_ID",
+                   "formReference": "Form_ID",
+                   "cognatesetReference": "Cognateset_ID"}
+
+def is_excluded(language, excluded_taxa):
+    '''Return True if language matches any of the excluded_taxa patterns.'''
+    return any(fnmatch.fnmatch(language, pattern) for pattern in excluded_taxa)
+
+class CognateStore():
+    '''Forms of a CLDF wordlist as aligned integer columns. language, meaning
+    and cognate_set index the lists languages, meanings and cognate_sets;
+    forms without a cognate set have cognate_set UNKNOWN.'''
+
+    def __init__(self, languages, meanings, cognate_sets, language, meaning, cognate_set):
+        self.languages = languages
+        self.meanings = meanings
+        self.cognate_sets = cognate_sets
+        self.language = language
+        self.meaning = meaning
+        self.cognate_set = cognate_set
+
+    def save(self, filename):
+        np.savez(filename,
+                 languages=np.array(self.languages, dtype=str),
+                 meanings=np.array(self.meanings, dtype=str),
+                 cognate_sets=np.array(self.cognate_sets, dtype=str),
+                 language=self.language,
+                 meaning=self.meaning,
+                 cognate_set=self.cognate_set)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(data["languages"].tolist(), data["meanings"].tolist(), data["cognate_sets"].tolist(),
+                       data["language"], data["meaning"], data["cognate_set"])
+
+    def cognates(self, excluded_taxa=()):
+        '''Return, for every meaning index, a dict of language index -> set of cognate set indices, with languages in order of appearance. Languages matching any of the excluded_taxa patterns are left out.'''
+        excluded = {i for i, l in enumerate(self.languages) if is_excluded(l, excluded_taxa)}
+        cognates = [{} for _ in self.meanings]
+        for l, m, c in zip(self.language.tolist(), self.meaning.tolist(), self.cognate_set.tolist()):
+            if c == UNKNOWN or l in excluded:
+                continue
+            cognates[m].setdefault(l, set()).add(c)
+        return cognates
+
+    def resolve_synonyms(self, strategy="minimum", excluded_taxa=(), seed=None):
+        '''Assign a single cognate set to every language and meaning. Returns a (languages x meanings) matrix of cognate set indices, UNKNOWN where a language has no cognate-coded form for a meaning. See SynonymResolver for the strategies.'''
+        return SynonymResolver(self, excluded_taxa).resolve(strategy, seed)
+
+class SynonymResolver():
+    '''Synonym resolution of a CognateStore, split into the part shared by
+    all strategies (grouping the forms, counting the cognate sets and assigning
+    every language without synonyms its only set) and the choices among
+    synonyms, which resolve() makes for one strategy at a time.
+
+    Among the cognate sets of a language with synonyms, the "minimum" strategy
+    prefers sets already assigned to other languages and then the most common
+    ones, so that the number of cognate classes is as small as possible;
+    "maximum" prefers unassigned and rare sets, and "random" picks one
+    uniformly.'''
+
+    STRATEGIES = ("minimum", "maximum", "random")
+
+    def __init__(self, store, excluded_taxa=()):
+        # Based on the synonym resolution of tiger-calculator
+        self.matrix = np.full((len(store.languages), len(store.meanings)), UNKNOWN, dtype=np.int32)
+        self.attested = []
+        self.synonyms = []
+        for m, by_language in enumerate(store.cognates(excluded_taxa)):
+            class_counts = collections.Counter(c for classes in by_language.values() for c in classes)
+            synonyms = []
+            for l, classes in by_language.items():
+                if len(classes) == 1:
+                    self.matrix[l, m] = next(iter(classes))
+                else:
+                    # Ties between equally common sets are broken by cognate set ID
+                    synonyms.append((l, sorted((class_counts[c], store.cognate_sets[c], c) for c in classes)))
+            self.attested.append(set(self.matrix[list(by_language), m].tolist()) - {UNKNOWN})
+            self.synonyms.append(synonyms)
+
+    def fixed_meanings(self):
+        '''Return the indices of the meanings without synonyms, which every strategy resolves the same way.'''
+        return [m for m, synonyms in enumerate(self.synonyms) if not synonyms]
+
+    def resolve(self, strategy="minimum", seed=None):
+        '''Return the resolved matrix for strategy. seed seeds the random strategy.'''
+        if strategy not in self.STRATEGIES:
+            raise ValueError("Unknown synonym strategy %s" % strategy)
+        rng = np.random.default_rng(seed)
+        matrix = self.matrix.copy()
+        for m, synonyms in enumerate(self.synonyms):
+            attested = set(self.attested[m])
+            for l, options in synonyms:
+                if strategy == "random":
+                    matrix[l, m] = options[rng.integers(len(options))][2]
+                    continue
+                if strategy == "minimum":
+                    options = options[::-1]
+                for n, _, c in options:
+                    if (c in attested) == (strategy == "minimum"):
+                        matrix[l, m] = c
+                        break
+                else:
+                    matrix[l, m] = options[0][2]
+                attested.add(int(matrix[l, m]))
+        return matrix
+
+def class_counts(matrix):
+    '''Return the number of distinct cognate classes of every meaning (column) of a resolved matrix.'''
+    return [len(set(column[column != UNKNOWN].tolist())) for column in matrix.T]
+
+def max_proportions(matrix):
+    '''Return the proportion of languages in the largest cognate class of every meaning (column) of a resolved matrix.'''
+    proportions = []
+    for column in matrix.T:
+        frequencies = np.unique(column[column != UNKNOWN], return_counts=True)[1]
+        proportions.append(frequencies.max() / frequencies.sum())
+    return proportions
+
+def harvest_lines(store, matrix, excluded_taxa=(), missing="?"):
+    '''Return the lines of a harvest-style CSV of a resolved matrix. Cognate classes are numbered 1, 2, ... within every meaning in order of appearance; spaces in language names become underscores.'''
+    lines = ["lang," + ",".join(store.meanings)]
+    codes = np.zeros(matrix.shape, dtype=np.int64)
+    for m in range(matrix.shape[1]):
+        known = matrix[:, m] != UNKNOWN
+        classes, first, inverse = np.unique(matrix[known, m], return_index=True, return_inverse=True)
+        labels = np.empty(len(classes), dtype=np.int64)
+        labels[np.argsort(first)] = np.arange(1, len(classes) + 1)
+        codes[known, m] = labels[inverse]
+    for l, language in enumerate(store.languages):
+        if is_excluded(language, excluded_taxa):
+            continue
+        taxon = language.replace(" ", "_").replace("õ", "o")
+        values = [str(c) if c else missing for c in codes[l].tolist()]
+        lines.append(taxon + "," + ",".join(values))
+    return lines
+
+def _read_metadata(path):
+    '''Return a dict of CLDF component -> (table filename, dict of property -> column name) from the metadata file in path, or the defaults if there is none.'''
+    tables = {}
+    for filename in sorted(glob.glob(os.path.join(path, "*metadata.json"))):
+        with open(filename, "r", encoding="utf-8") as fp:
+            metadata = json.load(fp)
+        for table in metadata.get("tables", []):
+            component = table.get("dc:conformsTo", "").replace(TERMS, "")
+            columns = {}
+            for column in table.get("tableSchema", {}).get("columns", []):
+                if "propertyUrl" in column:
+                    columns[column["propertyUrl"].replace(TERMS, "")] = column["name"]
+            tables[component] = (os.path.join(path, table["url"]), columns)
+        break
+    for component, filename in DEFAULT_TABLES.items():
+        if component not in tables and os.path.exists(os.path.join(path, filename)):
+            tables[component] = (os.path.join(path, filename), {})
+    return tables
+
+def _column(columns, prop):
+    return columns.get(prop, DEFAULT_COLUMNS[prop])
+
+def _read_table(filename):
+    with open(filename, "r", encoding="utf-8", newline="") as fp:
+        return list(csv.DictReader(fp))
+
+def _names(tables, component):
+    '''Return a dict of ID -> name of the rows of a language or parameter table.'''
+    if component not in tables:
+        return {}
+    filename, columns = tables[component]
+    id_col, name_col = _column(columns, "id"), _column(columns, "name")
+    return {row[id_col]: row.get(name_col) or row[id_col] for row in _read_table(filename)}
+
+def input_files(path):
+    '''Return the files of the CLDF dataset in path which the store is built from.'''
+    tables = _read_metadata(path)
+    files = sorted(glob.glob(os.path.join(path, "*metadata.json")))[:1]
+    return files + sorted(filename for filename, _ in tables.values())
+
+def dataset_hash(path):
+    '''Return the SHA-256 hash of the input files of the CLDF dataset in path.'''
+    h = hashlib.sha256(CACHE_VERSION.encode())
+    for filename in input_files(path):
+        h.update(os.path.basename(filename).encode())
+        with open(filename, "rb") as fp:
+            for block in iter(lambda: fp.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def build(path):
+    '''Read the CLDF dataset in path into a CognateStore.'''
+    tables = _read_metadata(path)
+    if "FormTable" not in tables:
+        raise ValueError("No form table found in %s" % path)
+    language_names = _names(tables, "LanguageTable")
+    meaning_names = _names(tables, "ParameterTable")
+
+    forms_file, columns = tables["FormTable"]
+    forms = _read_table(forms_file)
+    id_col = _column(columns, "id")
+    language_col = _column(columns, "languageReference")
+    meaning_col = _column(columns, "parameterReference")
+    form_cognates = {}
+    if "CognateTable" in tables:
+        cognates_file, cognate_columns = tables["CognateTable"]
+        form_col = _column(cognate_columns, "formReference")
+        set_col = _column(cognate_columns, "cognatesetReference")
+        for row in _read_table(cognates_file):
+            form_cognates.setdefault(row[form_col], []).append(row[set_col])
+    else:
+        # Cognate sets given directly in the form table
+        set_col = _column(columns, "cognatesetReference")
+        for row in forms:
+            if row.get(set_col):
+                form_cognates[row[id_col]] = [row[set_col]]
+
+    index = {"language": {}, "meaning": {}, "cognate_set": {}}
+    rows = {"language": [], "meaning": [], "cognate_set": []}
+    for form in forms:
+        language = language_names.get(form[language_col], form[language_col])
+        meaning = meaning_names.get(form[meaning_col], form[meaning_col])
+        for cognate_set in form_cognates.get(form[id_col], [None]):
+            rows["language"].append(index["language"].setdefault(language, len(index["language"])))
+            rows["meaning"].append(index["meaning"].setdefault(meaning, len(index["meaning"])))
+            if cognate_set in (None, "", "?"):
+                rows["cognate_set"].append(UNKNOWN)
+            else:
+                # Cognate set IDs are only unique within a meaning in some datasets
+                key = meaning + "\t" + cognate_set
+                rows["cognate_set"].append(index["cognate_set"].setdefault(key, len(index["cognate_set"])))
+    return CognateStore(list(index["language"]), list(index["meaning"]), list(index["cognate_set"]),
+                        np.array(rows["language"], dtype=np.int32),
+                        np.array(rows["meaning"], dtype=np.int32),
+                        np.array(rows["cognate_set"], dtype=np.int32))
+
+def load(path):
+    '''Return the CognateStore of the CLDF dataset in path, from the cache if the dataset has not changed since it was cached.'''
+    cache = os.path.join(path, CACHE_FOLDER, dataset_hash(path) + ".npz")
+    if os.path.exists(cache):
+        return CognateStore.load(cache)
+    store = build(path)
+    # Caches of earlier versions of the dataset are no longer needed
+    for old in glob.glob(os.path.join(path, CACHE_FOLDER, "*.npz")):
+        os.remove(old)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    store.save(cache)
+    return store
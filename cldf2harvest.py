@@ -1,54 +1,45 @@
 #!/usr/bin/python3
 import argparse
-import sys
-import os
-import master_script
 
-if __name__ == '__main__':
+import cldf
 
-    sys.path.append(os.path.join(master_script.MATERIALS_FOLDER, master_script.TIGER_FOLDER))
-    import formats
+if __name__ == '__main__':
 
-    parser = argparse.ArgumentParser(description="Create harvest CSV with tiger-calculator's CLDF reader")
+    parser = argparse.ArgumentParser(description="Create harvest CSV from a CLDF dataset")
 
     parser.add_argument(dest="in_file",
-                        help="Input file to analyze.",
+                        help="CLDF folder to convert.",
                         metavar='IN_FILE',
                         default=None,
                         type=str)
 
     parser.add_argument("-x",
                         dest="excluded_taxa",
-                        help="Comma-separated list of taxa to exclude",
+                        help="Comma-separated list of taxa to exclude (wildcards allowed)",
                         metavar='EXCLUDED_TAXA',
                         default="",
                         type=str)
 
+    parser.add_argument("-s",
+                        dest="synonym_strategy",
+                        help="Synonym resolution strategy (minimum, maximum or random)",
+                        metavar='STRATEGY',
+                        default="minimum",
+                        type=str)
+
+    parser.add_argument("-r",
+                        dest="seed",
+                        help="Random seed for the random synonym resolution strategy",
+                        metavar='SEED',
+                        default=None,
+                        type=int)
+
     args = parser.parse_args()
-    reader = formats.getReader("cldf")
-    reader.synonym_strategy = "minimum"
-    content = reader.getContents(args.in_file)
-    taxa = content[0]
-    chars = content[1]
-    names = content[2]
-
-    excluded_taxa = args.excluded_taxa.split(",")
-
-    out = []
-    current_line = ""
-    current_line = "lang"
-    for n in names:
-        current_line += "," + n
-    out.append(current_line)
-    for i in range(len(taxa)):
-        current_taxon = str(taxa[i])
-        if current_taxon in excluded_taxa:
-            continue
-        current_taxon = current_taxon.replace(" ","_")
-        current_taxon = current_taxon.replace("õ","o")
-        current_line = current_taxon
-        for j in range(len(chars[i])):
-            current_line += "," + str(chars[i][j])
-        out.append(current_line)
-    for l in out:
+    if args.synonym_strategy not in cldf.SynonymResolver.STRATEGIES:
+        print("Unknown synonym strategy", args.synonym_strategy)
+        exit(1)
+    store = cldf.load(args.in_file)
+    excluded_taxa = [x for x in args.excluded_taxa.split(",") if x]
+    matrix = store.resolve_synonyms(args.synonym_strategy, excluded_taxa, args.seed)
+    for l in cldf.harvest_lines(store, matrix, excluded_taxa):
         print(l)
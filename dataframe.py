@@ -1,15 +1,24 @@
+import os
 import random
 import sys
 
+import numpy as np
 import scipy.stats
 
 class DataFrame:
 
-    def __init__(self):
+    def __init__(self, languages=None, features=None, matrix=None):
         self.data = {}
+        # Simulators store their data as a compact integer matrix
+        # (languages x features) instead of nested dicts.
+        self.languages = languages
+        self.features = features
+        self.matrix = matrix
 
     def format_output(self):
         """Return a string containing a .csv file of the data."""
+        if self.matrix is not None:
+            return "\n".join(self.format_lines())
         languages = list(self.data.keys())
         languages.sort()
         features = list(self.data[languages[0]].keys())
@@ -20,10 +29,27 @@ class DataFrame:
             lines.append(l + "," + ",".join(map(str,[self.data[l][f] for f in features])))
         return "\n".join(lines)
 
+    def format_lines(self):
+        """Yield the lines of a .csv file of matrix-backed data one language at a time."""
+        rows = sorted(range(len(self.languages)), key=lambda i: self.languages[i])
+        columns = sorted(range(len(self.features)), key=lambda j: self.features[j])
+        yield "language," + ",".join(self.features[j] for j in columns)
+        for i in rows:
+            yield self.languages[i] + "," + ",".join(map(str, self.matrix[i, columns].tolist()))
+
     def borrow(self, borrowing_rate):
         """Randomly borrow feature values at a certain rate."""
         if borrowing_rate == 0.0:
             return
+        if self.matrix is not None:
+            for f in range(self.matrix.shape[1]):
+                all_values = np.unique(self.matrix[:, f])
+                if len(all_values) == 1:
+                    continue
+                for l in np.flatnonzero(np.random.random_sample(self.matrix.shape[0]) <= borrowing_rate):
+                    borrowable_values = all_values[all_values != self.matrix[l, f]]
+                    self.matrix[l, f] = random.choice(borrowable_values)
+            return
         languages = list(self.data.keys())
         features = list(self.data[languages[0]].keys())
         for f in features:
@@ -39,3 +65,38 @@ class DataFrame:
                 current_value = self.data[l][f]
                 borrowable_values = [x for x in all_values if x != current_value]
                 self.data[l][f] = random.sample(borrowable_values,1)[0]
+
+def state_matrix(n_languages, n_features):
+    """Return an all-zero matrix with the smallest integer type that holds n_languages cognate classes."""
+    return np.zeros((n_languages, n_features), dtype=np.min_scalar_type(n_languages))
+
+def from_chunks(languages, n_features, chunks):
+    """Assemble a matrix-backed DataFrame from (feature names, languages x features matrix) chunks."""
+    matrix = state_matrix(len(languages), n_features)
+    features = []
+    for names, block in chunks:
+        matrix[:, len(features):len(features) + len(names)] = block
+        features.extend(names)
+    return DataFrame(languages, features, matrix)
+
+def write_chunks(filename, languages, n_features, chunks, binary=False):
+    """Write (feature names, languages x features matrix) chunks to filename, holding one chunk and one output line in memory at a time. Chunks are spooled into a memory-mapped .npy matrix; with binary=True that matrix is the output and the language and feature names are written next to it, otherwise it is turned into a .csv file one language at a time and removed. Chunks must arrive in sorted feature name order."""
+    spool = filename if binary else filename + ".spool.npy"
+    matrix = np.lib.format.open_memmap(spool, mode="w+", dtype=np.min_scalar_type(len(languages)), shape=(len(languages), n_features))
+    features = []
+    for names, block in chunks:
+        matrix[:, len(features):len(features) + len(names)] = block
+        features.extend(names)
+    matrix.flush()
+    if binary:
+        with open(filename + ".languages.txt", "w") as f:
+            f.writelines(l + "\n" for l in languages)
+        with open(filename + ".features.txt", "w") as f:
+            f.writelines(name + "\n" for name in features)
+    else:
+        with open(filename, "w") as f:
+            f.write("language," + ",".join(features))
+            for i in sorted(range(len(languages)), key=lambda i: languages[i]):
+                f.write("\n" + languages[i] + "," + ",".join(map(str, matrix[i].tolist())))
+        del matrix
+        os.remove(spool)
@@ -1,155 +1,168 @@
-import itertools
+import functools
 import random
 
-import dendropy
-from dendropy.simulate import treesim
 import scipy.stats
 import numpy as np
 
+import arraytree
 import dataframe
+import naming
 
-dummy_isos = set(["".join(chars) for chars in itertools.combinations("abcdefghijklmnopqrstuvwxyz",3)])
+TREE_CACHE_SIZE = 1024 # most recently used trees kept
+
+@functools.lru_cache(maxsize=TREE_CACHE_SIZE)
+def _seeded_yule_tree(taxa, rseed):
+    '''Return the Yule tree of a DolloSimulator with taxa languages and seed rseed.'''
+    rng = random.Random(rseed)
+    return arraytree.generate_yule_tree(taxa, 1.0, rng, naming.taxon_names(taxa, rng))
+
+def clear_tree_cache():
+    '''Forget all cached trees.'''
+    _seeded_yule_tree.cache_clear()
 
 class DolloSimulator():
 
     def __generate_yule_tree(self, taxa, birthrate=1.0, taxa_names=None):
-        names = self.tree_rng.sample(dummy_isos, min(taxa, len(dummy_isos)))
+        names = naming.taxon_names(taxa, self.tree_rng)
         # print(names)
-        fancytaxa = dendropy.TaxonNamespace(names)
-        tree = treesim.birth_death_tree(birth_rate=birthrate, death_rate=0.0, num_extant_tips=taxa, taxon_namespace=fancytaxa, rng=self.tree_rng)
-        # print(tree.as_ascii_plot())
-        return tree
+        return arraytree.generate_yule_tree(taxa, birthrate, self.tree_rng, names)
 
-    def __init__(self, n_languages, n_features, cognate_birthrate=0.5, cognate_gamma=1.0, borrowing_prob=0.0, rseed=None):
+    def __init__(self, n_languages, n_features, cognate_birthrate=0.5, cognate_gamma=1.0, borrowing_prob=0.0, rseed=None, common_random_numbers=False):
         if rseed == None:
             self.tree_rng = random.Random()
+            self.tree = self.__generate_yule_tree(n_languages, 1.0, None)
         else:
             self.tree_rng = random.Random(rseed)
             random.seed(rseed)
             np.random.seed(rseed)
-        self.tree = self.__generate_yule_tree(n_languages, 1.0, None)
+            # The tree only depends on the taxon count and the seed, so simulators
+            # that differ only in their cognate parameters can share it.
+            self.tree = _seeded_yule_tree(n_languages, rseed)
+        # With common random numbers, every feature draws its uniforms from its own
+        # stream seeded by (rseed, feature), so simulators with the same seed but
+        # different birthrates see the same draws.
+        self.common_random_numbers = common_random_numbers
+        self.crn_seed = rseed if rseed != None else np.random.randint(2**31)
+        self.crn_rng = None
         self.n_features = n_features
         self.cognate_birthrate = cognate_birthrate
         self.cognate_gamma = cognate_gamma
         self.borrowing_prob = borrowing_prob
         self.next_cognate = None
-        self.attested_cognates = {} # dict of attested cognate arrays
-        self.borrowing_sources = []
+        # Borrowing visits the children of each node in preorder, as in the dendropy implementation
+        children = self.tree.children[self.tree.preorder].ravel()
+        self.borrowing_order = children[children >= 0]
 
-    def __evolve_feature(self, feature, parent, gamma):
-        '''Evolve immediate children of branch.'''
-        # for each child in node, define timerate (average number of changes) as edge length * birth_rate * sampled gamma
+    def __evolve_feature(self, cognates, nodes, gamma):
+        '''Evolve nodes (in preorder) from their parents.'''
+        # for each node, define timerate (average number of changes) as edge length * birth_rate * sampled gamma
         # sample whether a mutation occurs from a poisson distribution, based on timerate
-        for child in parent.child_node_iter():
-            timerate = child.edge_length * self.cognate_birthrate * gamma
-            changes = scipy.stats.poisson(timerate).rvs()
-            if changes:
-                # A mutation has occurred.
-                # define cognate as a new cognate. add new cognate number to attested cognates. Update next_cognate
-                child.cognate = self.next_cognate
-                self.attested_cognates[feature].append(child.cognate)
-                self.next_cognate = max(self.attested_cognates[feature]) + 1
-            else:
-                # No change has occurred, so propagate the parent's cognate value
-                child.cognate = parent.cognate
+        timerates = self.tree.edge_length[nodes] * self.cognate_birthrate * gamma
+        changed = self.__sample_changes(timerates)
+        # Mutated nodes get new cognates, numbered in preorder
+        new_cognates = np.zeros(len(nodes), dtype=cognates.dtype)
+        new_cognates[changed] = self.next_cognate + np.arange(changed.sum())
+        self.next_cognate += changed.sum()
+        # Others propagate their parent's cognate value. Parents are settled before
+        # their children by working through the nodes one generation at a time.
+        order = np.argsort(self.tree.level[nodes], kind="stable")
+        levels = self.tree.level[nodes][order]
+        bounds = np.flatnonzero(np.diff(levels)) + 1
+        for block in np.split(order, bounds):
+            block_nodes = nodes[block]
+            cognates[block_nodes] = np.where(changed[block], new_cognates[block], cognates[self.tree.parent[block_nodes]])
+
+    def __sample_changes(self, timerates):
+        '''Return whether at least one Poisson event occurs for each of timerates.'''
+        if self.crn_rng is None:
+            return np.random.poisson(timerates) > 0
+        # P(at least one event) = 1 - exp(-timerate)
+        return self.crn_rng.random_sample(len(timerates)) < -np.expm1(-timerates)
+
+    def __sample_gamma(self):
+        dist = scipy.stats.gamma(self.cognate_gamma,scale=1.0/self.cognate_gamma)
+        if self.crn_rng is None:
+            return dist.rvs()
+        return dist.ppf(self.crn_rng.random_sample())
 
     def generate_data(self):
         """Generate cognate class data in a Dollo-like fashion."""
-        self.data = dataframe.DataFrame()
+        self.data = dataframe.from_chunks(*self.generate_chunks(self.n_features))
         self.data.datatype = "binary" # what does this row do?
-        for i in range(0, self.n_features):
-            self.attested_cognates[i] = []
-            gamma = scipy.stats.gamma(self.cognate_gamma,scale=1.0/self.cognate_gamma).rvs()
-            self.next_cognate = 1
-            first = True
-            for parent in self.tree.preorder_node_iter():
-                if first:
-                    parent.cognate = self.next_cognate
-                    self.attested_cognates[i] = [parent.cognate]
-                    self.next_cognate = max(self.attested_cognates[i]) + 1
-                    first = False
-                # Lines here migrated to separate method to allow reusing it in borrowing.
-                # Result is identical with previous version when no borrowing occurs and random seeds are defined explicitly.
-                self.__evolve_feature(i, parent, gamma)
-
-            self.borrowing_sources = [] # reset borrowing source constraints (populated during previous borrowing simulation)
-            if self.borrowing_prob:
-                self.__borrow_feature(i, gamma)
-
-            terminal_values = []
-            for leaf in self.tree.leaf_node_iter():
-                if leaf.cognate not in terminal_values:
-                    terminal_values.append(leaf.cognate)
-            terminal_values.sort()
-            trans = dict([(v,n) for (n,v) in enumerate(terminal_values)])
-            for leaf in self.tree.leaf_node_iter():
-                iso = str(leaf.taxon)[1:-1]
-                if iso not in self.data.data:
-                    self.data.data[iso] = {}
-                self.data.data[iso]["f_%03d" % i] = trans[leaf.cognate] 
         #if self.borrowing_prob:
         #    self.data.borrow(self.borrowing_prob)
 
         return self.data
 
-    def __borrow_feature(self, feature, gamma):
+    def generate_chunks(self, chunk_size):
+        """Generate the data chunk_size features at a time. Returns the languages, the number of features and an iterator over (feature names, languages x features matrix) chunks."""
+        return self.tree.leaf_labels(), self.n_features, self.__chunks(chunk_size)
+
+    def __chunks(self, chunk_size):
+        names = naming.feature_names(self.n_features)
+        for start in range(0, self.n_features, chunk_size):
+            stop = min(start + chunk_size, self.n_features)
+            block = dataframe.state_matrix(len(self.tree.leaves), stop - start)
+            for i in range(start, stop):
+                block[:, i - start] = self.__generate_feature(i)
+            yield names[start:stop], block
+        self.crn_rng = None
+
+    def __generate_feature(self, i):
+        '''Return the cognate classes (numbered 0, 1, ...) of the leaves for feature i.'''
+        if self.common_random_numbers:
+            self.crn_rng = np.random.RandomState([self.crn_seed, i])
+        gamma = self.__sample_gamma()
+        cognates = np.zeros(self.tree.n_nodes, dtype=np.int64)
+        cognates[self.tree.preorder[0]] = 1
+        self.next_cognate = 2
+        self.__evolve_feature(cognates, self.tree.preorder[1:], gamma)
+
+        if self.borrowing_prob:
+            self.__borrow_feature(cognates, gamma)
+
+        # Number the attested cognates 0, 1, ... in order of their cognate numbers
+        return np.unique(cognates[self.tree.leaves], return_inverse=True)[1]
+
+    def __borrow_feature(self, cognates, gamma):
         '''Generate cascading borrowing events for feature.'''
         # draw separate gamma for borrowing susceptibility
-        gamma_borr = scipy.stats.gamma(self.cognate_gamma,scale=1.0/self.cognate_gamma).rvs()
-        # start similarly to when growing data
-        for parent in self.tree.preorder_node_iter():
-            for child in parent.child_node_iter():
-                # check that current node is not dependent on an already generated borrowing event.
-                #( = is a borrowing source language, or an ancestor of a borrowing source language). In that case no borrowing can take place.
-                if child not in self.borrowing_sources:
-                    # Borrowing likelihood similar to cognate change but with borrowing probability replacing cognate birth rate
-                    timerate = child.edge_length * self.borrowing_prob * gamma_borr
-                    # Similar Poisson sampling process as with cognate mutation, except now we sample for borrowing events
-                    changes = scipy.stats.poisson(timerate).rvs()
-                    if changes:
-                        # A borrowing has occurred.
-                        # Sample donor language from languages existing at this point in time. If no plausible sources are available, we skip this node.
-                        try:
-                            borrowing_source = random.choice(self.__get_borrowing_candidates(child))
-                        except IndexError:
-                            continue
-                        child.cognate = borrowing_source.cognate
-                        # add borrowing source and its ancestors to self.borrowing_sources, as their "history" is now constrained by the new borrowing event
-                        self.borrowing_sources += [borrowing_source]
-                        self.borrowing_sources += self.__get_ancestors(borrowing_source)
-                        # remutate subtree's cognates, starting from borrower node, using tree building gamma
-                        for node in child.preorder_internal_node_iter():
-                            self.__evolve_feature(feature, node, gamma)
-
-    def __get_borrowing_candidates(self,target):
-        '''return list of nodes that are not the target or its ancestors, and exist within its time frame (i.e. do not have longer distance from root). If no such nodes exists, returns an empty list'''
-        invalid_nodes = self.__get_ancestors(target)
-        invalid_nodes.append(target)
-        candidates = []
-        target_branch_length = target.distance_from_root() # donor language = node whose distance from root <= target branch length
-        #print("Target branch length ", target_branch_length)
-        for parent in self.tree.preorder_node_iter():
-            if parent in invalid_nodes: # reject ancestors and self
+        gamma_borr = self.__sample_gamma()
+        # Borrowing likelihood similar to cognate change but with borrowing probability replacing cognate birth rate
+        timerates = self.tree.edge_length[self.borrowing_order] * self.borrowing_prob * gamma_borr
+        # Similar Poisson sampling process as with cognate mutation, except now we sample for borrowing events
+        changes = self.__sample_changes(timerates)
+        # Nodes that are a borrowing source language, or an ancestor of one, are constrained by
+        # an already generated borrowing event and cannot borrow.
+        borrowing_sources = np.zeros(self.tree.n_nodes, dtype=bool)
+        for child in self.borrowing_order[changes]:
+            if borrowing_sources[child]:
                 continue
-            if parent.distance_from_root() > target_branch_length:
+            # A borrowing has occurred.
+            # Sample donor language from languages existing at this point in time. If no plausible sources are available, we skip this node.
+            candidates = self.__get_borrowing_candidates(child)
+            if len(candidates) == 0:
                 continue
-            if any(parent.child_node_iter()): # returns false if leaf node
-                for child in parent.child_node_iter():
-                    if child.distance_from_root() > target_branch_length: # child exceeds branch length; parent best candidate
-                        #print("Accepted:",parent.distance_from_root())
-                        candidates.append(parent)
+            if self.crn_rng is None:
+                borrowing_source = random.choice(candidates)
             else:
-                #print("Accepted:",parent.distance_from_root())
-                if parent not in candidates:
-                    candidates.append(parent)
-        #print("Returning",len(candidates),"borrowing candidates for target node with root distance",target_branch_length)
-        #for i in candidates:
-        #    print("Source root distance ->",i.distance_from_root())
-        return candidates
-    
-    def __get_ancestors(self, node):
-        '''Return ancestors of node'''
-        nodes = []
-        for anc in node.ancestor_iter():
-            nodes.append(anc)
-        return nodes
+                borrowing_source = candidates[self.crn_rng.randint(len(candidates))]
+            cognates[child] = cognates[borrowing_source]
+            # mark borrowing source and its ancestors, as their "history" is now constrained by the new borrowing event
+            borrowing_sources[borrowing_source] = True
+            borrowing_sources[self.tree.ancestors(borrowing_source)] = True
+            # remutate subtree's cognates, starting from borrower node, using tree building gamma
+            self.__evolve_feature(cognates, self.tree.descendants(child), gamma)
+
+    def __get_borrowing_candidates(self,target):
+        '''return list of nodes that are not the target or its ancestors, and exist within its time frame (i.e. do not have longer distance from root). If no such nodes exists, returns an empty list'''
+        tree = self.tree
+        target_branch_length = tree.depth[target] # donor language = node whose distance from root <= target branch length
+        valid = tree.depth <= target_branch_length
+        valid[target] = False # reject ancestors and self
+        valid[tree.ancestors(target)] = False
+        # An internal node is a candidate once for each child that exceeds the branch length
+        # (the parent is then the best candidate); a leaf is a candidate once.
+        exceeding = (tree.children >= 0) & (tree.depth[tree.children] > target_branch_length)
+        weights = np.where(tree.is_leaf, 1, exceeding.sum(axis=1)) * valid
+        return np.repeat(tree.preorder, weights[tree.preorder]).tolist()
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+# Emulate the mean TIGER rate of the simulation models.
+#
+# A Gaussian process is fitted for every exploration model to the mean TIGER
+# rates stored in the results database, as a function of the logarithms of the
+# taxon count and of the model parameter (alpha or the relative cognate birth
+# rate). Every explored parameter combination is one observation, whose noise
+# is the variance of the mean of its replicates. The main simulation runs are
+# left out, as they use other cognate class count distributions and numbers of
+# features. The fitted processes are saved to a numpy archive, from which
+# queries are answered without refitting. A query is only answered by the
+# emulator inside its trusted region: within the range of the explored taxon
+# counts and parameter values, and where the emulator is certain enough. Other
+# queries are simulated.
+
+import argparse
+import math
+import os
+
+import numpy as np
+import scipy.linalg
+import scipy.optimize
+
+import results_db
+import sampling
+import tiger
+
+PARSER_DESC = "Fit emulators of mean TIGER rates to the results database, or query them."
+EMULATOR_FILE = "emulator.npz"
+PARAMETERS = {"swamp_exploration": "alpha",
+              "chain_exploration": "alpha",
+              "tree_exploration": "birth_rate"}
+MAX_SD = 0.02 # largest standard deviation of a trusted prediction
+N_FEATURES = 200 # of the exploration runs
+N_FALLBACK_REPS = 10
+
+class GaussianProcess():
+    '''Gaussian-process regression with a constant mean and a squared exponential kernel with a length scale for every input. Observations have known noise variances.'''
+
+    def __init__(self, x, y, noise, lengthscales, variance, offset):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.noise = np.asarray(noise, dtype=float)
+        self.lengthscales = np.asarray(lengthscales, dtype=float)
+        self.variance = float(variance)
+        self.offset = float(offset)
+        # Precomputed, so a prediction only takes a kernel vector and two products
+        self._scaled = self.x / self.lengthscales
+        k = self._kernel(self._scaled, self._scaled) + np.diag(self.noise)
+        self._inverse = scipy.linalg.cho_solve(scipy.linalg.cho_factor(k, lower=True), np.eye(len(self.y)))
+        self._weights = self._inverse @ (self.y - self.offset)
+
+    def _kernel(self, a, b):
+        sq_dist = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return self.variance * np.exp(-0.5 * sq_dist)
+
+    @staticmethod
+    def _neg_log_likelihood(log_params, x, y, noise):
+        lengthscales, variance = np.exp(log_params[:-1]), np.exp(log_params[-1])
+        scaled = x / lengthscales
+        sq_dist = ((scaled[:, None, :] - scaled[None, :, :]) ** 2).sum(axis=2)
+        k = variance * np.exp(-0.5 * sq_dist) + np.diag(noise)
+        try:
+            factor = scipy.linalg.cho_factor(k, lower=True)
+        except np.linalg.LinAlgError:
+            return math.inf
+        residuals = y - np.average(y, weights=1 / noise)
+        return 0.5 * residuals @ scipy.linalg.cho_solve(factor, residuals) + np.log(np.diag(factor[0])).sum()
+
+    @classmethod
+    def fit(cls, x, y, noise):
+        '''Fit the length scales and the variance of the kernel by maximum likelihood.'''
+        x, y, noise = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(noise, dtype=float)
+        spans = np.maximum(x.max(axis=0) - x.min(axis=0), 1e-3)
+        start = np.log(np.append(spans / 2, max(y.var(), 1e-6)))
+        # Length scales between a twentieth and ten times the explored range
+        bounds = [(math.log(s / 20), math.log(s * 10)) for s in spans] + [(math.log(1e-6), math.log(1.0))]
+        result = scipy.optimize.minimize(cls._neg_log_likelihood, start, args=(x, y, noise),
+                                         method="L-BFGS-B", bounds=bounds)
+        params = np.exp(result.x)
+        return cls(x, y, noise, params[:-1], params[-1], np.average(y, weights=1 / noise))
+
+    def predict(self, x):
+        '''Return the predicted means and standard deviations at the rows of x.'''
+        k = self._kernel(np.atleast_2d(x) / self.lengthscales, self._scaled)
+        mean = self.offset + k @ self._weights
+        variance = self.variance - np.einsum("ij,jk,ik->i", k, self._inverse, k)
+        return mean, np.sqrt(np.maximum(variance, 0.0))
+
+    def to_arrays(self, prefix):
+        return {prefix + "x": self.x, prefix + "y": self.y, prefix + "noise": self.noise,
+                prefix + "lengthscales": self.lengthscales,
+                prefix + "kernel": np.array([self.variance, self.offset])}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        variance, offset = arrays[prefix + "kernel"]
+        return cls(arrays[prefix + "x"], arrays[prefix + "y"], arrays[prefix + "noise"],
+                   arrays[prefix + "lengthscales"], variance, offset)
+
+def inputs(taxa, value):
+    '''Return the emulator inputs of taxon counts and parameter values.'''
+    taxa, value = np.broadcast_arrays(np.log10(taxa), np.log10(value))
+    return np.column_stack((taxa.ravel(), value.ravel()))
+
+def observations(conn, model, param_name):
+    '''Return the taxon counts, parameter values, mean TIGER rates and variances of the means of every explored parameter combination of model.'''
+    replicates = {}
+    for params, _, mean, _ in results_db.parameter_means(conn, model, "tiger"):
+        params = results_db.parse_params(params)
+        replicates.setdefault((params["taxa"], params[param_name]), []).append(mean)
+    points = sorted(replicates)
+    means = np.array([np.mean(replicates[p]) for p in points])
+    variances = np.array([np.var(replicates[p], ddof=1) / len(replicates[p]) if len(replicates[p]) > 1 else np.nan
+                          for p in points])
+    # Combinations with a single replicate get the typical variance of a replicate
+    typical = np.nanmedian([v * len(replicates[p]) for p, v in zip(points, variances)]) if np.isfinite(variances).any() else 1e-4
+    variances = np.where(np.isfinite(variances), variances, typical)
+    # A floor keeps the kernel matrix well conditioned
+    variances = np.maximum(variances, 1e-8)
+    taxa = np.array([p[0] for p in points], dtype=float)
+    values = np.array([p[1] for p in points], dtype=float)
+    return taxa, values, means, variances
+
+def simulate(model, taxa, value, replicates=N_FALLBACK_REPS):
+    '''Simulate replicates of model and return the mean and standard error of their mean TIGER rates.'''
+    # Imported here so that queries answered by the emulator do not load the simulators
+    from chain import ChainSimulator
+    from dollo import DolloSimulator
+    from swamp import SwampSimulator
+    means = []
+    for i in range(replicates):
+        if model == "tree_exploration":
+            simulator = DolloSimulator(taxa, N_FEATURES, value, 1.0, 0.0, i, True)
+        else:
+            # Cognate class counts are drawn like in the explorations the emulator was fitted to
+            Simulator = SwampSimulator if model == "swamp_exploration" else ChainSimulator
+            simulator = Simulator(taxa, N_FEATURES, value, sampling.exploration_dist(taxa))
+        lines = simulator.generate_data().format_output().splitlines()
+        means.append(tiger.calculate_rates(tiger.read_harvest(lines)[2]).mean())
+    return float(np.mean(means)), float(np.std(means, ddof=1)) / math.sqrt(replicates)
+
+class Emulator():
+    '''Gaussian-process emulators of the mean TIGER rate of the exploration models.'''
+
+    def __init__(self, processes=None):
+        self.processes = processes if processes is not None else {}
+
+    @classmethod
+    def fit(cls, conn):
+        '''Fit an emulator to the exploration results in the database.'''
+        processes = {}
+        for model, param_name in sorted(PARAMETERS.items()):
+            taxa, values, means, variances = observations(conn, model, param_name)
+            if len(means) < 2:
+                print("Not enough results of %s to fit an emulator" % model)
+                continue
+            processes[model] = GaussianProcess.fit(inputs(taxa, values), means, variances)
+        return cls(processes)
+
+    def save(self, filename=EMULATOR_FILE):
+        arrays = {}
+        for model, process in self.processes.items():
+            arrays.update(process.to_arrays(model + "/"))
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename=EMULATOR_FILE):
+        with np.load(filename) as arrays:
+            arrays = dict(arrays)
+        models = sorted({key.split("/")[0] for key in arrays})
+        return cls({model: GaussianProcess.from_arrays(arrays, model + "/") for model in models})
+
+    def predict(self, model, taxa, value):
+        '''Return the emulated mean TIGER rates of model and their standard deviations. taxa and value can be numbers or arrays.'''
+        mean, sd = self.processes[model].predict(inputs(taxa, value))
+        return (mean, sd) if np.ndim(taxa) or np.ndim(value) else (float(mean[0]), float(sd[0]))
+
+    def trusted(self, model, taxa, value, max_sd=MAX_SD):
+        '''Return whether the emulator of model can be trusted at taxa and value: within the explored ranges and with a standard deviation of at most max_sd.'''
+        if model not in self.processes:
+            return False
+        x = self.processes[model].x
+        point = inputs(taxa, value)[0]
+        if (point < x.min(axis=0) - 1e-9).any() or (point > x.max(axis=0) + 1e-9).any():
+            return False
+        return self.predict(model, taxa, value)[1] <= max_sd
+
+    def query(self, model, taxa, value, max_sd=MAX_SD, replicates=N_FALLBACK_REPS):
+        '''Return the mean TIGER rate of model, its standard deviation and whether it was emulated or simulated.'''
+        if self.trusted(model, taxa, value, max_sd):
+            return self.predict(model, taxa, value) + ("emulated",)
+        return simulate(model, taxa, value, replicates) + ("simulated",)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="query",
+                        help="Model (swamp, chain or tree), taxon count and parameter value to query",
+                        metavar='QUERY',
+                        nargs="*")
+
+    parser.add_argument("-f",
+                        dest="fit",
+                        help="Fit the emulators to the results database first",
+                        action="store_true")
+
+    parser.add_argument("-d",
+                        dest="database",
+                        help="Results database",
+                        metavar='DATABASE',
+                        default=results_db.DB_FILE,
+                        type=str)
+
+    parser.add_argument("-e",
+                        dest="emulator",
+                        help="Emulator file",
+                        metavar='EMULATOR',
+                        default=EMULATOR_FILE,
+                        type=str)
+
+    parser.add_argument("-s",
+                        dest="max_sd",
+                        help="Largest standard deviation of an emulated result; other queries are simulated",
+                        metavar='MAX_SD',
+                        default=MAX_SD,
+                        type=float)
+
+    args = parser.parse_args()
+
+    if args.query and len(args.query) != 3:
+        print("A query needs a model, a taxon count and a parameter value")
+        exit(1)
+    if args.fit:
+        if not os.path.isfile(args.database):
+            print("Could not find file", args.database)
+            exit(1)
+        conn = results_db.connect(args.database)
+        emulator = Emulator.fit(conn)
+        conn.close()
+        emulator.save(args.emulator)
+    elif args.query:
+        try:
+            emulator = Emulator.load(args.emulator)
+        except FileNotFoundError:
+            print("Could not find file", args.emulator)
+            exit(1)
+    if args.query:
+        model = args.query[0] + "_exploration"
+        if model not in PARAMETERS:
+            print("Unknown model", args.query[0])
+            exit(1)
+        mean, sd, source = emulator.query(model, int(args.query[1]), float(args.query[2]), args.max_sd)
+        print("%s\t%s\t%s\t%f\t%f\t%s" % (args.query[0], args.query[1], args.query[2], mean, sd, source))
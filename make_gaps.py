@@ -15,16 +15,11 @@ import os
 import master_script
 import random
 import numpy
-import glob
 import copy
 
-TIGER_PARAMS = ["-f","harvest","-n", "-i", "?"]
+import results_db
 
-IN_FILES = [sorted(glob.glob("analyses/pure_tree/*_*1.csv"))[0],
-            sorted(glob.glob("analyses/borrowing_10/*_*1.csv"))[0],
-            sorted(glob.glob("analyses/dialect/*_*1.csv"))[0],
-            sorted(glob.glob("analyses/swamp/*_*1.csv"))[0],
-            "analyses/uralex/uralex.csv"]
+TIGER_PARAMS = ["-f","harvest","-n", "-i", "?"]
 
 DATASETS = ["pure_tree",
             "borrowing_10",
@@ -177,6 +172,7 @@ if __name__ == '__main__':
     sys.path.append(os.path.join(master_script.MATERIALS_FOLDER, master_script.TIGER_FOLDER))
     import formats
     reader = formats.getReader("harvest")
+    conn = results_db.connect()
     results_gapped = {}
     results_missing = {}
     for c in COVERAGES:
@@ -185,16 +181,14 @@ if __name__ == '__main__':
     results_gapped[1.0] = {}
     results_missing[1.0] = {}
 
-    for n in range(len(IN_FILES)):
-        current_data = DATASETS[n]
-        content = reader.getContents(IN_FILES[n])
-        tiger_rates_file = glob.glob(IN_FILES[n][:-4] + "*_rates.txt")[0] # we do not recalculate full rates
-        print("Adding TIGER results from " + tiger_rates_file)
-        with open(tiger_rates_file, "r") as fp:
-            rates = []
-            rates.extend([float(x.strip().split()[-1]) for x in fp.readlines()])
-            results_gapped[1.0][current_data] = numpy.mean(rates)
-            results_missing[1.0][current_data] = numpy.mean(rates)
+    for current_data in DATASETS:
+        # The first replicate of every simulation, and its full rates, which are not recalculated
+        in_file, replicate = results_db.first_dataset(conn, current_data)
+        content = reader.getContents(in_file)
+        print("Adding TIGER results of " + in_file)
+        full_mean = results_db.summary(conn, current_data, "tiger", replicate=replicate).mean
+        results_gapped[1.0][current_data] = full_mean
+        results_missing[1.0][current_data] = full_mean
         for c in COVERAGES:
             gapped_content = make_random_gaps(coverage=c, data=content)
             missing_content = make_random_unknowns(coverage=c, data=content)
@@ -205,17 +199,17 @@ if __name__ == '__main__':
             outfile_missing = os.path.join(DATAGAPS_DIR, current_data + "_" + str(c) + "_unknowns.csv")            
             write_harvest_csv(gapped_content, outfile_gapped)
             write_harvest_csv(missing_content, outfile_missing)
+            gapped_params = {"dataset": current_data, "coverage": c, "kind": "gaps"}
+            missing_params = {"dataset": current_data, "coverage": c, "kind": "unknowns"}
+            results_db.register(outfile_gapped, "datagaps", gapped_params)
+            results_db.register(outfile_missing, "datagaps", missing_params)
             master_script.run_tiger(outfile_gapped, TIGER_PARAMS, outfile_gapped)
             master_script.run_tiger(outfile_missing, TIGER_PARAMS, outfile_missing)
-            with open(outfile_gapped + "_rates.txt", "r") as fp:
-                rates = []
-                rates.extend([float(x.strip().split()[-1]) for x in fp.readlines()])
-                results_gapped[c][current_data] = numpy.mean(rates)
-            with open(outfile_missing + "_rates.txt", "r") as fp:
-                rates = []
-                rates.extend([float(x.strip().split()[-1]) for x in fp.readlines()])
-                results_missing[c][current_data] = numpy.mean(rates)      
+            results_gapped[c][current_data] = results_db.mean(conn, "datagaps", "tiger", results_db.format_params(gapped_params))
+            results_missing[c][current_data] = results_db.mean(conn, "datagaps", "tiger", results_db.format_params(missing_params))
                 
+    conn.close()
+
     print("Writing tables...")
     table_file = []
     table_file.append("dataset")
@@ -1,14 +1,107 @@
 #!/usr/bin/env python3
-import glob
+import argparse
+import concurrent.futures
 from math import log
 import os, os.path
 
 import scipy.stats
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 import numpy
 
+import results_db
+import summaries
+
+PARAM_EXPLORATIONS = [("tree_exploration", "birth_rate"),
+                      ("swamp_exploration", "alpha"),
+                      ("chain_exploration", "alpha")]
+
+class Results():
+    '''TIGER rates, delta scores and Q-residuals from the results database, queried on first use and shared by all plots.'''
+
+    def __init__(self, database=results_db.DB_FILE):
+        self.database = database
+        self._rate_summaries = None
+        self._delta_q = None
+        self._uralex_rates = None
+        self._param_exploration = {}
+
+    def rate_summaries(self):
+        '''Return a dict of analysis name -> RateHistogram of TIGER rates over all replicates, binned by the database.'''
+        if self._rate_summaries is None:
+            conn = results_db.connect(self.database)
+            self._rate_summaries = {model: results_db.histogram(conn, model) for model in results_db.models(conn)}
+            conn.close()
+        return self._rate_summaries
+
+    def delta_q(self):
+        '''Return a dict of analysis name -> (RunningStats of delta scores, RunningStats of Q-residuals) over all replicates.'''
+        if self._delta_q is None:
+            conn = results_db.connect(self.database)
+            self._delta_q = {model: (results_db.summary(conn, model, "delta"), results_db.summary(conn, model, "qresidual"))
+                             for model in results_db.models(conn, "delta")}
+            conn.close()
+        return self._delta_q
+
+    def uralex_rates(self):
+        '''Return a dict of UraLex meaning -> TIGER rate.'''
+        if self._uralex_rates is None:
+            conn = results_db.connect(self.database)
+            self._uralex_rates = results_db.items(conn, "uralex", "tiger")
+            conn.close()
+        return self._uralex_rates
+
+    def param_exploration(self, model, param_name):
+        '''Return a data frame of the mean TIGER rate of every replicate of a parameter exploration model, with its taxon count and parameter value.'''
+        if model not in self._param_exploration:
+            conn = results_db.connect(self.database)
+            rows = results_db.parameter_means(conn, model, "tiger")
+            conn.close()
+            params = [results_db.parse_params(row[0]) for row in rows]
+            assert all(row[3] == 200 for row in rows)
+            self._param_exploration[model] = pd.DataFrame({"id": range(len(rows)),
+                "taxon_count": [str(p["taxa"]) for p in params],
+                param_name: [p[param_name] for p in params],
+                "mean_tiger": [row[2] for row in rows]
+                })
+        return self._param_exploration[model]
+
+    def load(self):
+        '''Read all results now.'''
+        self.rate_summaries()
+        self.delta_q()
+        self.uralex_rates()
+        for model, param_name in PARAM_EXPLORATIONS:
+            self.param_exploration(model, param_name)
+
+results = Results()
+
+def violin_plot(hists, names, scale="area"):
+    '''Draw horizontal violins of the RateHistograms hists, labelled with names from top to bottom, with the quartiles as a bar and the median as a dot. scale is "area" (equal areas), "count" (area proportional to the number of values) or "width" (equal widths).'''
+    stats = [hist.violin_stats() for hist in hists]
+    peaks = numpy.array([s["vals"].max() for s in stats])
+    if scale == "area":
+        widths = peaks / peaks.max()
+    elif scale == "count":
+        counts = numpy.array([s["n"] for s in stats])
+        widths = peaks / peaks.max() * counts / counts.max()
+    else:
+        widths = numpy.ones(len(stats))
+    ax = plt.gca()
+    colors = sns.color_palette(n_colors=len(stats))
+    for i, (s, width) in enumerate(zip(stats, widths)):
+        half_width = 0.4 * width * s["vals"] / s["vals"].max()
+        ax.fill_between(s["coords"], i - half_width, i + half_width, facecolor=colors[i], edgecolor="0.25")
+        ax.plot(s["quartiles"], (i, i), color="0.25", linewidth=5, solid_capstyle="butt")
+        ax.plot(s["median"], i, "o", color="white", markersize=5)
+    ax.set_yticks(range(len(names)))
+    ax.set_yticklabels(names)
+    ax.set_ylim(len(names) - 0.5, -0.5)
+    return ax
+
 def cognate_class_count_plot():
     # Actual class counts
     cognate_counts = []
@@ -38,10 +131,9 @@ def cognate_class_count_plot():
     plt.savefig("plots/cognate_dist.png")
 
 def tiger_rate_dist_plot():
-    rates = []
-    with open("analyses/uralex/uralex_rates.txt","r") as fp:
-        for line in fp:
-            rates.extend([float(line.strip().split()[-1])])
+    rates = list(results.uralex_rates().values())
+    sns.set(style="whitegrid", palette="muted")
+    sns.set_context("paper",font_scale=2.0)
     fig, ax = plt.subplots()
     ax.hist(rates,19)
     ax.set_xlabel("TIGER value")
@@ -50,27 +142,13 @@ def tiger_rate_dist_plot():
     plt.savefig("plots/uralex_rates_dist.png")
 
 def tiger_rate_plot():
-    dfs = []
-    data_models = glob.glob("analyses/*")
-    data_names = []
-    for model in data_models:
-        name = os.path.split(model)[-1]
-        data_names.append(name)
-        rates_files = glob.glob(os.path.join(model, "*rates.txt"))
-        rates = []
-        for rates_file in rates_files:
-            with open(rates_file, "r") as fp:
-                rates.extend([float(x.strip().split()[-1]) for x in fp.readlines()])
-        df = pd.DataFrame({name: rates})
-        dfs.append(df)
-    df = pd.concat(dfs)
-
-    data_names.sort(key=lambda x: df[x].mean())
+    hists = results.rate_summaries()
+    data_names = sorted(hists, key=lambda x: hists[x].mean(), reverse=True)
 
     plt.figure(figsize=(12,12))
     sns.set(style="whitegrid", palette="muted")
     sns.set_context("paper",font_scale=2.0)
-    ax = sns.violinplot(data=df,order=list(reversed(data_names)), orient="h")
+    ax = violin_plot([hists[name] for name in data_names], data_names)
     ax.set(xlabel='TIGER values')
     ax.set_xticks([0.00, 0.25,0.50,0.75,1.00])
     plt.xticks(rotation=90)
@@ -78,15 +156,10 @@ def tiger_rate_plot():
     plt.savefig("plots/tiger_rates_plot.png")
 
 def tiger_rates_semantic_categories():
-    rates = {}
+    rates = results.uralex_rates()
     categories = {}
     categories["basic"] = []
     categories["non-basic"] = []
-    dfs = []
-    with open("analyses/uralex/uralex_rates.txt", "r") as fp:
-        for line in fp:
-            meaning, rate = line.strip().split()
-            rates[meaning] = float(rate)
     with open("uralex_supplement.tsv", "r") as fp:
         fp.readline() # headers
         for line in fp:
@@ -98,12 +171,15 @@ def tiger_rates_semantic_categories():
             if category not in categories:
                 categories[category] = []
             categories[category].append(rates[meaning])
-        df = pd.concat([pd.DataFrame({cat:rates}) for cat,rates in categories.items()])
+    hists = []
+    for cat_rates in categories.values():
+        hists.append(summaries.RateHistogram())
+        hists[-1].add(cat_rates)
 
     plt.figure(figsize=(12,12))
     sns.set(style="whitegrid", palette="muted")
     sns.set_context("paper",font_scale=2.0)
-    ax = sns.violinplot(data=df, orient="h", scale="count")
+    ax = violin_plot(hists, list(categories), scale="count")
     ax.set(xlabel='TIGER values by category')
     ax.set_xticks([0.50,0.75,1.00])
     plt.xticks(rotation=90)
@@ -113,30 +189,12 @@ def tiger_rates_semantic_categories():
 def metric_comparison_plot():
     x_axis = ["pure_tree","borrowing_05","borrowing_10","borrowing_15","borrowing_20","dialect","swamp","uralex"]
     y_axis = []
-    analyses = glob.glob("analyses/*")
-    tiger_rates = {}
-    qresiduals = {}
+    tiger_rates = results.rate_summaries()
     delta_scores = {}
-    
-    for a in analyses:
-        current_analysis = os.path.split(a)[-1]    
-        tiger_files = glob.glob(os.path.join(a, "*rates.txt"))
-        delta_q_files = glob.glob(os.path.join(a,"*delta_qresidual.txt"))
-
-        tiger_rates[current_analysis] = []
-        qresiduals[current_analysis] = []
-        delta_scores[current_analysis] = []
-        
-        for f in tiger_files:
-            with open(f, "r") as fp:
-                tiger_rates[current_analysis].extend([float(x.strip().split()[-1]) for x in fp.readlines()])
-
-        for f in delta_q_files:
-            with open(f, "r") as fp:
-                lines = fp.readlines()
-                for l in lines[1:]:
-                    delta_scores[current_analysis].extend([float(l.strip().split()[1])])
-                    qresiduals[current_analysis].extend([float(l.strip().split()[2])])
+    qresiduals = {}
+    for current_analysis, (deltas, qs) in results.delta_q().items():
+        delta_scores[current_analysis] = deltas
+        qresiduals[current_analysis] = qs
 
 
     sns.set(style="whitegrid", palette="muted")
@@ -144,7 +202,7 @@ def metric_comparison_plot():
     
     y_axis = []
     for k in x_axis:
-        y_axis.append(numpy.mean(tiger_rates[k]))
+        y_axis.append(tiger_rates[k].mean())
 
     plt.subplot(2,2,1)    
     plt.xticks(rotation=90)
@@ -154,7 +212,7 @@ def metric_comparison_plot():
 
     y_axis = []
     for k in x_axis:
-        y_axis.append(numpy.mean(delta_scores[k]))
+        y_axis.append(delta_scores[k].mean)
 
     plt.subplot(2,2,2)    
     plt.xticks(rotation=90)
@@ -164,7 +222,7 @@ def metric_comparison_plot():
 
     y_axis = []
     for k in x_axis:
-        y_axis.append(numpy.mean(qresiduals[k]))
+        y_axis.append(qresiduals[k].mean)
 
     plt.subplot(2,2,3)    
     plt.xticks(rotation=90)
@@ -176,12 +234,8 @@ def metric_comparison_plot():
     plt.savefig("plots/metric_comparison_plot.png", dpi=300)
 
 def tiger_rate_cognates_plot():
-    rates = {}
+    rates = results.uralex_rates()
     cognates = {}
-    with open("analyses/uralex/uralex_rates.txt", "r") as fp:
-        for line in fp:
-            meaning, rate = line.strip().split()
-            rates[meaning] = float(rate)
     with open("uralex_counts.csv","r") as fp: # counts based on minimising strategy
         for line in fp:
             meaning, cognate_count = line.strip().split(",")
@@ -192,9 +246,9 @@ def tiger_rate_cognates_plot():
         rates_sorted.append(rates[k])
         cognates_sorted.append(cognates[k])
     y_axis = range(min(cognates_sorted), max(cognates_sorted)+1)
-    fig,ax = plt.subplots()
     sns.set(style="whitegrid", palette="muted")
     sns.set_context("paper",font_scale=2.0)
+    fig,ax = plt.subplots()
     plt.tight_layout()
     ax.scatter(rates_sorted, cognates_sorted)
     plt.yticks(y_axis[1::2])
@@ -202,51 +256,19 @@ def tiger_rate_cognates_plot():
     ax.set_ylabel('Cognate count')
     plt.savefig("plots/tiger_rates_vs_cognates.png")
 
-def _read_param_exp_rates(directory, param_name, param_values):
-
-    # param_values is used to translate the numeric indicies (1, 2, 3,...) used
-    # in the filenames of simulated data/TIGER values, into the actual numeric
-    # values used
-    ids = []
-    taxon_counts = []
-    params = []
-    mean_tigers = []
-    for i, filename in enumerate(glob.glob(os.path.join(directory, "*_rates.txt"))):
-        print(filename)
-        taxa, _, _, param, n = filename.split("/")[-1].split(".")[0].split("_")
-        print(taxa, param, n)
-        with open(filename, "r") as fp:
-            x, N = 0, 0
-            for line in fp:
-                _, r = line.strip().split("\t")
-                x += float(r)
-                N += 1
-        assert N == 200
-        ids.append(i)
-        mean_tigers.append(x/N)
-        taxon_counts.append(taxa)
-        params.append(param_values[int(param)])
-    df = pd.DataFrame({"id": ids,
-        "taxon_count": taxon_counts,
-        param_name: params,
-        "mean_tiger": mean_tigers
-        })
-#    df.to_csv(os.path.join(directory, "param_exp.csv"))
-    return df
+def shared_values(df, param_col):
+    '''Return the parameter values explored at every taxon count: the whole grid of a grid exploration, or the starting grid of an adaptive one.'''
+    return sorted(set.intersection(*[set(group[param_col]) for _, group in df.groupby("taxon_count")]))
 
 def param_exploration_plot():
+    df = results.param_exploration("tree_exploration", "birth_rate")
+    make_param_exp_plot("tree_param_exploration.png", df, "birth_rate", "Relative cognate birthrate", shared_values(df, "birth_rate"), log_x=True)
 
-    theta = 1000**0.125 # (8th root of 1000)
-    brs = [theta**x for x in range(-8, 9)]
-    df =_read_param_exp_rates("param_exploration/tree", "birth_rate", brs)
-    make_param_exp_plot("tree_param_exploration.png", df, "birth_rate", "Relative cognate birthrate", brs, log_x=True)
+    df = results.param_exploration("swamp_exploration", "alpha")
+    make_param_exp_plot("swamp_param_exploration.png", df, "alpha", "Alpha parameter", shared_values(df, "alpha"))
 
-    alphas = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
-    df =_read_param_exp_rates("param_exploration/swamp", "alpha", alphas)
-    make_param_exp_plot("swamp_param_exploration.png", df, "alpha", "Alpha parameter", alphas)
-
-    df =_read_param_exp_rates("param_exploration/chain", "alpha", alphas)
-    make_param_exp_plot("chain_param_exploration.png", df, "alpha", "Alpha parameter", alphas)
+    df = results.param_exploration("chain_exploration", "alpha")
+    make_param_exp_plot("chain_param_exploration.png", df, "alpha", "Alpha parameter", shared_values(df, "alpha"))
 
 def make_param_exp_plot(filename, df, param_col, param_fancy_name, param_values, log_x=False):
 
@@ -269,16 +291,43 @@ def make_param_exp_plot(filename, df, param_col, param_fancy_name, param_values,
     plt.tight_layout()
     plt.savefig(os.path.join("plots", filename))
 
-def main():
+PLOTS = [cognate_class_count_plot,
+         tiger_rate_plot,
+         tiger_rates_semantic_categories,
+         tiger_rate_dist_plot,
+         metric_comparison_plot,
+         tiger_rate_cognates_plot,
+         param_exploration_plot]
+
+def render(plot):
+    # Start every figure from the default style, so the result does not
+    # depend on which plots were drawn before it in the same process
+    plt.rcdefaults()
+    plot()
+    plt.close("all")
+
+def main(processes=1):
     if not os.path.exists("plots"):
         os.mkdir("plots")
-    cognate_class_count_plot()
-    tiger_rate_plot()
-    tiger_rates_semantic_categories()
-    tiger_rate_dist_plot()
-    metric_comparison_plot()
-    tiger_rate_cognates_plot()
-    param_exploration_plot()
+    if processes > 1:
+        # Read the results once; forked workers inherit the loaded cache
+        results.load()
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            for f in [pool.submit(render, plot) for plot in PLOTS]:
+                f.result()
+    else:
+        for plot in PLOTS:
+            render(plot)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Plot the results of the analyses.")
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of figures to render in parallel",
+                        metavar='PROCESSES',
+                        default=1,
+                        type=int)
+
+    args = parser.parse_args()
+    main(args.processes)
@@ -1,17 +1,17 @@
 #!/usr/bin/python3
 
+import itertools
 import os
-import glob
-import statistics
 
-comparisons = ["pure_tree","borrowing_05","borrowing_10","borrowing_15","borrowing_20","dialect","swamp"]
+import numpy as np
 
-def read_table_from_file(infile):
-    table = []
-    with open(infile,"r") as f:
-        for line in f:
-            table.append(line.strip().rstrip().split("\t"))
-    return table
+import results_db
+
+comparisons = ["pure_tree","borrowing_05","borrowing_10","borrowing_15","borrowing_20","dialect","swamp"]
+metrics = ["tiger","delta","qresidual"]
+N_RESAMPLES = 10000
+CONFIDENCE = 0.95
+RANDOM_SEED = 1234
 
 def a_greater_than_b(a,b,metric,results):
     count = 0
@@ -20,32 +20,12 @@ def a_greater_than_b(a,b,metric,results):
             count += 1
     return count
 
-def make_comparison_table():
+def make_comparison_table(conn):
     results = {}
-    analyses = sorted(glob.glob(os.path.join("analyses","*")))
-    analyses.remove(os.path.join("analyses","uralex"))
-    for a in analyses:
-        basename = os.path.basename(os.path.normpath(a))
-        results[basename] = []
-        replications = sorted(glob.glob(os.path.join(a,"*.csv")))
-        for r in replications:
-            tiger_file = r + "_rates.txt"
-            delta_q_file = r + "_delta_qresidual.txt"
-            tiger_rates = read_table_from_file(tiger_file)
-            delta_q_rates = read_table_from_file(delta_q_file)[1:] # ignore header
-            trates = []
-            dscores = []
-            qresiduals = []
-            for line in tiger_rates:
-                trates.append(float(line[1]))
-            for line in delta_q_rates:
-                dscores.append(float(line[1]))
-                qresiduals.append(float(line[2]))
-            current = {}
-            current["tiger"] = statistics.mean(trates)
-            current["delta"] = statistics.mean(dscores)
-            current["qresidual"] = statistics.mean(qresiduals)
-            results[basename].append(current)
+    for c in comparisons:
+        # Mean of every metric in every replicate, in order of replicate
+        means = {m: results_db.replicate_means(conn, c, m) for m in metrics}
+        results[c] = [dict(zip(metrics, values)) for values in zip(*(means[m] for m in metrics))]
     total = len(results["pure_tree"])
     table = []
     table.append("More tree-like vs. less tree-like\tTIGER rate agreements\tDelta score agreements\tQ-residual agreements\tNumber of replications")
@@ -56,46 +36,62 @@ def make_comparison_table():
         table.append("%s vs. %s\t%i\t%i\t%i\t%i" % (comparisons[i],comparisons[i+1], tiger_cmp, delta_cmp, qres_cmp, total))
     return table
 
-def make_mean_rates_table():
-    results = {}
-    analyses = sorted(glob.glob(os.path.join("analyses","*")))
-    for a in analyses:
-        basename = os.path.basename(os.path.normpath(a))
-        results[basename] = {}
-        results[basename]["delta"] = []
-        results[basename]["tiger"] = []
-        results[basename]["qresidual"] = []
-        replications = sorted(glob.glob(os.path.join(a,"*.csv")))
-        for r in replications:
-            if basename != "uralex":
-                tiger_file = r + "_rates.txt"
-                delta_q_file = r + "_delta_qresidual.txt"
-            else:
-                tiger_file = os.path.splitext(r)[0] + "_rates.txt"
-                delta_q_file = r + "_delta_qresidual.txt"                 
-            tiger_rates = read_table_from_file(tiger_file)
-            delta_q_rates = read_table_from_file(delta_q_file)[1:] # ignore header
-            for line in tiger_rates:
-                results[basename]["tiger"].append(float(line[1]))
-            for line in delta_q_rates:
-                results[basename]["delta"].append(float(line[1]))
-                results[basename]["qresidual"].append(float(line[2]))
+def make_mean_rates_table(conn):
     table = []
     table.append("Simulation\tMean TIGER rate\tMean delta score\tMean Q-residual")
-    for c in comparisons:
-        mean_tiger = statistics.mean(results[c]["tiger"])
-        mean_delta = statistics.mean(results[c]["delta"])
-        mean_qresi = statistics.mean(results[c]["qresidual"])
+    for c in comparisons + ["uralex"]:
+        mean_tiger = results_db.mean(conn, c, "tiger")
+        mean_delta = results_db.mean(conn, c, "delta")
+        mean_qresi = results_db.mean(conn, c, "qresidual")
         table.append("%s\t%f\t%f\t%f" % (c,mean_tiger,mean_delta,mean_qresi))
-    mean_tiger = statistics.mean(results["uralex"]["tiger"])
-    mean_delta = statistics.mean(results["uralex"]["delta"])
-    mean_qresi = statistics.mean(results["uralex"]["qresidual"])
-    table.append("%s\t%f\t%f\t%f" % ("uralex",mean_tiger,mean_delta,mean_qresi))
     return table
     
+def pairwise_comparisons(means, n_resamples=N_RESAMPLES, confidence=CONFIDENCE, seed=RANDOM_SEED):
+    '''Compare every pair of rows of means, a (models x replicates) array of replicate means paired by replicate. Returns the pairs (i, j) and, for each pair, the mean difference of row i from row j, the number of replicates in which row i is greater, a bootstrap confidence interval of the mean difference and the p-value of a paired sign-flip permutation test (exact if there are at most n_resamples sign assignments). All pairs share the same resamples, which are applied to all differences at once as matrix products.'''
+    n_reps = means.shape[1]
+    pairs = list(itertools.combinations(range(means.shape[0]), 2))
+    first, second = (np.array(p, dtype=np.intp) for p in zip(*pairs))
+    differences = means[first] - means[second]
+    observed = differences.mean(axis=1)
+    rng = np.random.default_rng(seed)
+    # Bootstrap: every resample is a vector of replicate counts summing to n_reps
+    counts = rng.multinomial(n_reps, np.full(n_reps, 1 / n_reps), size=n_resamples)
+    boot = differences @ counts.T / n_reps
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(boot, [alpha, 1 - alpha], axis=1)
+    # Permutation: under the null hypothesis the sign of every paired difference is arbitrary
+    if 2 ** n_reps <= n_resamples:
+        # Few enough replicates to enumerate every assignment of signs
+        signs = 1.0 - 2.0 * ((np.arange(2 ** n_reps)[:, None] >> np.arange(n_reps)) & 1)
+        permuted = differences @ signs.T / n_reps
+        p_values = (np.abs(permuted) >= np.abs(observed)[:, None] - 1e-12).mean(axis=1)
+    else:
+        signs = rng.choice(np.array([-1.0, 1.0]), size=(n_resamples, n_reps))
+        permuted = differences @ signs.T / n_reps
+        extreme = (np.abs(permuted) >= np.abs(observed)[:, None] - 1e-12).sum(axis=1)
+        p_values = (extreme + 1) / (n_resamples + 1)
+    greater = (differences > 0).sum(axis=1)
+    return pairs, observed, greater, low, high, p_values
+
+def make_pairwise_table(conn, models=comparisons):
+    table = []
+    table.append("Model A\tModel B\tMetric\tMean difference (A - B)\tCI low\tCI high\tA greater\tp-value\tNumber of replications")
+    for metric in metrics:
+        replicate_means = [results_db.replicate_means(conn, m, metric) for m in models]
+        n_reps = min(len(r) for r in replicate_means)
+        means = np.array([r[:n_reps] for r in replicate_means])
+        pairs, observed, greater, low, high, p_values = pairwise_comparisons(means)
+        for k, (i, j) in enumerate(pairs):
+            table.append("%s\t%s\t%s\t%f\t%f\t%f\t%i\t%g\t%i" % (models[i], models[j], metric, observed[k],
+                                                                   low[k], high[k], greater[k], p_values[k], n_reps))
+    return table
+
 def main():
-    comparisons_table = make_comparison_table()
-    means_table = make_mean_rates_table()
+    conn = results_db.connect()
+    comparisons_table = make_comparison_table(conn)
+    means_table = make_mean_rates_table(conn)
+    pairwise_table = make_pairwise_table(conn)
+    conn.close()
     if not os.path.exists("tables"):
         os.mkdir("tables")
     with open(os.path.join("tables","comparisons.tsv"), "w") as f:
@@ -104,6 +100,9 @@ def main():
     with open(os.path.join("tables","means.tsv"), "w") as f:
         for line in means_table:
             f.write(line + "\n")
+    with open(os.path.join("tables","pairwise_comparisons.tsv"), "w") as f:
+        for line in pairwise_table:
+            f.write(line + "\n")
 
 if __name__ == '__main__':
     main()
@@ -9,16 +9,18 @@ import zipfile
 import sys
 import os
 import glob
-import random
 import subprocess
 import numpy as np
 import scipy.stats
 
+import dataframe
+import results_db
+import sampling
+from refinement import CurveRefinement, refine
 from dollo import DolloSimulator
 from chain import ChainSimulator
-from swamp import SwampSimulator
+from swamp import SwampSimulator, expected_tiger
 from make_tables import main as make_tables
-from make_plots import main as make_plots
 
 MATERIALS_FOLDER    = 'materials'
 ANALYSIS_FOLDER     = 'analyses'
@@ -31,6 +33,7 @@ TIGER_ZIP           = "tiger-calculator.zip"
 TIGER_FOLDER        = "tiger-calculator-d8325684f8d6e60e52fcb3e6c7ad8205aa44ea33"
 N_REPETITIONS       = 100
 N_EXPLORE_REPS      = 20
+PLOT_PROCESSES      = os.cpu_count()
 URALEX_BASE         = "uralex"
 URALEX_N_LANGS      = 26
 URALEX_N_FEATURES   = 313
@@ -41,7 +44,31 @@ DIALECT_BASE        = 'dialect'
 HARVEST_BASE        = 'pure_tree'
 URALEX_COG_BIRTH    = 2.0
 BORROWING_BASE      = 'borrowing'
-URALEX_TIGER_PARAMS = ["-f","cldf","-n", "-x", "Proto-Uralic*", "-i", "?"]
+URALEX_TIGER_PARAMS = ["-f","harvest","-n", "-i", "?"]
+URALEX_EXCLUDED     = "Proto-Uralic*"
+TIGER_PROCESSES     = os.cpu_count()
+NEIGHBORNET_PROCESSES = os.cpu_count()
+SYNONYM_SWEEP_FOLDER = "synonym_sweep"
+SYNONYM_SWEEP_SEEDS = 100
+EXPLORE_TAXA        = (10, 25, 50, 100, 250, 500)
+EXPLORE_ALPHAS      = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+EXPLORE_BIRTHRATES  = tuple((10**0.5)**x for x in range(-6, 7)) # powers of the square root of 10
+# Parameter name and values of every exploration model, in the order of the indices in file names
+EXPLORATION_GRIDS   = {"swamp": ("alpha", EXPLORE_ALPHAS),
+                       "chain": ("alpha", EXPLORE_ALPHAS),
+                       "tree": ("birth_rate", EXPLORE_BIRTHRATES)}
+# Adaptive exploration (off by default, so the published grids are reproduced) starts
+# from coarse grids and bisects where mean TIGER changes fastest
+EXPLORE_ADAPTIVE    = False
+# ABC-SMC calibration of the simulators to UraLex takes hours, so it is opt-in
+CALIBRATE_SIMULATORS = False
+EXPLORE_COARSE_GRIDS = {"swamp": ("alpha", (0.25, 1.0, 5.0)),
+                        "chain": ("alpha", (0.25, 1.0, 5.0)),
+                        "tree": ("birth_rate", (0.001, 0.1, 10.0, 1000.0))}
+EXPLORE_BUDGET      = 100 # simulations per model and taxon count
+EXPLORE_TOLERANCE   = 0.02 # largest change of mean TIGER left between neighbouring values
+CLDF_COLLECTION     = os.path.join(MATERIALS_FOLDER,"cldf_datasets")
+CLDF_EXCLUSIONS     = os.path.join(CLDF_COLLECTION,"exclusions.tsv")
 
 def run(cmd):
     proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
@@ -55,6 +82,10 @@ def write_lines_to_file(lines,filename):
     outfile.close()
     #print("Done.")
 
+def write_rates(lines,filename,dataset):
+    write_lines_to_file(lines,filename)
+    results_db.store_rates(dataset, lines.splitlines())
+
 def download_and_extract(url,filename,destination):
     try:
         zf = zipfile.ZipFile(filename, 'r')
@@ -68,7 +99,7 @@ def download_and_extract(url,filename,destination):
     zf.close()
     print("Done.")
 
-def run_simulator(simulator, output_directory, filebase, repetition=0):
+def run_simulator(simulator, output_directory, filebase, repetition=0, chunk_size=None, model=None, params=None):
 
     try:
         os.makedirs(output_directory, exist_ok=True)
@@ -76,45 +107,69 @@ def run_simulator(simulator, output_directory, filebase, repetition=0):
         print("Failed to create folder %s." % output_directory)
         exit(1)
 
+    filename = os.path.join(output_directory,filebase + "_" + str(repetition+1).zfill(3) + ".csv")
+    if model == None:
+        model = os.path.basename(os.path.normpath(output_directory))
+    if params == None:
+        params = {}
+    results_db.register(filename, model, params, repetition+1)
+    if chunk_size != None:
+        # Stream the features to disk instead of building the whole output in memory
+        print("Writing to file %s" % filename)
+        dataframe.write_chunks(filename, *simulator.generate_chunks(chunk_size))
+        return filename
     data = simulator.generate_data()
     output = data.format_output()
-    filename = os.path.join(output_directory,filebase + "_" + str(repetition+1).zfill(3) + ".csv")
     write_lines_to_file(output, filename)
+    return filename
 
-def run_tree_model(output_directory, filebase, languages, features, cognate_birthrate, cognate_gamma=1.0, borrowing_probability=0.0, repetitions=N_REPETITIONS):
+def run_tree_model(output_directory, filebase, languages, features, cognate_birthrate, cognate_gamma=1.0, borrowing_probability=0.0, repetitions=N_REPETITIONS, common_random_numbers=False, chunk_size=None, model=None, params=None):
     for i in range(repetitions):
-        simulator = DolloSimulator(languages, features, cognate_birthrate, cognate_gamma, borrowing_probability, i)
-        run_simulator(simulator, output_directory, filebase, i)
+        simulator = DolloSimulator(languages, features, cognate_birthrate, cognate_gamma, borrowing_probability, i, common_random_numbers)
+        run_simulator(simulator, output_directory, filebase, i, chunk_size, model, params)
 
 def run_tree_model_with_uralex_params(output_directory, filebase, borrowing_probability=0.0):
     run_tree_model(output_directory, filebase, URALEX_N_LANGS, URALEX_N_FEATURES, URALEX_COG_BIRTH, 1.0, borrowing_probability)
 
-def run_chain_model(output_directory, filebase, languages, features, alpha, dist, repetitions=N_REPETITIONS):
+def run_chain_model(output_directory, filebase, languages, features, alpha, dist, repetitions=N_REPETITIONS, chunk_size=None):
     for i in range(repetitions):
         simulator = ChainSimulator(languages, features, alpha, dist)
-        run_simulator(simulator, output_directory, filebase, i)
+        run_simulator(simulator, output_directory, filebase, i, chunk_size)
 
 def run_chain_model_with_uralex_params(output_directory, filebase):
     run_chain_model(output_directory, filebase, URALEX_N_LANGS, URALEX_N_FEATURES, URALEX_ALPHA, URALEX_COG_DIST, repetitions=N_REPETITIONS)
 
-def run_swamp_model(output_directory, filebase, languages, features, alpha, dist, repetitions=N_REPETITIONS):
+def run_swamp_model(output_directory, filebase, languages, features, alpha, dist, repetitions=N_REPETITIONS, chunk_size=None):
     for i in range(repetitions):
         simulator = SwampSimulator(languages, features, alpha, dist)
-        run_simulator(simulator, output_directory, filebase, i)
+        run_simulator(simulator, output_directory, filebase, i, chunk_size)
 
 def run_swamp_model_with_uralex_params(output_directory, filebase):
     run_swamp_model(output_directory, filebase, URALEX_N_LANGS, URALEX_N_FEATURES, URALEX_ALPHA, URALEX_COG_DIST)
 
-def run_tiger(filename,params,outfile=None):
-    print("Calculating TIGER rates for %s" % filename)
-    params = params + [filename]
-    tigercmd = os.path.join(MATERIALS_FOLDER,TIGER_FOLDER, "tiger-calculator.py")
-    code,out,err = run([PYTHON_CMD, tigercmd] + params)
+def run_tiger(filename,params,outfile=None,processes=1):
+    # The native TIGER of tiger.py, which reproduces tiger-calculator, is used for every dataset
+    print("Calculating TIGER rates for %s with %i processes" % (filename, processes))
+    params = params + ["-p", str(processes), filename]
+    code,out,err = run([PYTHON_CMD, "tiger.py"] + params)
     print(err.decode("utf-8"), file=sys.stderr)
     if outfile == None:
-        write_lines_to_file(out.decode("utf-8"), filename + "_rates.txt")
+        write_rates(out.decode("utf-8"), filename + "_rates.txt", filename)
     else:
-        write_lines_to_file(out.decode("utf-8"), outfile + "_rates.txt")
+        write_rates(out.decode("utf-8"), outfile + "_rates.txt", filename)
+
+def run_sampled_tiger(filename,params,target_se=None,budget=None,outfile=None):
+    print("Estimating TIGER rates for %s from sampled characters" % filename)
+    if outfile == None:
+        outfile = filename
+    params = params + [filename, "-e", outfile + "_rates_stderr.txt"]
+    if target_se != None:
+        params += ["-s", str(target_se)]
+    if budget != None:
+        params += ["-b", str(budget)]
+    code,out,err = run([PYTHON_CMD, "tiger.py"] + params)
+    print(err.decode("utf-8"), file=sys.stderr)
+    write_rates(out.decode("utf-8"), outfile + "_rates.txt", filename)
 
 def harvest_to_nexus(directory, filename):
     print("Creating NEXUS for %s..." % filename)
@@ -123,7 +178,7 @@ def harvest_to_nexus(directory, filename):
     write_lines_to_file(out.decode("utf-8"), os.path.join(directory,"splitstree_input.nex"))
 
 def cldf_to_harvest(directory, cldf_path):
-    code,out,err = run([PYTHON_CMD, "cldf2harvest.py", "-x", "Proto-Uralic*", cldf_path]) 
+    code,out,err = run([PYTHON_CMD, "cldf2harvest.py", "-x", URALEX_EXCLUDED, cldf_path])
     print(err.decode("utf-8"), file=sys.stderr)
     write_lines_to_file(out.decode("utf-8"), os.path.join(directory,"uralex.csv"))
 
@@ -133,6 +188,47 @@ def calculate_delta_and_q(filename):
     code,out,err = run([PYTHON_CMD, "calculate_delta_and_q.py"] + params)
     print(err.decode("utf-8"), file=sys.stderr)
     write_lines_to_file(out.decode("utf-8"), filename + "_delta_qresidual.txt")
+    results_db.store_delta_q(filename, out.decode("utf-8").splitlines())
+
+def jackknife_delta_and_q(filename):
+    # Which taxa drive the conflicting signal: all leave-one-out scores from a single pass over the quartets
+    print("Calculating leave-one-out delta scores and Q-residuals for %s" % filename)
+    code,out,err = run([PYTHON_CMD, "calculate_delta_and_q.py", "-j", filename])
+    print(err.decode("utf-8"), file=sys.stderr)
+    write_lines_to_file(out.decode("utf-8"), filename + "_jackknife.txt")
+
+def run_neighbornets(directory, processes=NEIGHBORNET_PROCESSES):
+    print("Computing NeighborNets for %s" % directory)
+    filenames = sorted(glob.glob(os.path.join(directory,"*.csv")))
+    code,out,err = run([PYTHON_CMD, "neighbornet.py", "-p", str(processes)] + filenames)
+    print(err.decode("utf-8"), file=sys.stderr)
+    write_lines_to_file(out.decode("utf-8"), os.path.join(directory,"neighbornet_fits.txt"))
+
+def synonym_sweep(cldf_path, outdir):
+    # All synonym resolution strategies from a single reading of the data
+    print("Comparing synonym resolution strategies for %s" % cldf_path)
+    params = ["-x", URALEX_EXCLUDED, "-r", str(SYNONYM_SWEEP_SEEDS), "-o", outdir, cldf_path]
+    code,out,err = run([PYTHON_CMD, "synonym_sweep.py"] + params)
+    print(out.decode("utf-8"))
+    print(err.decode("utf-8"), file=sys.stderr)
+
+def calibrate_simulators(cldf_path, outbase):
+    # Posterior samples of the parameters of every model, fitted jointly to several summaries of the data
+    print("Calibrating simulator parameters to %s" % cldf_path)
+    params = ["-x", URALEX_EXCLUDED, "-o", outbase, cldf_path]
+    code,out,err = run([PYTHON_CMD, "abc_calibration.py"] + params)
+    print(out.decode("utf-8"))
+    print(err.decode("utf-8"), file=sys.stderr)
+
+def analyse_cldf_collection(folder, outfile):
+    # Every CLDF dataset in the folder is analysed like UraLex, into one table
+    params = ["-x", URALEX_EXCLUDED, "-o", outfile, folder]
+    if os.path.isfile(CLDF_EXCLUSIONS):
+        params = ["-e", CLDF_EXCLUSIONS] + params
+    print("Analysing CLDF datasets in %s" % folder)
+    code,out,err = run([PYTHON_CMD, "batch_cldf.py"] + params)
+    print(out.decode("utf-8"))
+    print(err.decode("utf-8"), file=sys.stderr)
 
 def get_uralex_counts():
     code,out,err = run([PYTHON_CMD, "get_uralex_counts.py"])    
@@ -187,10 +283,15 @@ def analyse_all_datasets():
         print("Failed to create folder %s." % uralexdir)
         exit(1)
     uralexdata = os.path.join(MATERIALS_FOLDER,URALEX_FOLDER,"cldf")
-    run_tiger(uralexdata,URALEX_TIGER_PARAMS,outfile=os.path.join(uralexdir,URALEX_BASE))
+    # The CLDF data is read once into a cached store; TIGER rates, delta and Q
+    # are all calculated from the harvest matrix built from it
     cldf_to_harvest(uralexdir, uralexdata)
+    results_db.register(os.path.join(uralexdir,"uralex.csv"), URALEX_BASE)
+    run_tiger(os.path.join(uralexdir,"uralex.csv"),URALEX_TIGER_PARAMS,outfile=os.path.join(uralexdir,URALEX_BASE),processes=TIGER_PROCESSES)
     calculate_delta_and_q(os.path.join(uralexdir,"uralex.csv"))
+    jackknife_delta_and_q(os.path.join(uralexdir,"uralex.csv"))
     harvest_to_nexus(uralexdir, os.path.join(uralexdir, "uralex.csv"))
+    synonym_sweep(uralexdata, SYNONYM_SWEEP_FOLDER)
     
     print("Done.")    
 
@@ -228,6 +329,11 @@ def analyse_all_datasets():
                 harvest_to_nexus(borrowingdir, i)
             calculate_delta_and_q(i)
 
+def compute_neighbornets():
+    # Split networks and their fit for every replicate of every analysis
+    for directory in sorted(glob.glob(os.path.join(ANALYSIS_FOLDER,"*"))):
+        run_neighbornets(directory)
+
 def explore_parameter_space():
 
     dirname = "param_exploration"
@@ -241,32 +347,35 @@ def explore_parameter_space():
             print("Failed to create folder %s." % subdirname)
             exit(1)
 
+    if EXPLORE_ADAPTIVE:
+        explore_adaptively(dirname)
+    else:
+        explore_grids(dirname)
+
+def explore_grids(dirname):
+
     # Do swamp and chain model exploration
     print("Exploring swamp and chain model parameter spaces...")
 
-    for taxa_count in (10, 25, 50, 100, 250, 500):
-        for i, alpha in enumerate((0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)):
+    # Exact expected swamp TIGER rates for every simulated replicate, to validate the simulations against
+    swamp_expected = ["taxa\talpha\treplicate\texpected_mean\texpected_variance\n"]
+    for taxa_count in EXPLORE_TAXA:
+        for i, alpha in enumerate(EXPLORE_ALPHAS):
             basename = "{}_taxa_alpha_{}".format(taxa_count, i)
 
             for i in range(N_EXPLORE_REPS):
-                if taxa_count == 10:
-                    dist = scipy.stats.binom(taxa_count, 0.33)
-                else:
-                    p = max(random.normalvariate(0.33, 0.1), 0.13)
-                    dist = scipy.stats.binom(taxa_count, p)
+                dist = sampling.exploration_dist(taxa_count)
 
                 for name, Simulator in zip(("swamp", "chain"), (SwampSimulator, ChainSimulator)):
                     subdirname = os.path.join(dirname, name)
                     simulator = Simulator(taxa_count, 200, alpha, dist)
-                    while True:
-                        try:
-                            data = simulator.generate_data()
-                            break
-                        except ValueError:
-                            pass
+                    data = simulator.generate_data()
                     output = data.format_output()
                     filename = os.path.join(subdirname,basename + "_" + str(i+1).zfill(len(str(N_EXPLORE_REPS))) + ".csv")
                     write_lines_to_file(output, filename)
+                    results_db.register(filename, name + "_exploration", {"taxa": taxa_count, "alpha": alpha}, i+1)
+                swamp_expected.append("%d\t%s\t%d\t%f\t%g\n" % ((taxa_count, alpha, i+1) + expected_tiger(taxa_count, alpha, dist)))
+    write_lines_to_file(swamp_expected, os.path.join(dirname, "swamp_expected.tsv"))
 
     for name in ("swamp", "chain"):
         subdirname = os.path.join(dirname, name)
@@ -277,14 +386,62 @@ def explore_parameter_space():
     print("Exploring tree model parameter space...")
 
     subdirname = os.path.join(dirname, "tree")
-    theta = 10**0.5 # (square root of 10)
-    for taxa_count in (10, 25, 50, 100, 250, 500):
-        for i, relative_cognate_br in enumerate((theta**x for x in range(-6, 7))):
+    for taxa_count in EXPLORE_TAXA:
+        for i, relative_cognate_br in enumerate(EXPLORE_BIRTHRATES):
             basename = "{}_taxa_br_{}".format(taxa_count, i)
-            run_tree_model(subdirname, basename, taxa_count, features=200, cognate_birthrate=relative_cognate_br, repetitions=N_EXPLORE_REPS)
+            # Replicate i uses the same (cached) tree and the same random draws at every birthrate
+            run_tree_model(subdirname, basename, taxa_count, features=200, cognate_birthrate=relative_cognate_br, repetitions=N_EXPLORE_REPS, common_random_numbers=True,
+                           model="tree_exploration", params={"taxa": taxa_count, "birth_rate": relative_cognate_br})
     for filename in sorted(glob.glob(os.path.join(subdirname,"*.csv"))):
         run_tiger(filename,["-f","harvest","-n"])
 
+def explore_adaptively(dirname):
+    # Every model and taxon count gets its own curve, refined where mean TIGER
+    # changes fastest or is most uncertain. Parameter values are written into
+    # the file names, as they are not on a fixed grid.
+    swamp_expected = ["taxa\talpha\treplicate\texpected_mean\texpected_variance\n"]
+    points = ["model\ttaxa\tparameter\tvalue\treplicates\tmean_tiger\tstderr\n"]
+    conn = results_db.connect()
+    for name, (param_name, coarse_values) in sorted(EXPLORE_COARSE_GRIDS.items()):
+        print("Exploring %s model parameter space..." % name)
+        model = name + "_exploration"
+        subdirname = os.path.join(dirname, name)
+        for taxa_count in EXPLORE_TAXA:
+            def simulate(jobs):
+                means = []
+                for value, replicate in jobs:
+                    params = {"taxa": taxa_count, param_name: value}
+                    basename = "{}_taxa_{}={}".format(taxa_count, param_name, value)
+                    if name == "tree":
+                        # Replicate i uses the same (cached) tree and the same random draws at every birthrate
+                        simulator = DolloSimulator(taxa_count, 200, value, 1.0, 0.0, replicate-1, True)
+                    else:
+                        dist = sampling.exploration_dist(taxa_count)
+                        Simulator = SwampSimulator if name == "swamp" else ChainSimulator
+                        simulator = Simulator(taxa_count, 200, value, dist)
+                        if name == "swamp":
+                            swamp_expected.append("%d\t%s\t%d\t%f\t%g\n" % ((taxa_count, value, replicate) + expected_tiger(taxa_count, value, dist)))
+                    filename = run_simulator(simulator, subdirname, basename, replicate-1, model=model, params=params)
+                    run_tiger(filename,["-f","harvest","-n"])
+                    means.append(results_db.summary(conn, model, "tiger", results_db.format_params(params), replicate).mean)
+                return means
+            refinement = CurveRefinement(coarse_values, tolerance=EXPLORE_TOLERANCE, max_reps=N_EXPLORE_REPS)
+            used = refine(refinement, simulate, EXPLORE_BUDGET)
+            print("Explored %s with %d taxa at %d values with %d simulations" % (name, taxa_count, len(refinement.values()), used))
+            for value in refinement.values():
+                stats = refinement.stats[value]
+                points.append("%s\t%d\t%s\t%s\t%d\t%f\t%f\n" % (name, taxa_count, param_name, value, stats.n, stats.mean,
+                                                                 refinement.standard_error(value)))
+    conn.close()
+    write_lines_to_file(swamp_expected, os.path.join(dirname, "swamp_expected.tsv"))
+    write_lines_to_file(points, os.path.join(dirname, "adaptive_points.tsv"))
+
+def fit_emulator():
+    # Mean TIGER rates of other parameter values are then emulated instead of simulated
+    print("Fitting emulators of mean TIGER rates...")
+    code,out,err = run([PYTHON_CMD, "emulator.py", "-f"])
+    print(err.decode("utf-8"), file=sys.stderr)
+
 def gap_test():
     code,out,err = run([PYTHON_CMD, "make_gaps.py"])
     print(err.decode("utf-8"), file=sys.stderr)
@@ -296,11 +453,20 @@ if __name__ == '__main__':
 
     generate_synthetic_datasets()
     analyse_all_datasets()
+    compute_neighbornets()
+    if os.path.isdir(CLDF_COLLECTION):
+        analyse_cldf_collection(CLDF_COLLECTION, "cldf_results.tsv")
     explore_parameter_space()
+    fit_emulator()
+    if CALIBRATE_SIMULATORS:
+        calibrate_simulators(os.path.join(MATERIALS_FOLDER,URALEX_FOLDER,"cldf"),
+                             os.path.join(ANALYSIS_FOLDER,URALEX_BASE,"abc_posterior"))
     gap_test()
 
     print("Tabulating agreements with simulations...")
     make_tables()
         
     print("Plotting results...")
-    make_plots()
+    # Imported here so that the plotting libraries are only loaded when needed
+    from make_plots import main as make_plots
+    make_plots(PLOT_PROCESSES)
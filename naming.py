@@ -0,0 +1,42 @@
+import itertools
+import string
+
+import numpy as np
+
+dummy_isos = sorted(["".join(chars) for chars in itertools.combinations(string.ascii_lowercase,3)])
+
+def _encode(codes, length):
+    '''Spell out integer codes as base-26 strings of lowercase letters.'''
+    codes = np.asarray(codes, dtype=np.int64)
+    digits = (codes[:, None] // 26 ** np.arange(length - 1, -1, -1, dtype=np.int64)) % 26
+    letters = np.array(list(string.ascii_lowercase))[digits]
+    return ["".join(row) for row in letters.tolist()]
+
+def _name_length(n, min_length):
+    length = min_length
+    while 26 ** length < n:
+        length += 1
+    return length
+
+def taxon_names(n, rng):
+    '''Return n distinct random taxon names drawn with the random.Random-like rng. Up to len(dummy_isos) taxa get three-letter ISO-like names; larger sets get names of the smallest sufficient length (at least four letters).'''
+    if n <= len(dummy_isos):
+        return rng.sample(dummy_isos, n)
+    length = _name_length(n, 4)
+    # Sampling from a range only stores the selected codes
+    return _encode(rng.sample(range(26 ** length), n), length)
+
+def random_names(n, length):
+    '''Return n distinct random names of at least length letters, drawn with numpy's global random state. The length is increased if there are fewer than n such names.'''
+    length = _name_length(n, length)
+    space = 26 ** length
+    codes = {}
+    while len(codes) < n:
+        for code in np.random.randint(0, space, size=n - len(codes)).tolist():
+            codes[code] = None
+    return _encode(list(codes)[:n], length)
+
+def feature_names(n, prefix="f_", min_width=3):
+    '''Return n feature names with zero-padded indices wide enough to sort in index order.'''
+    width = max(min_width, len(str(n - 1)))
+    return ["%s%0*d" % (prefix, width, i) for i in range(n)]
@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+# Compute NeighborNet split networks (Bryant & Moulton 2004) for harvest-style
+# CSV files without SplitsTree.
+#
+# Distances are uncorrected p-distances between the bit-packed binarised rows
+# that harvestcsv2nexus.py writes, ignoring missing data, which is what
+# SplitsTree computes from that NEXUS file. The circular ordering is built by
+# the NeighborNet agglomeration, and the weights of the circular splits are
+# fitted by non-negative least squares. Every split is an interval of the
+# ordering, so the split distances and their adjoint are evaluated with prefix
+# sums in O(n^2) time without forming the design matrix, and the number of
+# pairs separated by two splits follows from the sizes of their intervals. The
+# active set method therefore only solves the normal equations of the free
+# splits, which are few as most weights of a fitted network are zero. Small
+# networks are fitted with the explicit design matrix instead, which is faster
+# below about 40 taxa.
+
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+import scipy.linalg
+from scipy.optimize import nnls
+
+from bitmatrix import BinaryMatrix
+
+PARSER_DESC = "Compute NeighborNet split networks for harvest-style CSV files."
+MIN_SPLIT_WEIGHT = 1e-6
+DENSE_SPLITS = 780 # 40 taxa
+
+def _reduce(d, slots, labels, nbr, reductions, x, y, z, next_label):
+    '''Replace the path x - y - z by two new nodes u (in the slot of x) and v (in the slot of z).'''
+    dx, dy, dz = d[x].copy(), d[y].copy(), d[z].copy()
+    du = (2 * dx + dy) / 3
+    dv = (dy + 2 * dz) / 3
+    duv = (dx[y] + dy[z] + dx[z]) / 3
+    d[x], d[:, x] = du, du
+    d[z], d[:, z] = dv, dv
+    d[x, x] = d[z, z] = 0
+    d[x, z] = d[z, x] = duv
+    reductions.append((labels[x], labels[y], labels[z], next_label, next_label + 1))
+    labels[x], labels[z] = next_label, next_label + 1
+    slots.remove(y)
+    nbr[x], nbr[z] = z, x
+    nbr[y] = -1
+
+def circular_ordering(distances):
+    '''Return the NeighborNet circular ordering of the taxa (row indices) of a distance matrix.'''
+    n = len(distances)
+    if n <= 3:
+        return list(range(n))
+    d = np.array(distances, dtype=float)
+    slots = list(range(n))
+    labels = list(range(n))
+    nbr = np.full(n, -1)
+    reductions = []
+    next_label = n
+    while len(slots) > 3:
+        clusters = [[s] if nbr[s] < 0 else [s, nbr[s]] for s in slots if nbr[s] < 0 or s < nbr[s]]
+        m = len(clusters)
+        if len(slots) == 4 and m == 2:
+            (p, p2), (q, q2) = clusters
+            if d[p, q] + d[p2, q2] < d[p, q2] + d[p2, q]:
+                _reduce(d, slots, labels, nbr, reductions, p, q, q2, next_label)
+            else:
+                _reduce(d, slots, labels, nbr, reductions, p, q2, q, next_label)
+            break
+        # Averaging matrix from nodes to clusters
+        members = np.zeros((m, n))
+        for i, cluster in enumerate(clusters):
+            members[i, cluster] = 1 / len(cluster)
+        node_to_cluster = d @ members.T
+        cluster_d = members @ node_to_cluster
+        r = cluster_d.sum(axis=1)
+        q_crit = (m - 2) * cluster_d - r[:, None] - r[None, :]
+        np.fill_diagonal(q_crit, np.inf)
+        ci, cj = np.unravel_index(np.argmin(q_crit), q_crit.shape)
+        # Choose the nodes to join as if the two clusters were split into singletons
+        candidates = clusters[ci] + clusters[cj]
+        m_hat = m + len(candidates) - 2
+        others = [k for k in range(m) if k not in (ci, cj)]
+        r_hat = {}
+        for x in candidates:
+            r_hat[x] = node_to_cluster[x, others].sum() + d[x, candidates].sum()
+        best = None
+        for x in clusters[ci]:
+            for y in clusters[cj]:
+                score = (m_hat - 2) * d[x, y] - r_hat[x] - r_hat[y]
+                if best is None or score < best[0]:
+                    best = (score, x, y)
+        _, x, y = best
+        u, v = nbr[x], nbr[y]
+        if u < 0 and v < 0:
+            nbr[x], nbr[y] = y, x
+        elif v < 0:
+            _reduce(d, slots, labels, nbr, reductions, u, x, y, next_label)
+            next_label += 2
+        elif u < 0:
+            _reduce(d, slots, labels, nbr, reductions, x, y, v, next_label)
+            next_label += 2
+        else:
+            _reduce(d, slots, labels, nbr, reductions, u, x, y, next_label)
+            next_label += 2
+            # The path is now u' - y' - v, with u' and y' in the slots of u and y
+            _reduce(d, slots, labels, nbr, reductions, u, y, v, next_label)
+            next_label += 2
+    order = [labels[s] for s in slots]
+    for x, y, z, u, v in reversed(reductions):
+        i = order.index(u)
+        order = order[i:] + order[:i]
+        if order[1] == v:
+            order = [x, y, z] + order[2:]
+        else:
+            order = [x] + order[1:-1] + [z, y]
+    i = order.index(0)
+    return order[i:] + order[:i]
+
+def _split_distances(w, n):
+    '''Return the distances (pairs a < b of positions in the ordering, in row-major order) induced by the weights w of the interval splits [i, j], 1 <= i <= j <= n-1.'''
+    W = np.zeros((n + 1, n + 1))
+    W[np.triu_indices(n - 1)[0] + 1, np.triu_indices(n - 1)[1] + 1] = w
+    a, b = np.triu_indices(n, 1)
+    # Splits [i, j] with i <= a <= j < b
+    R = np.cumsum(W, axis=0)
+    F = np.cumsum(R, axis=1)
+    first = F[a, b - 1] - np.where(a > 0, F[a, a - 1], 0)
+    # Splits [i, j] with a < i <= b <= j
+    T = np.cumsum(W[:, ::-1], axis=1)[:, ::-1]
+    G = np.cumsum(T, axis=0)
+    second = G[b, b] - G[a, b]
+    return first + second
+
+def _split_adjoint(r, n):
+    '''Return, for every interval split [i, j], the sum of r over the pairs it separates.'''
+    R = np.zeros((n, n))
+    a, b = np.triu_indices(n, 1)
+    R[a, b] = r
+    R[b, a] = r
+    rows = np.concatenate(([0], np.cumsum(R.sum(axis=1))))
+    S = np.zeros((n + 1, n + 1))
+    S[1:, 1:] = np.cumsum(np.cumsum(R, axis=0), axis=1)
+    i, j = np.triu_indices(n - 1)
+    i, j = i + 1, j + 1
+    inside = S[j + 1, j + 1] - S[i, j + 1] - S[j + 1, i] + S[i, i]
+    return rows[j + 1] - rows[i] - inside
+
+def _design_matrix(n):
+    '''Return the 0/1 matrix of pairs of positions (rows) separated by the interval splits (columns).'''
+    a, b = np.triu_indices(n, 1)
+    i, j = np.triu_indices(n - 1)
+    i, j = i + 1, j + 1
+    a_in = (i <= a[:, None]) & (a[:, None] <= j)
+    b_in = (i <= b[:, None]) & (b[:, None] <= j)
+    return (a_in != b_in).astype(float)
+
+def _unconstrained_weights(d, n):
+    '''Return the split weights which reproduce the distances d (pairs of positions, as in _split_distances) exactly.'''
+    D = np.zeros((n + 1, n + 1))
+    D[np.triu_indices(n, 1)] = d
+    D += D.T
+    # Position n is position 0 again
+    D[n], D[:, n] = D[0], D[:, 0]
+    i, j = np.triu_indices(n - 1)
+    i, j = i + 1, j + 1
+    return (D[i - 1, j] + D[i, j + 1] - D[i, j] - D[i - 1, j + 1]) / 2
+
+def _split_gram(i, j, n):
+    '''Return the numbers of pairs of positions separated by both of every two of the interval splits [i, j]: the Gram matrix of their columns of the design matrix.'''
+    size = j - i + 1
+    # Positions inside both splits
+    both = np.maximum(np.minimum(j[:, None], j[None, :]) - np.maximum(i[:, None], i[None, :]) + 1, 0)
+    s, t = size[:, None], size[None, :]
+    # A pair separated by both has one position inside both splits and the other
+    # inside neither, or one position inside each split only
+    return both * (n - s - t + both) + (s - both) * (t - both)
+
+def _free_least_squares(b, n, free):
+    '''Return the least squares split weights when only the free weights may be non-zero, by the normal equations of the free splits. b is the adjoint of the distances.'''
+    i, j = np.triu_indices(n - 1)
+    index = np.flatnonzero(free)
+    gram = _split_gram(i[index] + 1, j[index] + 1, n).astype(float)
+    z = np.zeros(len(free))
+    try:
+        z[index] = scipy.linalg.cho_solve(scipy.linalg.cho_factor(gram), b[index])
+    except np.linalg.LinAlgError:
+        z[index] = np.linalg.lstsq(gram, b[index], rcond=None)[0]
+    return z
+
+def _nonnegative_weights(d, n):
+    '''Return the non-negative least squares split weights for the distances d, using the active set method of Lawson and Hanson. Starting from no free weights, up to n constrained weights with the steepest descent are released at a time while the residual keeps decreasing; after that they are released one at a time, which guarantees termination.'''
+    x = _unconstrained_weights(d, n)
+    if x.min() >= 0:
+        return x
+    tolerance = 1e-10 * max(d.max(), 1e-300) * len(d)
+    b = _split_adjoint(d, n)
+    x = np.zeros(len(x))
+    free = np.zeros(len(x), dtype=bool)
+    block = True
+    best = np.inf
+    while True:
+        residual = d - _split_distances(x, n)
+        objective = residual @ residual
+        if block and objective >= best * (1 - 1e-12):
+            block = False
+        elif not block and not free[released]:
+            # The released weight could not be increased within the accuracy of the solver
+            return x
+        best = min(best, objective)
+        gradient = _split_adjoint(residual, n)
+        gradient[free] = 0
+        if gradient.max() <= tolerance:
+            return x
+        if block:
+            steepest = np.argsort(gradient)[::-1][:n]
+            released = steepest[gradient[steepest] > tolerance]
+        else:
+            released = np.argmax(gradient)
+        free[released] = True
+        while True:
+            z = _free_least_squares(b, n, free)
+            negative = free & (z <= 0)
+            if not negative.any():
+                x = z
+                break
+            # Move towards z until the first weight reaches zero
+            alpha = np.min(np.where(x[negative] > 0, x[negative] / (x[negative] - z[negative]), 0.0))
+            x = x + alpha * (z - x)
+            free &= x > 0
+            x[~free] = 0
+
+def split_weights(distances, order):
+    '''Fit non-negative weights to the circular splits of order by least squares. Returns the splits (as sets of positions [i, j] of order), their weights and the fitted distances between the taxa.'''
+    n = len(order)
+    d = np.asarray(distances, dtype=float)[np.ix_(order, order)][np.triu_indices(n, 1)]
+    if len(d) <= DENSE_SPLITS:
+        weights = nnls(_design_matrix(n), d)[0]
+    else:
+        weights = _nonnegative_weights(d, n)
+    fitted = np.zeros((n, n))
+    fitted[np.triu_indices(n, 1)] = _split_distances(weights, n)
+    fitted += fitted.T
+    position = np.empty(n, dtype=np.intp)
+    position[order] = np.arange(n)
+    i, j = np.triu_indices(n - 1)
+    return list(zip(i + 1, j + 1)), weights, fitted[np.ix_(position, position)]
+
+def fit(distances, fitted):
+    '''Return the least squares fit (percent) of the fitted distances.'''
+    d = np.asarray(distances)[np.triu_indices(len(distances), 1)]
+    p = fitted[np.triu_indices(len(distances), 1)]
+    return 100 * (1 - ((d - p) ** 2).sum() / (d ** 2).sum())
+
+def neighbornet(taxa, distances):
+    '''Return the NeighborNet of the distance matrix: the circular ordering, the splits with weights of at least MIN_SPLIT_WEIGHT as (taxa on the side without the first taxon, weight) pairs, and the fit.'''
+    if len(taxa) < 3:
+        return list(range(len(taxa))), [], 100.0
+    order = circular_ordering(distances)
+    intervals, weights, fitted = split_weights(distances, order)
+    splits = [(order[i:j + 1], w) for (i, j), w in zip(intervals, weights) if w >= MIN_SPLIT_WEIGHT]
+    return order, splits, fit(distances, fitted)
+
+def format_nexus(taxa, order, splits, fit_percent):
+    '''Return the lines of a NEXUS file with the taxa and the splits.'''
+    lines = []
+    lines.append("#NEXUS")
+    lines.append("")
+    lines.append("BEGIN Taxa;")
+    lines.append("DIMENSIONS ntax=%d;" % len(taxa))
+    lines.append("TAXLABELS")
+    for i, taxon in enumerate(taxa):
+        lines.append("[%d] '%s'" % (i + 1, taxon))
+    lines.append(";")
+    lines.append("END; [Taxa]")
+    lines.append("")
+    lines.append("BEGIN Splits;")
+    lines.append("DIMENSIONS ntax=%d nsplits=%d;" % (len(taxa), len(splits)))
+    lines.append("FORMAT labels=no weights=yes confidences=no intervals=no;")
+    lines.append("PROPERTIES fit=%.2f leastsquares cyclic;" % fit_percent)
+    lines.append("CYCLE " + " ".join(str(t + 1) for t in order) + ";")
+    lines.append("MATRIX")
+    for i, (side, weight) in enumerate(splits):
+        lines.append("[%d, size=%d] \t %s \t %s," % (i + 1, len(side), weight, " ".join(str(t + 1) for t in sorted(side))))
+    lines.append(";")
+    lines.append("END; [Splits]")
+    return [line + "\n" for line in lines]
+
+def process_file(filename):
+    '''Compute the NeighborNet of a harvest-style CSV file and write it to filename + "_neighbornet.nex". Returns the fit and the number of splits.'''
+    with open(filename, "r") as f:
+        matrix = BinaryMatrix.from_harvest(f.readlines())
+    order, splits, fit_percent = neighbornet(matrix.taxa, matrix.p_distances())
+    with open(filename + "_neighbornet.nex", "w") as f:
+        f.writelines(format_nexus(matrix.taxa, order, splits, fit_percent))
+    return float(fit_percent), len(splits)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="infiles",
+                        help="Input files",
+                        metavar='INFILE',
+                        nargs="+",
+                        type=str)
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of files to process in parallel",
+                        metavar='PROCESSES',
+                        default=1,
+                        type=int)
+
+    args = parser.parse_args()
+
+    for filename in args.infiles:
+        if not os.path.isfile(filename):
+            print("Could not find file",filename)
+            quit()
+
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(process_file, args.infiles)
+    print("file\tfit\tsplits")
+    for filename, (fit_percent, n_splits) in zip(args.infiles, results):
+        print("%s\t%s\t%d" % (filename, fit_percent, n_splits))
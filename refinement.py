@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# Adaptive sampling of a noisy curve over one parameter.
+#
+# The curve starts from a coarse grid of parameter values, each sampled with a
+# few replicates. Intervals across which the mean clearly changes by more than
+# the tolerance are bisected first, steepest first; then values whose mean is
+# still too uncertain get more replicates, which settles whether the remaining
+# intervals need bisecting. This goes on until the curve is resolved everywhere
+# or the simulation budget is spent. Intervals are bisected on a log scale by
+# default, which suits rate and concentration parameters spanning orders of
+# magnitude.
+
+import math
+
+from running_stats import RunningStats
+
+class CurveRefinement():
+    '''Replicate results of a noisy function of one parameter, with the choice of where to simulate next.'''
+
+    def __init__(self, values, log_scale=True, tolerance=0.02, target_se=0.01, min_width=0.125,
+                 initial_reps=5, max_reps=20, digits=6):
+        self.log_scale = log_scale
+        self.tolerance = tolerance # largest change of the mean left between neighbouring values
+        self.target_se = target_se
+        self.min_width = min_width # narrowest interval to bisect, in log10 units on a log scale
+        self.initial_reps = initial_reps
+        self.max_reps = max_reps
+        self.digits = digits # significant digits of new parameter values
+        self.stats = {}
+        self.started = {} # replicates started at every value, finished or not
+        for value in values:
+            self._add_value(value)
+
+    def _add_value(self, value):
+        self.stats[value] = RunningStats()
+        self.started[value] = 0
+
+    def _scale(self, value):
+        return math.log10(value) if self.log_scale else value
+
+    def _midpoint(self, low, high):
+        middle = (self._scale(low) + self._scale(high)) / 2
+        if self.log_scale:
+            middle = 10 ** middle
+        # Rounded, so the value is the same in file names, the database and here
+        return float("%.*g" % (self.digits, middle))
+
+    def values(self):
+        return sorted(self.stats)
+
+    def standard_error(self, value):
+        stats = self.stats[value]
+        return stats.std() / math.sqrt(stats.n) if stats.n > 1 else math.inf
+
+    def _replicate_jobs(self, value, count):
+        jobs = [(value, self.started[value] + r + 1) for r in range(count)]
+        self.started[value] += count
+        return jobs
+
+    def next_jobs(self, budget=None):
+        '''Return the (value, replicate number) pairs to simulate next, at most budget of them. Values without results come first, then new values bisecting intervals which are steep beyond doubt, then more replicates of uncertain values, then new values bisecting the remaining steep intervals. Returns an empty list when the curve is resolved.'''
+        if budget is None:
+            budget = math.inf
+        jobs = []
+        for value in self.values():
+            if self.started[value] == 0:
+                jobs.extend(self._replicate_jobs(value, min(self.initial_reps, budget - len(jobs))))
+        if not jobs:
+            jobs = self._bisect(self.steep_intervals(margin=2), budget)
+        if not jobs:
+            for value in self.values():
+                if self.started[value] < self.max_reps and self.standard_error(value) > self.target_se:
+                    # Doubling the replicates shrinks the standard error by a factor of sqrt(2)
+                    count = min(self.started[value], self.max_reps - self.started[value], budget - len(jobs))
+                    jobs.extend(self._replicate_jobs(value, count))
+        if not jobs:
+            jobs = self._bisect(self.steep_intervals(), budget)
+        return jobs
+
+    def _bisect(self, intervals, budget):
+        jobs = []
+        for change, low, high in intervals:
+            middle = self._midpoint(low, high)
+            if budget - len(jobs) < 1 or middle in self.stats:
+                continue
+            self._add_value(middle)
+            jobs.extend(self._replicate_jobs(middle, min(self.initial_reps, budget - len(jobs))))
+        return jobs
+
+    def steep_intervals(self, margin=0):
+        '''Return the (change of the mean, low, high) of every interval between neighbouring values which should be bisected, steepest first. With a margin, the change must exceed the tolerance by margin standard errors of the change.'''
+        values = self.values()
+        intervals = []
+        for low, high in zip(values, values[1:]):
+            change = abs(self.stats[high].mean - self.stats[low].mean)
+            if margin:
+                change -= margin * math.hypot(self.standard_error(low), self.standard_error(high))
+            if change > self.tolerance and self._scale(high) - self._scale(low) > self.min_width:
+                intervals.append((change, low, high))
+        return sorted(intervals, reverse=True)
+
+    def add(self, value, result):
+        '''Record the result of one replicate at value.'''
+        self.stats[value].push(result)
+
+def refine(refinement, simulate, budget):
+    '''Sample the curve of refinement with simulate, a function from a list of (value, replicate number) to the list of their results, until it is resolved or budget simulations have been run. Returns the number of simulations run.'''
+    used = 0
+    while used < budget:
+        jobs = refinement.next_jobs(budget - used)
+        if not jobs:
+            break
+        for (value, _), result in zip(jobs, simulate(jobs)):
+            refinement.add(value, result)
+        used += len(jobs)
+    return used
@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+# SQLite database of analysis results.
+#
+# Every dataset (simulated replicate or real wordlist) is registered with its
+# model, parameters and replicate number when it is written, and every result
+# calculated from it is stored as one row per character or taxon and metric.
+# The count, mean, variance, minimum and maximum of every metric in every
+# replicate are stored alongside as mergeable running statistics, so summary
+# tables only merge one row per replicate, and databases of partial runs can be
+# merged. Tables and plots are made with SQL queries on these tables, which are
+# indexed on model and parameters. Results from earlier runs, which were only
+# written to files, can be added with the backfill command; it recovers the
+# metadata from the folder layout used by master_script.
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+
+import summaries
+from running_stats import RunningStats
+
+PARSER_DESC = "Add results written to files by earlier runs, or the databases of partial runs, to the results database."
+DB_FILE = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    path TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    replicate INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    replicate INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS results_model_params ON results (model, params, metric, replicate);
+CREATE TABLE IF NOT EXISTS replicate_stats (
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    replicate INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL,
+    m2 REAL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (model, params, metric, replicate)
+);
+"""
+
+def connect(filename=DB_FILE):
+    '''Open the results database, creating the tables if needed.'''
+    conn = sqlite3.connect(filename, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+def format_params(params):
+    '''Return the canonical string of a dict of parameter values.'''
+    return ",".join("%s=%s" % (k, params[k]) for k in sorted(params))
+
+def parse_params(params):
+    '''Return the dict of parameter values of a parameter string. Numeric values are converted to numbers.'''
+    values = {}
+    for pair in params.split(","):
+        if not pair:
+            continue
+        k, v = pair.split("=", 1)
+        try:
+            values[k] = int(v)
+        except ValueError:
+            try:
+                values[k] = float(v)
+            except ValueError:
+                values[k] = v
+    return values
+
+def register(path, model, params=None, replicate=0, filename=DB_FILE):
+    '''Record the model, parameters and replicate number of the dataset in path.'''
+    if params is None:
+        params = {}
+    with connect(filename) as conn:
+        conn.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)",
+                     (os.path.normpath(path), model, format_params(params), replicate))
+    conn.close()
+
+def describe(path, grids=None):
+    '''Return the model, parameter string and replicate number of a dataset written by an earlier run, from its location: analyses/MODEL/NAME_REPLICATE.csv, param_exploration/MODEL/TAXA_taxa_PARAM_INDEX_REPLICATE.csv (or TAXA_taxa_PARAM=VALUE_REPLICATE.csv) or datagaps/DATASET_COVERAGE_KIND.csv. grids maps exploration models to their parameter values, which the file names only give by index. Returns None for other files.'''
+    if grids is None:
+        grids = {}
+    parts = os.path.normpath(path).split(os.sep)
+    stem = os.path.splitext(parts[-1])[0]
+    if len(parts) >= 3 and parts[-3] == "analyses":
+        match = re.search(r"_(\d+)$", stem)
+        return parts[-2], "", int(match.group(1)) if match else 0
+    if len(parts) >= 3 and parts[-3] == "param_exploration":
+        if parts[-2] not in grids:
+            return None
+        name, values = grids[parts[-2]]
+        # Adaptive explorations give the value itself: TAXA_taxa_PARAM=VALUE_REPLICATE.csv
+        match = re.match(r"(\d+)_taxa_\w+=([^_]+)_(\d+)$", stem)
+        if match is not None:
+            taxa, value, replicate = match.groups()
+            return (parts[-2] + "_exploration", format_params({"taxa": int(taxa), name: float(value)}),
+                    int(replicate))
+        match = re.match(r"(\d+)_taxa_(.+)_(\d+)_(\d+)$", stem)
+        if match is None:
+            return None
+        taxa, _, index, replicate = match.groups()
+        return (parts[-2] + "_exploration", format_params({"taxa": int(taxa), name: values[int(index)]}),
+                int(replicate))
+    if len(parts) >= 2 and parts[-2] == "datagaps":
+        match = re.match(r"(.+)_([\d.]+)_(gaps|unknowns)$", stem)
+        if match is None:
+            return None
+        dataset, coverage, kind = match.groups()
+        return "datagaps", format_params({"dataset": dataset, "coverage": coverage, "kind": kind}), 0
+    return None
+
+def lookup(conn, path, grids=None):
+    '''Return the model, parameter string and replicate number of a registered dataset, or those given by describe.'''
+    row = conn.execute("SELECT model, params, replicate FROM datasets WHERE path = ?",
+                       (os.path.normpath(path),)).fetchone()
+    return row if row is not None else describe(path, grids)
+
+def _store(conn, dataset, rows, grids=None):
+    '''Replace the results of dataset for the metrics of rows, a list of (item, metric, value).'''
+    meta = lookup(conn, dataset, grids)
+    if meta is None:
+        print("No model known for %s, not storing its results" % dataset)
+        return
+    meta = tuple(meta)
+    for metric in sorted({metric for _, metric, _ in rows}):
+        conn.execute("DELETE FROM results WHERE model = ? AND params = ? AND metric = ? AND replicate = ?",
+                     (meta[0], meta[1], metric, meta[2]))
+        stats = RunningStats.from_values([value for _, m, value in rows if m == metric])
+        conn.execute("INSERT OR REPLACE INTO replicate_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     meta + (metric,) + stats.to_tuple())
+    conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                     [meta + (item, metric, value) for item, metric, value in rows])
+
+def rates_rows(lines):
+    '''Return result rows of the lines of a rates file. Rates without character names are numbered.'''
+    rows = []
+    for i, line in enumerate(l for l in lines if l.strip()):
+        fields = line.strip().split("\t")
+        rows.append((fields[0] if len(fields) > 1 else str(i), "tiger", float(fields[-1])))
+    return rows
+
+def delta_q_rows(lines):
+    '''Return result rows of the lines of a delta score and Q-residual file.'''
+    rows = []
+    for line in lines[1:]: # ignore header
+        if line.strip():
+            taxon, delta, q = line.strip().split("\t")
+            rows.append((taxon, "delta", float(delta)))
+            rows.append((taxon, "qresidual", float(q)))
+    return rows
+
+def store_rates(dataset, lines, filename=DB_FILE):
+    '''Store the TIGER rates of dataset given as the lines of a rates file.'''
+    with connect(filename) as conn:
+        _store(conn, dataset, rates_rows(lines))
+    conn.close()
+
+def store_delta_q(dataset, lines, filename=DB_FILE):
+    '''Store the delta scores and Q-residuals of dataset given as the lines of their output file.'''
+    with connect(filename) as conn:
+        _store(conn, dataset, delta_q_rows(lines))
+    conn.close()
+
+def _read_lines(filename):
+    with open(filename, "r") as fp:
+        return fp.readlines()
+
+def backfill(folders=("analyses", "param_exploration", "datagaps"), grids=None, filename=DB_FILE):
+    '''Store the results of all datasets in folders which have result files.'''
+    with connect(filename) as conn:
+        for folder in folders:
+            for dataset in sorted(glob.glob(os.path.join(folder, "**", "*.csv"), recursive=True)):
+                rows = []
+                for rates_file in (dataset + "_rates.txt", os.path.splitext(dataset)[0] + "_rates.txt"):
+                    if os.path.isfile(rates_file):
+                        rows += rates_rows(_read_lines(rates_file))
+                        break
+                if os.path.isfile(dataset + "_delta_qresidual.txt"):
+                    rows += delta_q_rows(_read_lines(dataset + "_delta_qresidual.txt"))
+                meta = lookup(conn, dataset, grids)
+                if rows and meta is not None:
+                    print("Storing results of %s" % dataset)
+                    conn.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)", (os.path.normpath(dataset),) + tuple(meta))
+                    _store(conn, dataset, rows, grids)
+    conn.close()
+
+def first_dataset(conn, model, params=""):
+    '''Return the path and replicate number of the registered dataset of model with the lowest replicate number, or None.'''
+    return conn.execute("SELECT path, replicate FROM datasets WHERE model = ? AND params = ? ORDER BY replicate, path LIMIT 1",
+                        (model, params)).fetchone()
+
+def models(conn, metric="tiger", params=""):
+    '''Return the names of the models with results for metric with the parameter string params.'''
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT model FROM replicate_stats WHERE params = ? AND metric = ? ORDER BY model", (params, metric))]
+
+def replicate_stats(conn, model, metric, params=""):
+    '''Return the RunningStats of metric in every replicate of model, in order of replicate.'''
+    return [RunningStats(*row) for row in conn.execute(
+        "SELECT n, mean, m2, min, max FROM replicate_stats WHERE model = ? AND params = ? AND metric = ? ORDER BY replicate",
+        (model, params, metric))]
+
+def replicate_means(conn, model, metric, params=""):
+    '''Return the mean of metric over the items of every replicate of model, in order of replicate.'''
+    return [stats.mean for stats in replicate_stats(conn, model, metric, params)]
+
+def summary(conn, model, metric, params="", replicate=None):
+    '''Return the RunningStats of metric over all items and replicates of model, or of one replicate, merged from the statistics of the replicates.'''
+    stats = RunningStats()
+    query = "SELECT n, mean, m2, min, max FROM replicate_stats WHERE model = ? AND params = ? AND metric = ?"
+    args = (model, params, metric)
+    if replicate is not None:
+        query += " AND replicate = ?"
+        args += (replicate,)
+    for row in conn.execute(query, args):
+        stats.merge(RunningStats(*row))
+    return stats
+
+def mean(conn, model, metric, params=""):
+    '''Return the mean of metric over all items and replicates of model.'''
+    return summary(conn, model, metric, params).mean
+
+def items(conn, model, metric, params="", replicate=0):
+    '''Return a dict of item -> value of metric in one replicate of model.'''
+    return dict(conn.execute(
+        "SELECT item, value FROM results WHERE model = ? AND params = ? AND metric = ? AND replicate = ?",
+        (model, params, metric, replicate)))
+
+def parameter_means(conn, model, metric):
+    '''Return the parameter string, replicate number, mean of metric and number of items of every replicate of model with any parameters.'''
+    return conn.execute(
+        "SELECT params, replicate, mean, n FROM replicate_stats WHERE model = ? AND metric = ? ORDER BY params, replicate",
+        (model, metric)).fetchall()
+
+def merge_databases(sources, filename=DB_FILE):
+    '''Add the datasets and results of the databases of partial runs in sources. Results of the same replicate are replaced.'''
+    conn = connect(filename)
+    for source in sources:
+        print("Merging %s" % source)
+        conn.execute("ATTACH DATABASE ? AS source", (source,))
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO datasets SELECT * FROM source.datasets")
+            conn.execute("""DELETE FROM results WHERE EXISTS (SELECT 1 FROM source.replicate_stats s
+                            WHERE s.model = results.model AND s.params = results.params
+                            AND s.metric = results.metric AND s.replicate = results.replicate)""")
+            conn.execute("INSERT INTO results SELECT * FROM source.results")
+            conn.execute("INSERT OR REPLACE INTO replicate_stats SELECT * FROM source.replicate_stats")
+        conn.execute("DETACH DATABASE source")
+    conn.close()
+
+def histogram(conn, model, metric="tiger", params="", bins=summaries.N_BINS):
+    '''Return a RateHistogram of all values of metric for model, with the binning done by the database.'''
+    hist = summaries.RateHistogram(bins)
+    where = "FROM results WHERE model = ? AND params = ? AND metric = ?"
+    for b, n in conn.execute("SELECT MIN(MAX(CAST(value * ? AS INTEGER), 0), ?), COUNT(*) " + where + " GROUP BY 1",
+                             (bins, bins - 1, model, params, metric)):
+        hist.counts[b] = n
+    total, total_sq, low, high = conn.execute("SELECT SUM(value), SUM(value * value), MIN(value), MAX(value) " + where,
+                                              (model, params, metric)).fetchone()
+    if hist.n > 0:
+        hist.total, hist.total_sq, hist.min, hist.max = total, total_sq, low, high
+    return hist
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="folders",
+                        help="Folders to search for results, or databases to merge with -m",
+                        metavar='FOLDER',
+                        nargs="*",
+                        default=["analyses", "param_exploration", "datagaps"])
+
+    parser.add_argument("-d",
+                        dest="database",
+                        help="Results database",
+                        metavar='DATABASE',
+                        default=DB_FILE,
+                        type=str)
+
+    parser.add_argument("-m",
+                        dest="merge",
+                        help="Merge the given databases of partial runs instead of searching folders",
+                        action="store_true")
+
+    args = parser.parse_args()
+    if args.merge:
+        for source in args.folders:
+            if not os.path.isfile(source):
+                print("Could not find file", source)
+                exit(1)
+        merge_databases(args.folders, args.database)
+    else:
+        # The parameter values of the exploration runs are only known to master_script
+        from master_script import EXPLORATION_GRIDS
+        backfill(args.folders, EXPLORATION_GRIDS, args.database)
@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+
+class RunningStats():
+    '''Count, mean, variance, minimum and maximum of a stream of values,
+    updated with Welford's algorithm. Statistics of separate streams, e.g.
+    of different replicates or of partial runs in different processes, can
+    be merged into the statistics of all their values.'''
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, min=math.inf, max=-math.inf):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2 # sum of squared differences from the mean
+        self.min = min
+        self.max = max
+
+    def push(self, x):
+        '''Add a single value.'''
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def extend(self, values):
+        '''Add a batch of values.'''
+        values = np.asarray(values, dtype=float)
+        if len(values) > 0:
+            mean = float(values.mean())
+            self.merge(RunningStats(len(values), mean, float(((values - mean) ** 2).sum()),
+                                    float(values.min()), float(values.max())))
+
+    def merge(self, other):
+        '''Add the values summarised by another RunningStats.'''
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def variance(self, ddof=1):
+        return self.m2 / (self.n - ddof) if self.n > ddof else float("nan")
+
+    def std(self, ddof=1):
+        return math.sqrt(self.variance(ddof))
+
+    def to_tuple(self):
+        return (self.n, self.mean, self.m2, self.min, self.max)
+
+    @classmethod
+    def from_values(cls, values):
+        stats = cls()
+        stats.extend(values)
+        return stats
@@ -0,0 +1,29 @@
+import random
+
+import numpy as np
+import scipy.stats
+
+def sample_truncated(dist, size, low, high):
+    '''Draw size values from the discrete scipy.stats distribution dist truncated to low..high, by inverse-CDF sampling over the finite support.'''
+    support = np.arange(low, high + 1)
+    probs = dist.pmf(support)
+    total = probs.sum()
+    if not total > 0:
+        print("Distribution has no probability mass between %d and %d." % (low, high))
+        exit(1)
+    cdf = np.cumsum(probs) / total
+    draws = np.searchsorted(cdf, np.random.random_sample(size), side="right")
+    return support[np.minimum(draws, len(support) - 1)]
+
+def sample_dirichlet(alpha, k):
+    '''Draw k probabilities from a symmetric Dirichlet(alpha) distribution. The Gamma variates are generated in log space, using Gamma(alpha) = Gamma(alpha + 1) * U**(1/alpha), so that small alphas cannot underflow to an all-zero vector.'''
+    log_gammas = np.log(np.random.standard_gamma(alpha + 1, k)) + np.log(np.random.random_sample(k)) / alpha
+    probs = np.exp(log_gammas - log_gammas.max())
+    return probs / probs.sum()
+
+def exploration_dist(n_langs):
+    '''Return the cognate class count distribution of one replicate of the swamp and chain parameter explorations: binomial, with a probability drawn for every replicate except with 10 languages.'''
+    if n_langs == 10:
+        return scipy.stats.binom(n_langs, 0.33)
+    p = max(random.normalvariate(0.33, 0.1), 0.13)
+    return scipy.stats.binom(n_langs, p)
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# Draw the NeighborNets of all analysis folders with SplitsTree and Inkscape.
+#
+# Instead of starting a SplitsTree JVM for every folder, the folders are divided
+# between a few sessions, each of which loads and exports all of its datasets
+# from one command script. Sessions, and the SVG to PNG conversions of the
+# folders they finish, run in parallel. Folders whose outputs are newer than
+# their input are skipped.
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PARSER_DESC = "Draw NeighborNets for all analysis folders with SplitsTree and Inkscape."
+INPUT_FILE = "splitstree_input.nex"
+NETWORK_FILE = "splitstree_network.nex"
+SVG_FILE = "splitstree_network.svg"
+PNG_FILE = "splitstree_network.png"
+
+DATASET_CMDS = """load file={input}
+update
+export file={network}
+exportgraphics file={svg} size={size} format=svg
+"""
+
+def is_newer(output, source):
+    '''Return True if output exists and was modified after source.'''
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(source)
+
+def needs_network(directory):
+    source = os.path.join(directory, INPUT_FILE)
+    return not (is_newer(os.path.join(directory, NETWORK_FILE), source) and
+                is_newer(os.path.join(directory, SVG_FILE), source))
+
+def needs_png(directory):
+    return not is_newer(os.path.join(directory, PNG_FILE), os.path.join(directory, SVG_FILE))
+
+def write_session_script(directories, size):
+    '''Write a SplitsTree command script which processes all directories in one session and return its filename.'''
+    fd, filename = tempfile.mkstemp(prefix="splitstree_", suffix=".txt")
+    with os.fdopen(fd, "w") as f:
+        f.write("begin SplitsTree;\n\n")
+        for directory in directories:
+            directory = os.path.abspath(directory)
+            f.write(DATASET_CMDS.format(input=os.path.join(directory, INPUT_FILE),
+                                        network=os.path.join(directory, NETWORK_FILE),
+                                        svg=os.path.join(directory, SVG_FILE),
+                                        size=size))
+        f.write("quit\n\nend;\n")
+    return filename
+
+def run_session(splitstree_cmd, directories, size):
+    script = write_session_script(directories, size)
+    try:
+        proc = subprocess.run([splitstree_cmd, "-g", "-c", script], stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finally:
+        os.remove(script)
+    print(proc.stderr.decode("utf-8"), file=sys.stderr, end="")
+    return directories
+
+def convert_to_png(inkscape_cmd, directory, dpi):
+    print("Converting %s" % os.path.join(directory, SVG_FILE))
+    proc = subprocess.run([inkscape_cmd, "--export-png=" + os.path.join(directory, PNG_FILE),
+                           "--export-dpi", str(dpi), os.path.join(directory, SVG_FILE)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    print(proc.stderr.decode("utf-8"), file=sys.stderr, end="")
+
+def main(splitstree_cmd, analysis_folder="analyses", sessions=2, conversions=2, inkscape_cmd="inkscape", size=500, dpi=150):
+    directories = sorted(d for d in glob.glob(os.path.join(analysis_folder, "*"))
+                         if os.path.isfile(os.path.join(d, INPUT_FILE)))
+    stale = [d for d in directories if needs_network(d)]
+    for d in directories:
+        if d not in stale:
+            print("Skipping %s, network is up to date" % d)
+    groups = [stale[i::sessions] for i in range(sessions) if stale[i::sessions]]
+    with concurrent.futures.ThreadPoolExecutor(max(len(groups), 1)) as session_pool, \
+         concurrent.futures.ThreadPoolExecutor(conversions) as conversion_pool:
+        conversion_jobs = [conversion_pool.submit(convert_to_png, inkscape_cmd, d, dpi)
+                           for d in directories if d not in stale and needs_png(d)]
+        session_jobs = []
+        for group in groups:
+            print("Starting SplitsTree session for %s" % ", ".join(group))
+            session_jobs.append(session_pool.submit(run_session, splitstree_cmd, group, size))
+        for job in concurrent.futures.as_completed(session_jobs):
+            for d in job.result():
+                if os.path.exists(os.path.join(d, SVG_FILE)):
+                    conversion_jobs.append(conversion_pool.submit(convert_to_png, inkscape_cmd, d, dpi))
+                else:
+                    print("SplitsTree did not produce %s" % os.path.join(d, SVG_FILE), file=sys.stderr)
+        for job in conversion_jobs:
+            job.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="splitstree",
+                        help="SplitsTree command",
+                        metavar='SPLITSTREE_CMD',
+                        type=str)
+
+    parser.add_argument("-d",
+                        dest="folder",
+                        help="Folder containing the analysis folders",
+                        metavar='FOLDER',
+                        default="analyses",
+                        type=str)
+
+    parser.add_argument("-s",
+                        dest="sessions",
+                        help="Number of SplitsTree sessions to run in parallel",
+                        metavar='SESSIONS',
+                        default=2,
+                        type=int)
+
+    parser.add_argument("-c",
+                        dest="conversions",
+                        help="Number of Inkscape conversions to run in parallel",
+                        metavar='CONVERSIONS',
+                        default=2,
+                        type=int)
+
+    parser.add_argument("-i",
+                        dest="inkscape",
+                        help="Inkscape command",
+                        metavar='INKSCAPE_CMD',
+                        default="inkscape",
+                        type=str)
+
+    args = parser.parse_args()
+
+    for cmd in (args.splitstree, args.inkscape):
+        if shutil.which(cmd) is None:
+            print("Could not find command", cmd)
+            exit(1)
+
+    main(args.splitstree, args.folder, args.sessions, args.conversions, args.inkscape)
@@ -0,0 +1,90 @@
+import numpy as np
+
+N_BINS = 500
+
+class RateHistogram():
+    '''Fixed-bin histogram of values in [low, high] with their count, sum and
+    sum of squares. Histograms with the same bins can be merged, so histograms
+    of parts of an analysis add up to the histogram of the whole analysis
+    without keeping the values themselves.'''
+
+    def __init__(self, bins=N_BINS, low=0.0, high=1.0):
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def edges(self):
+        return np.linspace(self.low, self.high, len(self.counts) + 1)
+
+    def centres(self):
+        edges = self.edges()
+        return (edges[:-1] + edges[1:]) / 2
+
+    def add(self, values):
+        '''Add values to the histogram. Values outside [low, high] go to the first or last bin.'''
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        scaled = (values - self.low) / (self.high - self.low) * len(self.counts)
+        bins = np.clip(scaled.astype(np.intp), 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.total += float(values.sum())
+        self.total_sq += float((values ** 2).sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        '''Add the contents of another histogram with the same bins.'''
+        if len(other.counts) != len(self.counts) or (other.low, other.high) != (self.low, self.high):
+            raise ValueError("Cannot merge histograms with different bins")
+        self.counts += other.counts
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.n
+
+    def std(self):
+        n = self.n
+        return np.sqrt(max(self.total_sq - self.total ** 2 / n, 0.0) / max(n - 1, 1))
+
+    def quantile(self, q):
+        '''Return the q-quantile(s), interpolating linearly within bins.'''
+        edges = self.edges()
+        cumulative = np.concatenate(([0], np.cumsum(self.counts))) / self.n
+        return np.clip(np.interp(q, cumulative, edges), self.min, self.max)
+
+    def density(self, points, bandwidth=None):
+        '''Gaussian kernel density estimate at points, using the bin centres as
+        weighted data. The default bandwidth follows Scott's rule.'''
+        if bandwidth is None:
+            bandwidth = self.std() * self.n ** (-1 / 5)
+        # Never smooth less than the bins can resolve
+        bandwidth = max(bandwidth, (self.high - self.low) / len(self.counts))
+        used = self.counts > 0
+        z = (np.asarray(points)[:, None] - self.centres()[used]) / bandwidth
+        kernel = np.exp(-0.5 * z ** 2) / np.sqrt(2 * np.pi)
+        return kernel @ self.counts[used] / (self.n * bandwidth)
+
+    def violin_stats(self, n_points=200):
+        '''Return the statistics needed to draw a violin: the density over the range of the data, and the mean, median and quartiles.'''
+        coords = np.linspace(self.min, self.max, n_points)
+        q1, median, q3 = self.quantile([0.25, 0.5, 0.75])
+        return {"coords": coords,
+                "vals": self.density(coords),
+                "mean": self.mean(),
+                "median": median,
+                "quartiles": (q1, q3),
+                "min": self.min,
+                "max": self.max,
+                "n": self.n}
@@ -1,11 +1,13 @@
 #!/usr/bin/python3
 
-import string
 import scipy
+import scipy.special
+import scipy.stats
 import numpy
-import random
 
 import dataframe
+import naming
+import sampling
 
 class SwampSimulator():
     
@@ -29,85 +31,59 @@ class SwampSimulator():
         self._taxon_namelen = taxon_namelen
 
     def generate_data(self):
-        # Generate data
+        # Generate data and insert into harvest-style DataFrame
+        return dataframe.from_chunks(*self.generate_chunks(self._n_features))
+
+    def generate_chunks(self, chunk_size):
+        """Generate the data chunk_size features at a time. Returns the taxa, the number of features and an iterator over (feature names, taxa x features matrix) chunks."""
         taxa = self._generateTaxa()
-        alignment = self._generateAlignment()
-        features = self._generateFeatureNames()
-        # Insert into harvest-style DataFrame
-        data = dataframe.DataFrame()
-        for taxon, values in zip(taxa, alignment):
-            if taxon not in data.data:
-                data.data[taxon] = {}
-            assert len(values) == len(features)
-            for feature, value in zip(features, values):
-                data.data[taxon][feature] = value
-        return data
+        # Generate cognate class counts
+        feature_sizes = sampling.sample_truncated(self.dist, self._n_features, 1, self._n_langs)
+        return taxa, self._n_features, self._generateAlignmentChunks(feature_sizes, chunk_size)
         
     def _generateTaxa(self):
-        taxa = []
-        for i in range(self._n_langs):
-            current = self._generateTaxon()
-            while current in taxa:
-                current = self._generateTaxon()
-            taxa.append(current)
-        return taxa
-    
-    def _generateTaxon(self):
-        taxon = ""
-        for i in range(self._taxon_namelen):
-            taxon += numpy.random.choice(list(string.ascii_lowercase))
-        return taxon
+        # Names are lengthened if there are not enough distinct names of _taxon_namelen letters
+        return naming.random_names(self._n_langs, self._taxon_namelen)
 
-    def _generateAlignment(self):
-        output = []
-        for i in range(self._n_langs):
-            output.append([])
-
-        # Generate cognate class counts
-        feature_sizes = self.dist.rvs(self._n_features)
-        test_counter = 5000000
-        while 0 in feature_sizes or max(feature_sizes) > self._n_langs:
-            feature_sizes = self.dist.rvs(self._n_features)
-            test_counter -= 1
-            if test_counter == 0:
-                print("Could not generate a suitable sample of features with many sampling attempts.")
-                exit(1)
+    def _generateAlignmentChunks(self, feature_sizes, chunk_size):
+        features = self._generateFeatureNames()
+        for start in range(0, self._n_features, chunk_size):
+            stop = min(start + chunk_size, self._n_features)
+            output = dataframe.state_matrix(self._n_langs, stop - start)
+            # Assign taxa to cognate classes
+            for i in range(start, stop):
+                output[:, i - start] = self._generateAssignments(feature_sizes[i])
+            yield features[start:stop], output
 
-        # Assign taxa to cognate classes
-        for classes in feature_sizes:
-            # For each meaning, we're going to generate a list `assignments`, which contains one element per language.
-            # The elements indicate which cognate class a language is assigned to.
-            # E.g. If there were 3 cognate classes for a meaning, and 10 languages, a valid `assignments` might be:
-            # assignments = [0, 1, 1, 0, 2, 0, 0, 0, 0, 2]
-            # We are generating these knowing only the number of cognates, e.g. 3 above.
-            # It is a requirement that each cognate class is represented at least once.  So, we start off `assignments`
-            # by sampling each cognate class precisely once (in numeric order, but fear not, all will get shuffled at the end)
-            assignments = list(range(classes))
-            # Now, we probably need to make some additional assignments.  How many?
-            remaining = self._n_langs - len(assignments)
-            if remaining:
-                # Now, we don't care, for the remaining assignments, that every cognate class is represented at least once.
-                # We can just sample randomly, and add the results to what we already have.  We could just sample uniformly
-                # from range(0, classes) (and previously did!), but it's not realistic that all cognate classes are equally
-                # sized on average.  So, let's instead sample the remaining assignments from a non-uniform multinomial
-                # distribution, which is itself sampled from a symmetric Dirichlet distribution.  By setting the Dirichlet's
-                # alpha parameter very high, we can gracefully degrade to the original uniform distribution.
-                # First, sample the multinomial probabilities.
-                multinomial_probs = scipy.stats.dirichlet.rvs(alpha=[self.alpha]*classes)[0]
-                # Now sample the counts of each class, after making `remaining` draws from the multinomial dist
-                multinomial_counts = scipy.stats.multinomial.rvs(n=remaining,p=multinomial_probs/sum(multinomial_probs))
-                # Add the actual assignments to `assignments`
-                for j,count in enumerate(multinomial_counts):
-                    assignments.extend([j]*count)
-            # Shuffle everything as promised earlier
-            random.shuffle(assignments)
-            # Sanity checks
-            assert len(assignments) == self._n_langs
-            assert len(set(assignments)) == classes
-            # Add to master output
-            for j, x in enumerate(assignments):
-                output[j].append(x)
-        return output
+    def _generateAssignments(self, classes):
+        # For each meaning, we're going to generate a list `assignments`, which contains one element per language.
+        # The elements indicate which cognate class a language is assigned to.
+        # E.g. If there were 3 cognate classes for a meaning, and 10 languages, a valid `assignments` might be:
+        # assignments = [0, 1, 1, 0, 2, 0, 0, 0, 0, 2]
+        # We are generating these knowing only the number of cognates, e.g. 3 above.
+        # It is a requirement that each cognate class is represented at least once.  So, we start off `assignments`
+        # by sampling each cognate class precisely once (in numeric order, but fear not, all will get shuffled at the end)
+        assignments = numpy.arange(classes)
+        # Now, we probably need to make some additional assignments.  How many?
+        remaining = self._n_langs - len(assignments)
+        if remaining:
+            # Now, we don't care, for the remaining assignments, that every cognate class is represented at least once.
+            # We can just sample randomly, and add the results to what we already have.  We could just sample uniformly
+            # from range(0, classes) (and previously did!), but it's not realistic that all cognate classes are equally
+            # sized on average.  So, let's instead sample the remaining assignments from a non-uniform multinomial
+            # distribution, which is itself sampled from a symmetric Dirichlet distribution.  By setting the Dirichlet's
+            # alpha parameter very high, we can gracefully degrade to the original uniform distribution.
+            # First, sample the multinomial probabilities.
+            multinomial_probs = sampling.sample_dirichlet(self.alpha, classes)
+            # Now sample the counts of each class, after making `remaining` draws from the multinomial dist
+            multinomial_counts = numpy.random.multinomial(remaining, multinomial_probs)
+            # Add the actual assignments to `assignments`
+            assignments = numpy.concatenate([assignments, numpy.repeat(numpy.arange(classes), multinomial_counts)])
+        # Shuffle everything as promised earlier
+        numpy.random.shuffle(assignments)
+        # Sanity checks
+        assert len(assignments) == self._n_langs
+        return assignments
 
     def _generateFeatureNames(self):
         output = []
@@ -117,3 +93,72 @@ class SwampSimulator():
     
     def __del__(self):
         pass
+
+def _log_binom(n, k):
+    return scipy.special.gammaln(n + 1) - scipy.special.gammaln(k + 1) - scipy.special.gammaln(n - k + 1)
+
+def class_size_pmfs(n_langs, alpha):
+    """Return the (n_langs x n_langs) matrix whose row k-1 is the distribution of the size (1..n_langs) of any one cognate class of a meaning with k classes. Every class has one member plus its share of a Dirichlet-multinomial draw of the n_langs - k other taxa, whose marginal is beta-binomial."""
+    ks = numpy.arange(2, n_langs + 1)[:, None]
+    extra = numpy.arange(n_langs)[None, :]
+    pmfs = numpy.zeros((n_langs, n_langs))
+    pmfs[0, n_langs - 1] = 1.0
+    with numpy.errstate(divide="ignore"):
+        pmfs[1:] = numpy.exp(scipy.stats.betabinom.logpmf(extra, n_langs - ks, alpha, (ks - 1) * alpha))
+    return pmfs
+
+def expected_tiger(n_langs, alpha, dist=None):
+    """Return the expected TIGER rate of the characters of data generated by SwampSimulator(n_langs, n_features, alpha, dist), and the variance of the expected rates of individual characters, i.e. the variance of the TIGER rates of a dataset in the limit of many features.
+
+    Meanings are generated independently and their taxa are exchangeable, so the
+    agreement of a character with a random partner depends only on the sizes of
+    their cognate classes: a class of m taxa of the partner lies within a class
+    of x taxa of the character with probability C(x, m) / C(n, m). The expected
+    rate sums this over the class size distributions; the variance needs the
+    joint distribution of two class sizes of the same meaning, which is
+    summarised by its factorial moments."""
+    n = n_langs
+    if dist is None:
+        dist = scipy.stats.randint(1, n + 1)
+    ks = numpy.arange(1, n + 1)
+    p_classes = dist.pmf(ks)
+    if not p_classes.sum() > 0:
+        raise ValueError("Distribution has no probability mass between 1 and %d." % n)
+    p_classes = p_classes / p_classes.sum()
+    pmfs = class_size_pmfs(n, alpha)
+    sizes = ks
+    # Size distribution of a random class of a random partner character
+    partner_sizes = p_classes @ pmfs
+    # R[x-1, m-1]: probability that m given taxa all lie in a given class of x taxa
+    with numpy.errstate(invalid="ignore"):
+        log_r = _log_binom(sizes[:, None], sizes[None, :]) - _log_binom(n, sizes)[None, :]
+    r = numpy.where(sizes[None, :] <= sizes[:, None], numpy.exp(numpy.where(numpy.isfinite(log_r), log_r, 0)), 0.0)
+    # h[x-1]: expected agreement contributed by a class of x taxa of the character
+    h = r @ partner_sizes
+    mean = p_classes @ (ks * (pmfs @ h))
+
+    # Second moment of the expected rate g = sum of h over the classes of a character:
+    # k E[h(s1)^2] + k(k-1) E[h(s1) h(s2)] for a meaning with k classes
+    same_class = pmfs @ h ** 2
+    # h(1 + c) = sum_a C(c, a) z(a) / u(a) with u(a) = alpha^[a] / a!, and the
+    # Dirichlet-multinomial factorial moments E[C(c1, a) C(c2, b)] = u(a) u(b) phi_k(a + b)
+    # turn E[h(s1) h(s2)] into a sum of phi_k over the autoconvolution of z.
+    scaled = numpy.zeros(n + 2)
+    scaled[1:n + 1] = partner_sizes * numpy.exp(-_log_binom(n, sizes))
+    a = numpy.arange(n + 1)
+    log_u = scipy.special.gammaln(alpha + a) - scipy.special.gammaln(alpha) - scipy.special.gammaln(a + 1)
+    with numpy.errstate(divide="ignore"):
+        log_z = numpy.log(scaled[:-1] + scaled[1:]) + log_u
+    top = log_z[numpy.isfinite(log_z)].max()
+    with numpy.errstate(divide="ignore"):
+        log_conv = numpy.log(numpy.convolve(numpy.exp(log_z - top), numpy.exp(log_z - top))) + 2 * top
+    cross = numpy.zeros(n)
+    remaining = n - ks[1:, None]
+    t = a[None, :n]
+    with numpy.errstate(invalid="ignore"):
+        log_phi = (scipy.special.gammaln(remaining + 1) - scipy.special.gammaln(remaining - t + 1)
+                   - scipy.special.gammaln(ks[1:, None] * alpha + t) + scipy.special.gammaln(ks[1:, None] * alpha))
+    terms = numpy.where(t <= remaining, numpy.exp(numpy.where(t <= remaining, log_phi + log_conv[None, :n], -numpy.inf)), 0.0)
+    cross[1:] = terms.sum(axis=1)
+    second_moment = p_classes @ (ks * same_class + ks * (ks - 1) * cross)
+    return mean, max(second_moment - mean ** 2, 0.0)
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# Compare synonym resolution strategies on one CLDF dataset.
+#
+# The dataset is read once, and the part of synonym resolution which does not
+# depend on the strategy is done once. Meanings without synonyms are resolved
+# identically by every strategy, so the TIGER agreements among them are also
+# calculated only once; each resolution adds only the agreements involving its
+# meanings with synonyms. Harvest matrices, TIGER rates and delta scores and
+# Q-residuals are written for every resolution, with a summary table.
+
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+
+import cldf
+import tiger
+from calculate_delta_and_q import harvest_to_matrix, phylogemetric
+
+PARSER_DESC = "Calculate TIGER rates, delta scores and Q-residuals of a CLDF dataset for several synonym resolution strategies."
+SUMMARY_FILE = "synonym_sweep.tsv"
+MISSING = "?"
+
+_worker = {}
+
+class SharedRates():
+    '''TIGER rates of character matrices which all contain the same fixed
+    characters. The agreements among the fixed characters are calculated
+    once; the rates of every matrix only add the agreements involving its
+    other characters.'''
+
+    def __init__(self, fixed):
+        self.n_fixed = fixed.shape[1]
+        self.fixed, self.counts, self.index = tiger.unique_partitions(np.asarray(fixed, dtype=np.int32))
+        self.fixed_sums = tiger.cross_agreement_sums(self.fixed, self.fixed, self.counts)
+
+    def rates(self, variable):
+        '''Return the TIGER rates of the fixed characters and then of the characters of variable, as if they were the columns of one matrix.'''
+        n_chars = self.n_fixed + variable.shape[1]
+        if n_chars < 2:
+            return np.zeros(n_chars)
+        variable, counts, index = tiger.unique_partitions(np.asarray(variable, dtype=np.int32))
+        fixed_sums = self.fixed_sums + tiger.cross_agreement_sums(self.fixed, variable, counts)
+        variable_sums = (tiger.cross_agreement_sums(variable, self.fixed, self.counts) +
+                         tiger.cross_agreement_sums(variable, variable, counts))
+        sums = np.concatenate((fixed_sums[self.index], variable_sums[index]))
+        # Every character agrees perfectly with itself; leave that comparison out
+        self_agreement = np.concatenate(((self.fixed != tiger.UNKNOWN).any(axis=0)[self.index],
+                                         (variable != tiger.UNKNOWN).any(axis=0)[index]))
+        return (sums - self_agreement) / (n_chars - 1)
+
+def resolutions(strategies, n_seeds):
+    '''Return the (label, strategy, seed) of every resolution to compare.'''
+    jobs = []
+    for strategy in strategies:
+        if strategy == "random":
+            jobs.extend(("random_%03d" % seed, strategy, seed) for seed in range(n_seeds))
+        else:
+            jobs.append((strategy, strategy, None))
+    return jobs
+
+def _init_worker(store, resolver, shared, excluded_taxa, taxa, fixed, variable, delta_q):
+    _worker.update(store=store, resolver=resolver, shared=shared, excluded_taxa=excluded_taxa,
+                   taxa=taxa, fixed=fixed, variable=variable, delta_q=delta_q)
+
+def analyse(job):
+    '''Resolve the synonyms for one job and analyse the result. Returns the label, the harvest lines, the rates lines, the delta and Q lines and the line of the summary table.'''
+    label, strategy, seed = job
+    store, taxa = _worker["store"], _worker["taxa"]
+    fixed, variable = _worker["fixed"], _worker["variable"]
+    matrix = _worker["resolver"].resolve(strategy, seed)
+    harvest = cldf.harvest_lines(store, matrix, _worker["excluded_taxa"], MISSING)
+    rates = np.empty(len(store.meanings))
+    rates[fixed + variable] = _worker["shared"].rates(matrix[np.ix_(taxa, variable)])
+    classes = sum(cldf.class_counts(matrix))
+    delta_q = []
+    delta_mean = q_mean = float("nan")
+    if _worker["delta_q"]:
+        taxon_matrix = harvest_to_matrix(harvest)
+        delta_score = phylogemetric.DeltaScoreMetric(taxon_matrix).score()
+        q_residual = phylogemetric.QResidualMetric(taxon_matrix).score()
+        delta_q.append("taxon\tdelta-score\tq-residual\n")
+        for taxon in sorted(delta_score.keys()):
+            delta_q.append("%s\t%f\t%f\n" % (taxon, delta_score[taxon], q_residual[taxon]))
+        delta_mean = np.mean(list(delta_score.values()))
+        q_mean = np.mean(list(q_residual.values()))
+    summary = "%s\t%s\t%s\t%d\t%f\t%f\t%f\n" % (label, strategy, "" if seed is None else seed, classes,
+                                                rates.mean(), delta_mean, q_mean)
+    return (label, [l + "\n" for l in harvest], tiger.format_rates(store.meanings, rates),
+            delta_q, summary)
+
+def main(cldf_path, outdir, strategies=("minimum", "maximum", "random"), n_seeds=100,
+         excluded_taxa=(), delta_q=True, processes=1):
+    store = cldf.load(cldf_path)
+    resolver = cldf.SynonymResolver(store, excluded_taxa)
+    taxa = [l for l, name in enumerate(store.languages) if not cldf.is_excluded(name, excluded_taxa)]
+    fixed = resolver.fixed_meanings()
+    variable = [m for m in range(len(store.meanings)) if m not in set(fixed)]
+    print("%d of %d meanings have synonyms" % (len(variable), len(store.meanings)))
+    shared = SharedRates(resolver.matrix[np.ix_(taxa, fixed)])
+    os.makedirs(outdir, exist_ok=True)
+    lines = ["resolution\tstrategy\tseed\tcognate_classes\ttiger_mean\tdelta_mean\tqresidual_mean\n"]
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(store, resolver, shared, excluded_taxa, taxa, fixed, variable, delta_q)) as pool:
+        for label, harvest, rates, delta_q_lines, summary in pool.imap(analyse, resolutions(strategies, n_seeds)):
+            filename = os.path.join(outdir, label + ".csv")
+            with open(filename, "w") as fp:
+                fp.writelines(harvest)
+            with open(filename + "_rates.txt", "w") as fp:
+                fp.writelines(rates)
+            if delta_q_lines:
+                with open(filename + "_delta_qresidual.txt", "w") as fp:
+                    fp.writelines(delta_q_lines)
+            lines.append(summary)
+    with open(os.path.join(outdir, SUMMARY_FILE), "w") as fp:
+        fp.writelines(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="in_file",
+                        help="CLDF folder to analyse",
+                        metavar='IN_FILE',
+                        type=str)
+
+    parser.add_argument("-o",
+                        dest="outdir",
+                        help="Output folder",
+                        metavar='OUTDIR',
+                        default="synonym_sweep",
+                        type=str)
+
+    parser.add_argument("-s",
+                        dest="strategies",
+                        help="Comma-separated list of synonym resolution strategies (minimum, maximum, random)",
+                        metavar='STRATEGIES',
+                        default="minimum,maximum,random",
+                        type=str)
+
+    parser.add_argument("-r",
+                        dest="seeds",
+                        help="Number of random resolutions",
+                        metavar='SEEDS',
+                        default=100,
+                        type=int)
+
+    parser.add_argument("-x",
+                        dest="excluded_taxa",
+                        help="Comma-separated list of taxa to exclude (wildcards allowed)",
+                        metavar='EXCLUDED_TAXA',
+                        default="",
+                        type=str)
+
+    parser.add_argument("-t",
+                        dest="tiger_only",
+                        help="Only calculate TIGER rates, not delta scores and Q-residuals",
+                        action="store_true")
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of resolutions to analyse in parallel",
+                        metavar='PROCESSES',
+                        default=os.cpu_count(),
+                        type=int)
+
+    args = parser.parse_args()
+
+    strategies = [s for s in args.strategies.split(",") if s]
+    for s in strategies:
+        if s not in cldf.SynonymResolver.STRATEGIES:
+            print("Unknown synonym strategy", s)
+            exit(1)
+    if not os.path.isdir(args.in_file):
+        print("Could not find folder", args.in_file)
+        exit(1)
+
+    excluded_taxa = [x for x in args.excluded_taxa.split(",") if x]
+    main(args.in_file, args.outdir, strategies, args.seeds, excluded_taxa, not args.tiger_only, args.processes)
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import cldf
+
+FORMS = [("f1", "l1", "hand", "A"), ("f2", "l2", "hand", "A"), ("f3", "l2", "hand", "B"),
+         ("f4", "l3", "hand", "B"), ("f5", "l3", "hand", "C"), ("f6", "l4", "hand", "C"),
+         ("f7", "l1", "eye", "D"), ("f8", "l2", "eye", "D"), ("f9", "l3", "eye", "")]
+
+def write_dataset(path, forms=FORMS):
+    '''Write a CLDF wordlist without metadata, so the default tables and columns are used.'''
+    with open(os.path.join(path, "forms.csv"), "w") as f:
+        f.write("ID,Language_ID,Parameter_ID,Form\n")
+        f.writelines("%s,%s,%s,x\n" % form[:3] for form in forms)
+    with open(os.path.join(path, "cognates.csv"), "w") as f:
+        f.write("ID,Form_ID,Cognateset_ID\n")
+        f.writelines("c%s,%s,%s\n" % (form[0], form[0], form[3]) for form in forms if form[3])
+    with open(os.path.join(path, "languages.csv"), "w") as f:
+        f.write("ID,Name\nl1,Lang 1\nl2,Lang 2\nl3,Lang 3\nl4,Proto 4\n")
+    with open(os.path.join(path, "parameters.csv"), "w") as f:
+        f.write("ID,Name\nhand,hand\neye,eye\n")
+
+def resolved(store, matrix, meaning):
+    '''Return the cognate set IDs of every language for meaning in a resolved matrix.'''
+    m = store.meanings.index(meaning)
+    return [store.cognate_sets[c].split("\t")[1] if c != cldf.UNKNOWN else None for c in matrix[:, m].tolist()]
+
+def test_store_is_cached(tmp_path, monkeypatch):
+    write_dataset(str(tmp_path))
+    store = cldf.load(str(tmp_path))
+    assert store.languages == ["Lang 1", "Lang 2", "Lang 3", "Proto 4"]
+    assert os.listdir(str(tmp_path / cldf.CACHE_FOLDER)) == [cldf.dataset_hash(str(tmp_path)) + ".npz"]
+    # An unchanged dataset is loaded from the cache without being read
+    monkeypatch.setattr(cldf, "build", lambda path: pytest.fail("read a cached dataset"))
+    cached = cldf.load(str(tmp_path))
+    assert cached.languages == store.languages and cached.cognate_sets == store.cognate_sets
+    assert (cached.cognate_set == store.cognate_set).all()
+    monkeypatch.undo()
+    # A changed dataset is read again and replaces the old cache
+    write_dataset(str(tmp_path), FORMS[:-1])
+    changed = cldf.load(str(tmp_path))
+    assert len(changed.cognate_set) == len(FORMS) - 1
+    assert os.listdir(str(tmp_path / cldf.CACHE_FOLDER)) == [cldf.dataset_hash(str(tmp_path)) + ".npz"]
+
+def test_synonym_strategies(tmp_path):
+    write_dataset(str(tmp_path))
+    store = cldf.load(str(tmp_path))
+    resolver = cldf.SynonymResolver(store)
+    assert resolver.fixed_meanings() == [store.meanings.index("eye")]
+    # The minimum strategy reuses the sets of languages without synonyms
+    minimum = resolver.resolve("minimum")
+    assert resolved(store, minimum, "hand") == ["A", "A", "C", "C"]
+    assert resolved(store, minimum, "eye") == ["D", "D", None, None]
+    # The maximum strategy prefers sets nobody has yet
+    maximum = store.resolve_synonyms("maximum")
+    assert resolved(store, maximum, "hand") == ["A", "B", "B", "C"]
+    assert cldf.class_counts(minimum) == [2, 1] and cldf.class_counts(maximum) == [3, 1]
+    random = resolver.resolve("random", seed=1)
+    assert (random == resolver.resolve("random", seed=1)).all()
+    assert resolved(store, random, "hand")[1] in ("A", "B")
+    with pytest.raises(ValueError):
+        resolver.resolve("median")
+
+def test_excluded_taxa(tmp_path):
+    write_dataset(str(tmp_path))
+    store = cldf.load(str(tmp_path))
+    matrix = store.resolve_synonyms("minimum", ["Proto*"])
+    assert resolved(store, matrix, "hand")[3] is None
+    lines = cldf.harvest_lines(store, matrix, ["Proto*"])
+    assert lines == ["lang,hand,eye", "Lang_1,1,1", "Lang_2,1,1", "Lang_3,2,?"]
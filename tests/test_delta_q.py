@@ -0,0 +1,50 @@
+import itertools
+
+import numpy as np
+import phylogemetric
+
+from bitmatrix import BinaryMatrix
+from calculate_delta_and_q import harvest_to_matrix, jackknife
+
+def harvest(n_taxa=8, n_chars=25, seed=0):
+    '''Return the lines of a random harvest-style CSV with single-digit codes and missing data.'''
+    rng = np.random.default_rng(seed)
+    lines = ["language," + ",".join("c%d" % j for j in range(n_chars))]
+    for t in range(n_taxa):
+        values = ["?" if rng.random() < 0.1 else str(rng.integers(1, 5)) for _ in range(n_chars)]
+        lines.append("t%d," % t + ",".join(values))
+    return lines
+
+def brute_force(lines):
+    '''Return the taxa of harvest lines with their delta scores and Q-residuals, scoring every quartet separately.'''
+    matrix = BinaryMatrix.from_harvest(lines)
+    dist = matrix.hamming_distances()
+    n = len(matrix.taxa)
+    delta, q = np.zeros(n), np.zeros(n)
+    quartets = list(itertools.combinations(range(n), 4))
+    for i, j, k, l in quartets:
+        m3, m2, m1 = sorted((dist[i, j] + dist[k, l], dist[i, k] + dist[j, l], dist[i, l] + dist[j, k]))
+        for t in (i, j, k, l):
+            delta[t] += (m1 - m2) / (m1 - m3) if m1 > m3 else 0.0
+            q[t] += (m1 - m2) ** 2
+    count = len(quartets) * 4 / n
+    scale = dist[np.triu_indices(n, 1)].mean() ** 2
+    return matrix.taxa, delta / count, q / count / scale
+
+def test_scores_match_phylogemetric():
+    lines = harvest()
+    taxa, delta, q, _, _ = jackknife(lines)
+    expected_delta = phylogemetric.DeltaScoreMetric(harvest_to_matrix(lines)).score()
+    expected_q = phylogemetric.QResidualMetric(harvest_to_matrix(lines)).score()
+    assert np.allclose(delta, [expected_delta[t] for t in taxa], rtol=0, atol=1e-12)
+    assert np.allclose(q, [expected_q[t] for t in taxa], rtol=0, atol=1e-12)
+
+def test_left_out_scores_match_brute_force():
+    lines = harvest()
+    taxa, _, _, loo_delta, loo_q = jackknife(lines)
+    for r, left_out in enumerate(taxa):
+        kept, delta, q = brute_force([line for line in lines if not line.startswith(left_out + ",")])
+        columns = [taxa.index(t) for t in kept]
+        assert np.allclose(loo_delta[r, columns], delta, rtol=0, atol=1e-12)
+        assert np.allclose(loo_q[r, columns], q, rtol=0, atol=1e-12)
+        assert np.isnan(loo_delta[r, r]) and np.isnan(loo_q[r, r])
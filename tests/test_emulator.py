@@ -0,0 +1,36 @@
+import numpy as np
+
+import emulator
+
+def smooth_observations():
+    '''Return observations of a smooth function of taxon counts and parameter values on a grid.'''
+    taxa, values = np.meshgrid([10, 25, 50, 100], [0.25, 0.5, 1.0, 2.0, 5.0])
+    taxa, values = taxa.ravel(), values.ravel()
+    means = 0.3 + 0.1 * np.log10(values) - 0.05 * np.log10(taxa)
+    return taxa, values, means, np.full(len(means), 1e-6)
+
+def test_gaussian_process_reproduces_observations():
+    taxa, values, means, noise = smooth_observations()
+    process = emulator.GaussianProcess.fit(emulator.inputs(taxa, values), means, noise)
+    predicted, sd = process.predict(emulator.inputs(taxa, values))
+    assert np.allclose(predicted, means, atol=5e-3)
+    assert (sd < 0.01).all()
+    # Between the observations the prediction follows the function
+    mean, sd = emulator.Emulator({"swamp_exploration": process}).predict("swamp_exploration", 40, 0.75)
+    assert abs(mean - (0.3 + 0.1 * np.log10(0.75) - 0.05 * np.log10(40))) < 0.01
+    assert sd < emulator.MAX_SD
+
+def test_save_and_load(tmp_path):
+    taxa, values, means, noise = smooth_observations()
+    fitted = emulator.Emulator({"tree_exploration": emulator.GaussianProcess.fit(emulator.inputs(taxa, values), means, noise)})
+    filename = str(tmp_path / "emulator.npz")
+    fitted.save(filename)
+    loaded = emulator.Emulator.load(filename)
+    assert sorted(loaded.processes) == ["tree_exploration"]
+    queries = (np.array([10, 30, 80]), np.array([0.3, 1.5, 4.0]))
+    for a, b in zip(fitted.predict("tree_exploration", *queries), loaded.predict("tree_exploration", *queries)):
+        assert np.allclose(a, b)
+    assert loaded.trusted("tree_exploration", 30, 1.5)
+    # Outside the explored ranges the emulator is not trusted
+    assert not loaded.trusted("tree_exploration", 500, 1.5)
+    assert not loaded.trusted("swamp_exploration", 30, 1.5)
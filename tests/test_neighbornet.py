@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.optimize import nnls
+
+import neighbornet
+
+def caterpillar_metric(n, seed):
+    '''Return a tree metric on n taxa in random order: the splits of a caterpillar tree and of its leaves, with random weights.'''
+    rng = np.random.default_rng(seed)
+    taxa = rng.permutation(n)
+    distances = np.zeros((n, n))
+    sides = [taxa[:k] for k in range(1, n - 1)] + [[t] for t in taxa]
+    for side in sides:
+        inside = np.isin(np.arange(n), side)
+        distances += rng.uniform(0.1, 1.0) * (inside[:, None] != inside[None, :])
+    return distances
+
+def random_distances(n, seed):
+    rng = np.random.default_rng(seed)
+    distances = rng.uniform(0.1, 1.0, (n, n))
+    distances = distances + distances.T
+    np.fill_diagonal(distances, 0)
+    return distances
+
+def test_tree_metric_is_recovered():
+    for n in (8, 50):
+        distances = caterpillar_metric(n, n)
+        order, splits, fit = neighbornet.neighbornet(list(range(n)), distances)
+        assert sorted(order) == list(range(n))
+        assert abs(fit - 100) < 1e-6
+        # A tree on n taxa has 2n - 3 splits
+        assert len(splits) == 2 * n - 3
+
+def test_split_operators_agree_with_design_matrix():
+    rng = np.random.default_rng(1)
+    for n in (4, 9):
+        design = neighbornet._design_matrix(n)
+        w = rng.uniform(size=design.shape[1])
+        r = rng.uniform(size=design.shape[0])
+        assert np.allclose(neighbornet._split_distances(w, n), design @ w)
+        assert np.allclose(neighbornet._split_adjoint(r, n), design.T @ r)
+        i, j = np.triu_indices(n - 1)
+        assert np.array_equal(neighbornet._split_gram(i + 1, j + 1, n), design.T @ design)
+
+def test_sparse_and_dense_weights_agree():
+    # Enough taxa to be fitted without the design matrix by split_weights
+    n = 45
+    assert n * (n - 1) // 2 > neighbornet.DENSE_SPLITS
+    distances = random_distances(n, 2)
+    order = neighbornet.circular_ordering(distances)
+    d = distances[np.ix_(order, order)][np.triu_indices(n, 1)]
+    dense = nnls(neighbornet._design_matrix(n), d)[0]
+    # Random distances are far from circular, so most weights are constrained
+    assert (dense == 0).sum() > len(dense) / 2
+    _, weights, _ = neighbornet.split_weights(distances, order)
+    assert np.allclose(weights, dense, atol=1e-9)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from refinement import CurveRefinement, refine
+
+def noisy(curve, sd=0.005, seed=0):
+    '''Return a simulate function of refine for the mean curve with normal noise.'''
+    rng = np.random.default_rng(seed)
+    return lambda jobs: [curve(value) + rng.normal(0, sd) for value, _ in jobs]
+
+def test_budget_is_respected():
+    refinement = CurveRefinement((0.25, 1.0, 5.0))
+    assert len(refinement.next_jobs(4)) == 4
+    refinement = CurveRefinement((0.25, 1.0, 5.0))
+    used = refine(refinement, noisy(lambda x: np.log10(x)), 37)
+    assert used <= 37
+    assert sum(refinement.stats[v].n for v in refinement.values()) == used
+
+def test_flat_curve_stops():
+    refinement = CurveRefinement((0.25, 1.0, 5.0))
+    used = refine(refinement, noisy(lambda x: 0.3), 1000)
+    assert used < 1000
+    assert refinement.values() == [0.25, 1.0, 5.0]
+    assert refinement.next_jobs() == []
+
+def test_step_is_bisected():
+    refinement = CurveRefinement((0.25, 1.0, 5.0))
+    refine(refinement, noisy(lambda x: 0.2 if x < 2.0 else 0.6), 1000)
+    values = refinement.values()
+    assert len(values) > 3
+    # The step is resolved to the narrowest interval, and the flat parts are not bisected
+    low = max(v for v in values if v < 2.0)
+    high = min(v for v in values if v >= 2.0)
+    assert np.log10(high) - np.log10(low) <= refinement.min_width
+    assert all(v >= 1.0 for v in values if v not in (0.25,))
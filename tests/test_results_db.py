@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+import results_db
+
+GRIDS = {"swamp": ("alpha", [0.1, 1.0, 10.0])}
+
+def tiger_lines(rates):
+    return ["c%d\t%r\n" % (i, r) for i, r in enumerate(rates.tolist())]
+
+def test_describe_folder_layouts():
+    describe = results_db.describe
+    assert describe(os.path.join("analyses", "tree", "tree_model_007.csv")) == ("tree", "", 7)
+    assert describe(os.path.join("analyses", "uralex", "uralex.csv")) == ("uralex", "", 0)
+    assert describe(os.path.join("param_exploration", "swamp", "25_taxa_alpha_2_003.csv"), GRIDS) == \
+        ("swamp_exploration", "alpha=10.0,taxa=25", 3)
+    assert describe(os.path.join("param_exploration", "swamp", "25_taxa_alpha=0.5_004.csv"), GRIDS) == \
+        ("swamp_exploration", "alpha=0.5,taxa=25", 4)
+    # Grid indices cannot be resolved without the grid of the model
+    assert describe(os.path.join("param_exploration", "chain", "25_taxa_alpha_2_003.csv"), GRIDS) is None
+    assert describe(os.path.join("datagaps", "uralex_0.75_gaps.csv")) == \
+        ("datagaps", "coverage=0.75,dataset=uralex,kind=gaps", 0)
+    assert describe(os.path.join("elsewhere", "data.csv")) is None
+
+def test_store_and_summarise(tmp_path):
+    db = str(tmp_path / "results.sqlite")
+    rng = np.random.default_rng(0)
+    replicates = [rng.uniform(size=n) for n in (5, 8, 13)]
+    for replicate, rates in enumerate(replicates, 1):
+        path = os.path.join("analyses", "tree", "tree_model_%03d.csv" % replicate)
+        results_db.register(path, "tree", {}, replicate, db)
+        results_db.store_rates(path, tiger_lines(rates), db)
+    # Storing a replicate again replaces its results
+    results_db.store_rates(path, tiger_lines(replicates[-1]), db)
+    results_db.store_delta_q(path, ["taxon\tdelta-score\tq-residual\n", "a\t0.25\t0.01\n", "b\t0.35\t0.03\n"], db)
+    conn = results_db.connect(db)
+    values = np.concatenate(replicates)
+    stats = results_db.summary(conn, "tree", "tiger")
+    assert stats.n == len(values)
+    assert np.isclose(stats.mean, values.mean())
+    assert np.isclose(stats.variance(), values.var(ddof=1))
+    assert (stats.min, stats.max) == (values.min(), values.max())
+    assert np.allclose(results_db.replicate_means(conn, "tree", "tiger"), [r.mean() for r in replicates])
+    assert results_db.items(conn, "tree", "delta", replicate=3) == {"a": 0.25, "b": 0.35}
+    assert results_db.models(conn) == ["tree"]
+    conn.close()
+
+def test_backfill_and_merge(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join("analyses", "chain"))
+    dataset = os.path.join("analyses", "chain", "chain_model_002.csv")
+    open(dataset, "w").close()
+    with open(dataset + "_rates.txt", "w") as f:
+        f.write("0.5\n0.7\n")
+    results_db.backfill(("analyses",), filename="partial.sqlite")
+    results_db.merge_databases(["partial.sqlite"], "merged.sqlite")
+    conn = results_db.connect("merged.sqlite")
+    assert results_db.lookup(conn, dataset) == ("chain", "", 2)
+    assert results_db.items(conn, "chain", "tiger", replicate=2) == {"0": 0.5, "1": 0.7}
+    assert np.isclose(results_db.mean(conn, "chain", "tiger"), 0.6)
+    conn.close()
@@ -0,0 +1,24 @@
+import numpy as np
+
+from running_stats import RunningStats
+
+def test_merge_matches_numpy():
+    rng = np.random.default_rng(0)
+    parts = [rng.normal(5.0, 2.0, n) for n in (1, 7, 100, 0, 33)]
+    values = np.concatenate(parts)
+    merged = RunningStats()
+    for part in parts:
+        merged.merge(RunningStats.from_values(part))
+    pushed = RunningStats()
+    for x in values:
+        pushed.push(x)
+    for stats in (merged, pushed):
+        assert stats.n == len(values)
+        assert np.isclose(stats.mean, values.mean())
+        assert np.isclose(stats.variance(), np.var(values, ddof=1))
+        assert np.isclose(stats.variance(ddof=0), np.var(values))
+        assert (stats.min, stats.max) == (values.min(), values.max())
+
+def test_too_few_values():
+    assert np.isnan(RunningStats.from_values([1.0]).variance())
+    assert RunningStats().merge(RunningStats()).n == 0
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+import tiger
+
+COMPARISONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tiger_implementation_comparisons")
+
+def read_phylip(filename):
+    '''Return the sites of a PHYLIP alignment as an integer matrix (taxa x sites).'''
+    with open(filename, "r") as f:
+        rows = [line.split() for line in f.readlines()[1:] if line.strip()]
+    sequences = np.array([list(sequence) for _, sequence in rows])
+    matrix = np.empty(sequences.shape, dtype=np.int32)
+    for j in range(sequences.shape[1]):
+        matrix[:, j] = np.unique(sequences[:, j], return_inverse=True)[1]
+    return matrix
+
+def test_rates_match_tiger_calculator():
+    matrix = read_phylip(os.path.join(COMPARISONS, "sampledata.phylip"))
+    expected = np.loadtxt(os.path.join(COMPARISONS, "rates_comparison_table.tsv"), skiprows=1, usecols=2)
+    assert np.allclose(tiger.calculate_rates(matrix), expected, rtol=0, atol=1e-15)
+    assert np.allclose(tiger.calculate_rates(matrix, processes=3), expected, rtol=0, atol=1e-15)
+
+def brute_force_rates(matrix):
+    '''Return the TIGER rates of matrix by comparing the sets of taxa of every pair of characters.'''
+    n_taxa, n_chars = matrix.shape
+    def sets(j):
+        states = sorted(set(matrix[:, j]) - {tiger.UNKNOWN})
+        return [frozenset(t for t in range(n_taxa) if matrix[t, j] == s) for s in states]
+    partitions = [sets(j) for j in range(n_chars)]
+    rates = []
+    for i in range(n_chars):
+        total = 0.0
+        for j in range(n_chars):
+            if j != i and partitions[j]:
+                total += sum(any(s <= t for t in partitions[i]) for s in partitions[j]) / len(partitions[j])
+        rates.append(total / (n_chars - 1))
+    return np.array(rates)
+
+def test_distinct_partitions_match_brute_force():
+    rng = np.random.default_rng(1)
+    matrix = rng.integers(0, 3, (8, 30)).astype(np.int32)
+    matrix[rng.random(matrix.shape) < 0.1] = tiger.UNKNOWN
+    # Relabelled copies induce the same partitions as the originals
+    matrix[:, 20:] = np.where(matrix[:, :10] == tiger.UNKNOWN, tiger.UNKNOWN, (matrix[:, :10] + 1) % 3)
+    matrix[:, 29] = tiger.UNKNOWN
+    partitions, counts, index = tiger.unique_partitions(matrix)
+    assert partitions.shape[1] < matrix.shape[1]
+    assert counts.sum() == matrix.shape[1]
+    assert np.array_equal(tiger.canonical_partitions(matrix), partitions[:, index])
+    assert np.allclose(tiger.calculate_rates(matrix), brute_force_rates(matrix), rtol=0, atol=1e-15)
+
+def test_sampled_rates_are_exact_with_every_partner():
+    rng = np.random.default_rng(2)
+    matrix = rng.integers(0, 4, (10, 50)).astype(np.int32)
+    matrix[:, 40:] = matrix[:, :10]
+    rates, se = tiger.sample_rates(matrix, batch_size=7, seed=3)
+    assert np.allclose(rates, tiger.calculate_rates(matrix), rtol=0, atol=1e-12)
+    assert np.allclose(se, 0)
+    # With part of the partners, the standard errors are positive
+    _, se = tiger.sample_rates(matrix, budget=20, seed=3)
+    assert (se > 0).all()
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+# Calculate TIGER rates (Cummins & McInerney 2011) for harvest-style CSV files.
+#
+# The rate of a character is its mean partition agreement with every other
+# character. Characters which induce the same partition of the taxa (up to
+# relabelling of states) are compared only once and weighted by their counts,
+# so the cost scales with the number of distinct partitions. The pairwise work
+# is split into blocks of partner partitions which are handed to a pool of
+# processes; the workers read the integer partition matrix from shared memory,
+# so a single large dataset can use every core.
+
+import argparse
+import fnmatch
+import multiprocessing
+from multiprocessing import shared_memory
+import sys
+
+import numpy as np
+
+PARSER_DESC = "Calculate TIGER rates for a harvest-style CSV."
+UNKNOWN = -1
+
+_worker_matrix = {}
+
+def read_harvest(lines, unknown=None, excluded_taxa=()):
+    '''Read harvest-style CSV lines. Returns taxa, character names and an integer matrix (taxa x characters) in which every character's states are coded 0..k-1 and unknown states as UNKNOWN. Taxa matching any of the excluded_taxa patterns are dropped.'''
+    rows = [line.strip().split(",") for line in lines if line.strip()]
+    names = rows[0][1:]
+    taxa = []
+    values = []
+    for row in rows[1:]:
+        if any(fnmatch.fnmatch(row[0], pattern) for pattern in excluded_taxa):
+            continue
+        taxa.append(row[0])
+        values.append(row[1:])
+    values = np.array(values, dtype=str)
+    matrix = np.empty(values.shape, dtype=np.int32)
+    for j in range(values.shape[1]):
+        states, codes = np.unique(values[:, j], return_inverse=True)
+        matrix[:, j] = codes
+        if unknown is not None and unknown in states:
+            missing = values[:, j] == unknown
+            matrix[missing, j] = UNKNOWN
+            matrix[~missing, j] -= (codes[~missing] > np.searchsorted(states, unknown))
+    return taxa, names, matrix
+
+def canonical_partitions(matrix):
+    '''Relabel every column as a restricted growth string, i.e. number its states in order of first appearance, so that columns inducing the same partition become identical. Unknown states are kept.'''
+    canonical = np.full(matrix.shape, UNKNOWN, dtype=np.int32)
+    for j in range(matrix.shape[1]):
+        column = matrix[:, j]
+        known = column != UNKNOWN
+        states, first, inverse = np.unique(column[known], return_index=True, return_inverse=True)
+        labels = np.empty(len(states), dtype=np.int32)
+        labels[np.argsort(first)] = np.arange(len(states))
+        canonical[known, j] = labels[inverse]
+    return canonical
+
+def unique_partitions(matrix):
+    '''Deduplicate the partitions induced by the columns of matrix. Returns the matrix of distinct partitions, their multiplicities and, for every original column, the index of its distinct partition.'''
+    canonical = canonical_partitions(matrix)
+    seen = {}
+    index = np.empty(matrix.shape[1], dtype=np.intp)
+    for j in range(matrix.shape[1]):
+        index[j] = seen.setdefault(canonical[:, j].tobytes(), len(seen))
+    first = np.zeros(len(seen), dtype=np.intp)
+    first[index[::-1]] = np.arange(matrix.shape[1])[::-1]
+    counts = np.bincount(index, minlength=len(seen))
+    return np.ascontiguousarray(canonical[:, first]), counts, index
+
+def cross_agreement_sums(matrix, partners, weights=None):
+    '''Return, for every character (column) of matrix, the sum of its partition agreements with the characters of partners, a matrix of the same taxa, each partner weighted by weights if given.'''
+    sums = np.zeros(matrix.shape[1])
+    for j in range(partners.shape[1]):
+        column = partners[:, j]
+        states = np.unique(column[column != UNKNOWN])
+        if len(states) == 0:
+            continue
+        agreements = np.zeros(matrix.shape[1])
+        for state in states:
+            # The set of taxa with this state is a subset of one set of
+            # character i exactly when all its members agree on character i.
+            rows = matrix[column == state]
+            low = rows.min(axis=0)
+            agreements += (low == rows.max(axis=0)) & (low != UNKNOWN)
+        weight = 1 if weights is None else weights[j]
+        sums += agreements * (weight / len(states))
+    return sums
+
+def agreement_sums(matrix, start, stop, weights=None):
+    '''Return, for every character, the sum of its partition agreements with the characters start..stop-1 (self-agreement included), each partner weighted by weights if given.'''
+    return cross_agreement_sums(matrix, matrix[:, start:stop], None if weights is None else weights[start:stop])
+
+def _attach_shared_matrix(name, shape, dtype, weights):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_matrix["shm"] = shm
+    _worker_matrix["matrix"] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker_matrix["weights"] = weights
+
+def _shared_agreement_sums(block):
+    return agreement_sums(_worker_matrix["matrix"], *block, weights=_worker_matrix["weights"])
+
+def _blocks(n_chars, n_blocks):
+    bounds = np.linspace(0, n_chars, n_blocks + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def calculate_rates(matrix, processes=1, blocks_per_process=4):
+    '''Return the TIGER rate of every character (column) of matrix. Agreements are calculated between distinct partitions only. With processes > 1 the partner partitions are split into blocks that are processed in a pool of workers sharing the matrix.'''
+    n_chars = matrix.shape[1]
+    if n_chars < 2:
+        return np.zeros(n_chars)
+    matrix, counts, index = unique_partitions(np.asarray(matrix, dtype=np.int32))
+    n_partitions = matrix.shape[1]
+    if processes <= 1:
+        sums = agreement_sums(matrix, 0, n_partitions, counts)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=matrix.nbytes)
+        try:
+            shared = np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=shm.buf)
+            shared[:] = matrix
+            blocks = _blocks(n_partitions, processes * blocks_per_process)
+            with multiprocessing.Pool(processes, initializer=_attach_shared_matrix,
+                                      initargs=(shm.name, matrix.shape, matrix.dtype.str, counts)) as pool:
+                sums = np.zeros(n_partitions)
+                for partial in pool.imap_unordered(_shared_agreement_sums, blocks):
+                    sums += partial
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+    # Every character agrees perfectly with itself; leave that comparison out
+    self_agreement = (matrix != UNKNOWN).any(axis=0)
+    return ((sums - self_agreement) / (n_chars - 1))[index]
+
+def sample_rates(matrix, target_se=None, budget=None, batch_size=100, seed=None):
+    '''Estimate the TIGER rate of every character from a random sample of partner characters, drawn without replacement in batches of batch_size until every standard error is at most target_se or budget partners have been used. Returns the estimated rates and their standard errors.'''
+    n_chars = matrix.shape[1]
+    if n_chars < 2:
+        return np.zeros(n_chars), np.zeros(n_chars)
+    if budget is None:
+        budget = n_chars
+    matrix, counts, index = unique_partitions(np.asarray(matrix, dtype=np.int32))
+    self_agreement = (matrix != UNKNOWN).any(axis=0)[index].astype(float)
+    total = np.zeros(matrix.shape[1])
+    total_sq = np.zeros(matrix.shape[1])
+    sampled = np.zeros(n_chars, dtype=bool)
+    order = np.random.default_rng(seed).permutation(n_chars)
+    drawn = 0
+    while True:
+        batch = order[drawn:min(drawn + batch_size, budget, n_chars)]
+        # Partners are compared one at a time, each against all characters at
+        # once; partners of the batch with the same partition are compared once
+        partners, multiplicity = np.unique(index[batch], return_counts=True)
+        for j, count in zip(partners, multiplicity):
+            agreements = agreement_sums(matrix, j, j + 1)
+            total += count * agreements
+            total_sq += count * agreements ** 2
+        sampled[batch] = True
+        drawn += len(batch)
+        # Characters which were drawn as their own partner drop that draw
+        n = drawn - sampled
+        mean = (total[index] - sampled * self_agreement) / np.maximum(n, 1)
+        sq = total_sq[index] - sampled * self_agreement
+        var = np.maximum(sq - n * mean ** 2, 0) / np.maximum(n - 1, 1)
+        # Finite population correction: there are only n_chars - 1 partners
+        se = np.sqrt(var / np.maximum(n, 1) * (1 - n / (n_chars - 1)))
+        if drawn >= min(budget, n_chars) or len(batch) == 0:
+            break
+        if target_se is not None and drawn >= 2 and se.max() <= target_se:
+            break
+    return mean, se
+
+def format_rates(names, rates, print_names=True):
+    '''Return the lines of a rates file.'''
+    if print_names:
+        return ["%s\t%s\n" % (name, rate) for name, rate in zip(names, rates.tolist())]
+    return ["%s\n" % rate for rate in rates.tolist()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=PARSER_DESC)
+
+    parser.add_argument(dest="infile",
+                        help="Input file",
+                        metavar='INFILE',
+                        type=str,
+                        default = None)
+
+    parser.add_argument("-f",
+                        dest="format",
+                        help="Input format (only harvest is supported)",
+                        metavar='FORMAT',
+                        default="harvest",
+                        type=str)
+
+    parser.add_argument("-n",
+                        dest="print_names",
+                        help="Print character names with the rates",
+                        action="store_true")
+
+    parser.add_argument("-x",
+                        dest="excluded_taxa",
+                        help="Comma-separated list of taxa to exclude (wildcards allowed)",
+                        metavar='EXCLUDED_TAXA',
+                        default="",
+                        type=str)
+
+    parser.add_argument("-i",
+                        dest="unknown",
+                        help="Symbol for unknown states, which are ignored",
+                        metavar='UNKNOWN',
+                        default=None,
+                        type=str)
+
+    parser.add_argument("-p",
+                        dest="processes",
+                        help="Number of worker processes",
+                        metavar='PROCESSES',
+                        default=1,
+                        type=int)
+
+    parser.add_argument("-s",
+                        dest="target_se",
+                        help="Estimate rates from sampled partner characters until every standard error is at most TARGET_SE",
+                        metavar='TARGET_SE',
+                        default=None,
+                        type=float)
+
+    parser.add_argument("-b",
+                        dest="budget",
+                        help="Estimate rates from at most BUDGET sampled partner characters",
+                        metavar='BUDGET',
+                        default=None,
+                        type=int)
+
+    parser.add_argument("-e",
+                        dest="se_file",
+                        help="Write the standard errors of sampled rates to SE_FILE",
+                        metavar='SE_FILE',
+                        default=None,
+                        type=str)
+
+    parser.add_argument("--seed",
+                        dest="seed",
+                        help="Random seed for sampling partner characters",
+                        metavar='SEED',
+                        default=None,
+                        type=int)
+
+    args = parser.parse_args()
+
+    if args.format != "harvest":
+        print("Unsupported input format %s." % args.format, file=sys.stderr)
+        exit(1)
+
+    try:
+        f = open(args.infile,"r")
+        infile = f.readlines()
+        f.close()
+    except FileNotFoundError:
+        print("Could not find file",args.infile)
+        quit()
+
+    excluded_taxa = [x for x in args.excluded_taxa.split(",") if x]
+    taxa, names, matrix = read_harvest(infile, args.unknown, excluded_taxa)
+    if args.target_se is None and args.budget is None:
+        rates = calculate_rates(matrix, args.processes)
+    else:
+        rates, se = sample_rates(matrix, args.target_se, args.budget, seed=args.seed)
+        if args.se_file:
+            with open(args.se_file, "w") as f:
+                f.writelines(format_rates(names, se, args.print_names))
+    sys.stdout.writelines(format_rates(names, rates, args.print_names))